@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Compare the vectorized vertical regridding of `plots.regrid_profiles` with
+the per-profile `np.interp`/`np.append` loop it replaced in `Plots.section`.
+
+usage: python benchmarks/bench_regrid.py [--profiles 1000 10000] [--levels 1500]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import plots  # noqa: E402
+
+
+def legacy_regrid(y, z, yi):
+    """The former loop of Plots.section, kept here as the reference."""
+    zi = np.array(([]))
+    for i in range(0, len(z)):
+        yy = np.ma.masked_array(y[i]).filled(np.nan)
+        zz = np.ma.masked_array(z[i]).filled(np.nan)
+        Z = np.interp(yi, yy, zz)
+        zi = np.append(zi, Z, axis=0)
+    return zi.reshape(len(z), len(yi))
+
+
+def synthetic_profiles(nprof, nlev, seed=0):
+    """Return CTD-like masked pressure and temperature arrays of varying depth."""
+    rng = np.random.default_rng(seed)
+    pres = np.tile(np.arange(nlev, dtype=float), (nprof, 1))
+    temp = 28.0 * np.exp(-pres / 400.0) + rng.normal(0, 0.05, pres.shape)
+    depth = rng.integers(nlev // 4, nlev, nprof)
+    mask = np.arange(nlev)[None, :] >= depth[:, None]
+    return np.ma.masked_array(pres, mask), np.ma.masked_array(temp, mask)
+
+
+def best_of(func, repeat):
+    """Return the best wall time of `repeat` calls and the last result."""
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--profiles', nargs='+', type=int, default=[1000, 10000])
+    parser.add_argument('--levels', type=int, default=1500)
+    parser.add_argument('--yinterp', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print('{:>9} {:>7} {:>12} {:>12} {:>8} {:>10}'.format(
+        'profiles', 'levels', 'loop [s]', 'vector [s]', 'speedup', 'max diff'))
+    for nprof in args.profiles:
+        y, z = synthetic_profiles(nprof, args.levels)
+        yi = np.arange(0, args.levels, args.yinterp, dtype=float)
+        t_loop, ref = best_of(lambda: legacy_regrid(y, z, yi), 1)
+        t_vec, new = best_of(lambda: plots.regrid_profiles(y, z, yi), args.repeat)
+        both = np.isfinite(ref) & np.isfinite(new)
+        print('{:>9} {:>7} {:>12.3f} {:>12.3f} {:>7.1f}x {:>10.2e}'.format(
+            nprof, args.levels, t_loop, t_vec, t_loop / t_vec,
+            np.max(np.abs(ref - new)[both])))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
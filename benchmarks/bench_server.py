@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Load test the render server of plots.py: requests per second and latency.
+
+The server is started with `plots.py --serve`, unless --url points to a
+running one. Client threads request profile figures of a sample file, the
+first request of each profile renders it and the following ones are
+answered from the figure cache.
+
+usage: python benchmarks/bench_server.py [--requests 200] [--clients 4] [--distinct 20]
+                                         [--jobs 1] [--url http://127.0.0.1:8765] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MAIN = os.path.join(ROOT, 'plots.py')
+PROFILE = 'netcdf/OS_PIRATA-FR31_XBT.nc -t XBT -p -k DEPTH TEMP DENS SVEL -l {0} {0}'
+
+
+class Client():
+    """A dashboard stand-in, requesting figures by command line."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def render(self, command):
+        """Return the status, the X-Cache header and the size of the answer to command."""
+        query = urllib.parse.urlencode({'args': command})
+        try:
+            with urllib.request.urlopen('{}/render?{}'.format(self.url, query)) as r:
+                return r.status, r.headers.get('X-Cache'), len(r.read())
+        except urllib.error.HTTPError as exc:
+            return exc.code, None, len(exc.read())
+
+    def stats(self):
+        with urllib.request.urlopen(self.url + '/stats') as r:
+            return json.load(r)
+
+
+def start_server(port, jobs, cache):
+    """Start plots.py --serve and return the process once it answers."""
+    env = dict(os.environ, MPLBACKEND='Agg')
+    proc = subprocess.Popen([sys.executable, MAIN, '--serve', str(port), '--jobs', str(jobs),
+                             '--serve-cache', str(cache)], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL)
+    client = Client('http://127.0.0.1:{}'.format(port))
+    for _ in range(300):
+        try:
+            client.stats()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError('the server did not start on port {}'.format(port))
+
+
+def load(client, commands, clients):
+    """Send every command from `clients` threads, return the latency and status of each."""
+    results = []
+    lock = threading.Lock()
+    queue = iter(commands)
+
+    def run():
+        while True:
+            with lock:
+                command = next(queue, None)
+            if command is None:
+                return
+            t0 = time.perf_counter()
+            status, cache, _ = client.render(command)
+            with lock:
+                results.append((time.perf_counter() - t0, status, cache))
+
+    threads = [threading.Thread(target=run) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=4, help='concurrent client threads')
+    parser.add_argument('--distinct', type=int, default=20,
+                        help='distinct profiles requested, up to 66, the others are cache hits')
+    parser.add_argument('--jobs', type=int, default=1, help='render workers of the server')
+    parser.add_argument('--cache', type=float, default=256, help='figure cache of the server in MB')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--url', help='load an already running server instead')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    proc = None
+    if args.url is None:
+        proc = start_server(args.port, args.jobs, args.cache)
+        args.url = 'http://127.0.0.1:{}'.format(args.port)
+    try:
+        client = Client(args.url)
+        commands = [PROFILE.format(1 + n % args.distinct) for n in range(args.requests)]
+        t0 = time.perf_counter()
+        results = load(client, commands, args.clients)
+        wall = time.perf_counter() - t0
+        stats = client.stats()
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    latencies = sorted(r[0] for r in results)
+    record = {'requests': len(results), 'clients': args.clients, 'jobs': args.jobs,
+              'errors': sum(1 for r in results if r[1] != 200),
+              'hits': sum(1 for r in results if r[2] == 'hit'),
+              'rate': round(len(results) / wall, 1),
+              'p50_ms': round(1000 * statistics.median(latencies), 1),
+              'p95_ms': round(1000 * latencies[int(0.95 * (len(latencies) - 1))], 1),
+              'max_ms': round(1000 * latencies[-1], 1), 'cache': stats}
+    if args.json:
+        print(json.dumps(record))
+    else:
+        print('{requests} requests, {clients} clients, {jobs} job(s): {rate:.1f} req/s, '
+              'p50 {p50_ms:.1f} ms, p95 {p95_ms:.1f} ms, max {max_ms:.1f} ms, '
+              '{hits} hits, {errors} errors'.format(**record))
+    return 1 if record['errors'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
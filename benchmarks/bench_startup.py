@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Measure the cold start of plots.py: `python plots.py --help` and a run
+plotting a single profile, each in a fresh interpreter.
+
+usage: python benchmarks/bench_startup.py [--repeat 5] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MAIN = os.path.join(ROOT, 'plots.py')
+PROFILE_ARGS = ['netcdf/OS_AMAZOMIX_CTD.nc', '-t', 'CTD', '-p', '-k', 'PRES', 'TEMP',
+                '-l', '101', '101', '--force']
+
+
+def timed_run(args):
+    """Run plots.py with args in a fresh interpreter, return the wall time."""
+    env = dict(os.environ, MPLBACKEND='Agg')
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, MAIN] + args, cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    return time.perf_counter() - t0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true',
+                        help='print one JSON record per case')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cases = {
+            'help': ['--help'],
+            'one-profile': PROFILE_ARGS + ['-o', tmpdir],
+        }
+        for name, case in cases.items():
+            # the first run warms the OS file cache, it is not recorded
+            timed_run(case)
+            times = [timed_run(case) for _ in range(args.repeat)]
+            record = {'case': name, 'repeat': args.repeat,
+                      'median_s': round(statistics.median(times), 4),
+                      'min_s': round(min(times), 4)}
+            if args.json:
+                print(json.dumps(record))
+            else:
+                print('{case:<12} median {median_s:.3f}s  min {min_s:.3f}s'.format(**record))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""
+Measure the throughput and peak memory of plots.py on synthetic datasets.
+
+Each case runs plots.py in a fresh interpreter on files written by
+tests/synthetic.py, and the results can be saved as JSON and compared with a
+previous run to catch regressions.
+
+usage: python benchmarks/bench_suite.py [--profiles 10000] [--levels 1000] [--samples 2000000]
+                                        [--cases profiles sections ...] [--output run.json]
+                                        [--compare baseline.json] [--tolerance 0.2]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from tests import synthetic  # noqa: E402
+
+SECTION = ['-t', 'CTD', '-s', '-k', 'PRES', 'TEMP', 'PSAL', '--xaxis', 'LATITUDE', '--yinterp', '5']
+SCATTER = ['-t', 'TSG', '--scatter', '-k', 'SSPS', 'SSTP']
+# name: dataset, plots.py arguments, what is counted in the throughput
+CASES = {
+    'profiles': ('ctd', ['-t', 'CTD', '-p', '-k', 'PRES', 'TEMP', 'PSAL', '-l', '1', '{render}'],
+                 'profiles'),
+    'overlay': ('ctd', ['-t', 'CTD', '--overlay', '--overlay-color', 'latitude',
+                        '-k', 'PRES', 'TEMP', 'PSAL'], 'profiles'),
+    'sections': ('ctd', SECTION + ['--yscale', '0', '1000'], 'profiles'),
+    'sections-split': ('ctd', SECTION + ['--yscale', '0', '250', '250', '1000'], 'profiles'),
+    'sections-xinterp': ('ctd', SECTION + ['--yscale', '0', '1000', '--xinterp', '200'],
+                         'profiles'),
+    'scatter-points': ('tsg', SCATTER + ['--scatter-mode', 'points'], 'samples'),
+    'scatter-mean': ('tsg', SCATTER + ['--scatter-mode', 'mean'], 'samples'),
+    'timeseries': ('mto', ['-t', 'MTO', '--timeseries', '-k', 'ATMS', 'DRYT', 'RELH', 'WMSP'],
+                   'samples'),
+}
+
+
+def peak_memory_mb():
+    """Return the peak resident memory of this process in MB, None when unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1048576.0 if sys.platform == 'darwin' else 1024.0)
+
+
+def child(argv, skip_coastlines=False):
+    """Run plots.main(argv) in this process and print its wall time and peak memory."""
+    import plots
+    if skip_coastlines:
+        # Natural Earth coastlines are downloaded on first use, not every machine can
+        plots.load_pyplot()
+        plots.MapCache.coastlines = lambda self, ax: plots.mpath.Path(np.empty((0, 2)))
+    t0 = time.perf_counter()
+    plots.main(argv)
+    wall = time.perf_counter() - t0
+    print(json.dumps({'wall_s': wall, 'peak_mb': peak_memory_mb()}))
+    return 0
+
+
+def run_case(argv, skip_coastlines):
+    """Run one case in a fresh interpreter, return its wall time and peak memory."""
+    cmd = [sys.executable, os.path.abspath(__file__), '--child']
+    if skip_coastlines:
+        cmd.append('--skip-coastlines')
+    env = dict(os.environ, MPLBACKEND='Agg')
+    out = subprocess.run(cmd + ['--'] + argv, cwd=ROOT, env=env, check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def dataset(kind, args):
+    """Return the path of the synthetic dataset for kind, writing it when missing."""
+    if kind == 'ctd':
+        name = 'OS_BENCH-{}x{}_CTD.nc'.format(args.profiles, args.levels)
+    else:
+        name = 'OS_BENCH-{}_{}.nc'.format(args.samples, kind.upper())
+    path = os.path.join(args.data_dir, name)
+    if not os.path.exists(path):
+        print('Writing', path, file=sys.stderr)
+        if kind == 'ctd':
+            synthetic.make_ctd(path, args.profiles, args.levels)
+        elif kind == 'tsg':
+            synthetic.make_tsg(path, args.samples)
+        else:
+            synthetic.make_mto(path, args.samples)
+    return path
+
+
+def environment():
+    """Describe the machine and the versions the results were measured with."""
+    import matplotlib
+    import numpy
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'python': platform.python_version(), 'numpy': numpy.__version__,
+            'matplotlib': matplotlib.__version__, 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'commit': commit,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def compare(results, baseline, tolerance):
+    """Print the ratios to a baseline run, return the names of regressed cases."""
+    before = {r['case']: r for r in baseline['results']}
+    regressions = []
+    print('\n{:<18} {:>10} {:>10} {:>8} {:>10}'.format(
+        'case', 'base [s]', 'now [s]', 'ratio', 'mem ratio'))
+    for record in results:
+        old = before.get(record['case'])
+        if old is None:
+            continue
+        ratio = record['wall_s'] / old['wall_s']
+        mem = (record['peak_mb'] / old['peak_mb']
+               if record['peak_mb'] and old['peak_mb'] else float('nan'))
+        flag = ''
+        if ratio > 1 + tolerance or mem > 1 + tolerance:
+            regressions.append(record['case'])
+            flag = '  REGRESSION'
+        print('{:<18} {:>10.3f} {:>10.3f} {:>8.2f} {:>10.2f}{}'.format(
+            record['case'], old['wall_s'], record['wall_s'], ratio, mem, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--profiles', type=int, default=10000,
+                        help='profiles of the synthetic CTD file')
+    parser.add_argument('--levels', type=int, default=1000,
+                        help='levels of the synthetic CTD file')
+    parser.add_argument('--samples', type=int, default=2000000,
+                        help='samples of the synthetic TSG and MTO files')
+    parser.add_argument('--render', type=int, default=20,
+                        help='profile figures rendered by the profiles case')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'plots-bench'),
+                        help='directory of the synthetic datasets, kept between runs')
+    parser.add_argument('--skip-coastlines', action='store_true',
+                        help='do not draw coastlines, for machines without Natural Earth data')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='compare with the JSON results of a previous run')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative slowdown or memory growth reported as a regression')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args, rest = parser.parse_known_args(argv)
+    if args.child:
+        return child([a for a in rest if a != '--'], args.skip_coastlines)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = []
+    print('{:<18} {:>10} {:>10} {:>14}'.format('case', 'wall [s]', 'peak [MB]', 'throughput'))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name in args.cases:
+            kind, case, unit = CASES[name]
+            path = dataset(kind, args)
+            case = [a.format(render=args.render) for a in case]
+            runs = [run_case([path] + case + ['-o', tmpdir, '--force'], args.skip_coastlines)
+                    for _ in range(args.repeat)]
+            wall = statistics.median(r['wall_s'] for r in runs)
+            peaks = [r['peak_mb'] for r in runs if r['peak_mb'] is not None]
+            items = {'profiles': args.render if name == 'profiles' else args.profiles,
+                     'samples': args.samples}[unit]
+            record = {'case': name, 'args': case, 'wall_s': round(wall, 4),
+                      'peak_mb': round(max(peaks), 1) if peaks else None,
+                      'items': items, 'unit': unit, 'rate': round(items / wall, 1)}
+            results.append(record)
+            print('{:<18} {:>10.3f} {:>10} {:>9.0f} {}/s'.format(
+                name, wall, record['peak_mb'], record['rate'], unit))
+
+    document = {'environment': environment(),
+                'sizes': {'profiles': args.profiles, 'levels': args.levels,
+                          'samples': args.samples, 'render': args.render},
+                'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('Regressions: {}'.format(', '.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""
+Write synthetic OceanSITES files, shaped like netcdf/OS_*_CTD.nc,
+netcdf/OS_*_TSG.nc and netcdf/OS_*_MTO.nc, with any number of profiles or
+samples.
+
+The writers live in tests/synthetic.py, shared with the tests.
+
+usage: python benchmarks/make_dataset.py ctd OS_BENCH_CTD.nc [--profiles 10000] [--levels 1000]
+       python benchmarks/make_dataset.py tsg OS_BENCH_TSG.nc [--samples 2000000]
+       python benchmarks/make_dataset.py mto OS_BENCH_MTO.nc [--samples 2000000]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tests.synthetic import make_ctd, make_mto, make_tsg  # noqa: E402
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('kind', choices=['ctd', 'tsg', 'mto'])
+    parser.add_argument('path', help='NetCDF file to write')
+    parser.add_argument('--profiles', type=int, default=10000)
+    parser.add_argument('--levels', type=int, default=1000)
+    parser.add_argument('--samples', type=int, default=2000000)
+    parser.add_argument('--format', default='NETCDF3_64BIT_OFFSET',
+                        choices=['NETCDF3_CLASSIC', 'NETCDF3_64BIT_OFFSET', 'NETCDF4_CLASSIC'])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.kind == 'ctd':
+        make_ctd(args.path, args.profiles, args.levels, fmt=args.format, seed=args.seed)
+    elif args.kind == 'tsg':
+        make_tsg(args.path, args.samples, fmt=args.format, seed=args.seed)
+    else:
+        make_mto(args.path, args.samples, fmt=args.format, seed=args.seed)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
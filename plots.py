@@ -1,13 +1,15 @@
 #!/usr/bin/env python
 """
-Plot OceanSITES NetCDF data as profiles, sections and surface scatters.
+Plot OceanSITES NetCDF data as profiles, sections, surface scatters and time series.
 
 The module configures the matplotlib backend before importing `pyplot`.
 This keeps batch generation reliable on Linux and Windows by defaulting to
 the non-interactive `Agg` backend, while still allowing interactive display
 with `--screen` when a GUI backend such as Qt is available.
+
+matplotlib, netCDF4, cartopy and scipy are imported when a plotting mode
+first needs them, which keeps `--help` and argument errors fast.
 """
-from netCDF4 import Dataset
 import logging
 import argparse
 import textwrap
@@ -15,10 +17,27 @@ import os
 import sys
 import re
 import math
-from datetime import datetime, timedelta
+import json
+import io
+import hashlib
+import shlex
+import glob
+import mmap
+import struct
+import time
+import tracemalloc
+import multiprocessing
+import threading
+import warnings
+import zipfile
+import tarfile
+import collections
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 import numpy as np
-from scipy.interpolate import griddata
-import matplotlib
 
 # Holds a one-line fallback message when interactive display requested by the
 # user cannot be enabled and matplotlib falls back to a non-interactive backend.
@@ -45,6 +64,7 @@ def select_matplotlib_backend(argv=None, env=None):
 def configure_matplotlib_backend(argv=None, env=None):
     """Configure matplotlib before importing pyplot."""
     global BACKEND_WARNING
+    import matplotlib
     env = os.environ if env is None else env
     backend = select_matplotlib_backend(argv, env)
     env['MPLBACKEND'] = backend
@@ -63,23 +83,124 @@ def configure_matplotlib_backend(argv=None, env=None):
             raise
 
 
-configure_matplotlib_backend()
-
-# pyplot must be imported only after the backend has been selected.
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from matplotlib import gridspec
-from cartopy.mpl.ticker import LongitudeFormatter, LatitudeFormatter
-import cartopy.crs as ccrs
+# Heavy modules are imported on first use only, so that --help, argument
+# validation and profile-only runs do not pay for cartopy and scipy.
+plt = None
+mdates = None
+gridspec = None
+mimage = None
+mcontour = None
+mpath = None
+mcollections = None
+ccrs = None
+LongitudeFormatter = None
+LatitudeFormatter = None
+
+
+def load_pyplot(argv=None):
+    """Select the matplotlib backend then import pyplot, on first call only."""
+    global plt, mdates, gridspec, mimage, mcontour, mpath, mcollections
+    if plt is None:
+        configure_matplotlib_backend(argv)
+        # pyplot must be imported only after the backend has been selected.
+        import matplotlib.pyplot as plt
+        import matplotlib.dates as mdates
+        import matplotlib.image as mimage
+        import matplotlib.contour as mcontour
+        import matplotlib.path as mpath
+        import matplotlib.collections as mcollections
+        from matplotlib import gridspec
+    return plt
+
+
+def load_cartopy():
+    """Import the cartopy projections and map formatters, on first call only."""
+    global ccrs, LongitudeFormatter, LatitudeFormatter
+    if ccrs is None:
+        from cartopy.mpl.ticker import LongitudeFormatter, LatitudeFormatter
+        import cartopy.crs as ccrs
+    return ccrs
+
+
+def open_dataset(file, reader='netcdf4'):
+    """Open a NetCDF file read-only, importing netCDF4 on first use.
+
+    A list of files is opened as a single `MultiDataset`. With the `mmap`
+    reader, classic and 64-bit offset files are memory mapped by
+    `ClassicDataset`, other formats are still read by netCDF4.
+    """
+    if not isinstance(file, str):
+        return MultiDataset([open_dataset(f, reader) for f in file])
+    if reader == 'mmap':
+        try:
+            return ClassicDataset(file)
+        except ValueError:
+            logging.debug('%s is not a classic NetCDF file, read by netCDF4', file)
+    from netCDF4 import Dataset
+    return Dataset(file, mode='r')
+
+
+def read_float(var, index=slice(None)):
+    """Return var[index] as floats, with NaN in place of missing values."""
+    if isinstance(var, ClassicVariable):
+        return var.read_float(index)
+    return np.ma.filled(np.ma.asarray(var[index], dtype=float), np.nan)
+
+
+def file_list(file):
+    """Return the list of files behind a file argument, a path or a list of paths."""
+    return [file] if isinstance(file, str) else list(file)
+
+
+def expand_files(patterns):
+    """Expand the glob patterns among patterns, keeping the order of the arguments.
+
+    Shells such as cmd.exe do not expand wildcards, so patterns are matched
+    here, sorted by name. Files given more than once are kept once.
+    Raise ValueError when a pattern matches no file.
+    """
+    files = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise ValueError('no file matches {}'.format(pattern))
+        else:
+            matches = [pattern]
+        files += [f for f in matches if f not in files]
+    return files
 
 CNES_EPOCH = datetime(1950, 1, 1)
 DEGREE = u"\u00B0"  # u"\N{DEGREE SIGN}"
 DEFAULT_COLORS = ['k-', 'b-', 'r-', 'm-', 'g-']
 DEFAULT_DIMS = ['TIME', 'LATITUDE', 'LONGITUDE']
+# sidecar manifest of the render cache, written in each output directory
+RENDER_CACHE_NAME = '.plots-cache.json'
+# default directory and size budget, in MB, of the gridded section cache
+GRID_CACHE_NAME = '.plots-grids'
+DEFAULT_GRID_CACHE_BUDGET = 512
+# projected coastlines of the scatter maps, size in MB
+MAP_CACHE_NAME = '.plots-maps'
+DEFAULT_MAP_CACHE_BUDGET = 64
+# default memory budget of the in-memory profile store, in MB
+DEFAULT_STORE_BUDGET = 1024
+# default number of samples read at a time from trajectory datasets
+DEFAULT_TRACK_CHUNK = 1000000
+# image formats of the figures, contour fills and markers are rasterized in vector ones
+OUTPUT_FORMATS = ['png', 'webp', 'jpg', 'pdf', 'svg']
+VECTOR_FORMATS = ('pdf', 'svg')
+# images rendered but not yet written by the background writer
+ASYNC_WRITE_DEPTH = 2
+# render server, memory budget of its figure cache in MB
+DEFAULT_SERVE_PORT = 8765
+DEFAULT_SERVE_CACHE = 256
+CONTENT_TYPES = {'png': 'image/png', 'webp': 'image/webp', 'jpg': 'image/jpeg',
+                 'pdf': 'application/pdf', 'svg': 'image/svg+xml'}
 DEFAULT_OUTPUT_PATHS = {
     'profiles': 'plots/profiles',
     'sections': 'plots/sections',
     'scatters': 'plots/scatters',
+    'timeseries': 'plots/timeseries',
 }
 
 
@@ -114,6 +235,59 @@ def dt2julian(dt):
     return (dt - CNES_EPOCH).total_seconds() / 86400.0
 
 
+def julian2datetime64(jd):
+    """Convert an array of CNES julian days to datetime64[us], NaT where missing.
+
+    Whole days and the fraction of day are converted separately, the result
+    is rounded to the microsecond like `julian2dt`.
+    """
+    jd = np.ma.filled(np.ma.asarray(jd, dtype=float), np.nan)
+    valid = np.isfinite(jd)
+    jd = np.where(valid, jd, 0.0)
+    days = np.floor(jd)
+    us = np.rint((jd - days) * 86400e6)
+    t = (np.datetime64(CNES_EPOCH, 'us') + days.astype(np.int64).astype('timedelta64[D]')
+         + us.astype(np.int64).astype('timedelta64[us]'))
+    return np.where(valid, t, np.datetime64('NaT'))
+
+
+def datetime642julian(t):
+    """Convert datetime64 values to CNES julian days, NaN for NaT."""
+    us = (np.asarray(t, dtype='datetime64[us]') - np.datetime64(CNES_EPOCH, 'us'))
+    jd = us.astype(np.int64) / 86400e6
+    return np.where(np.isnat(us), np.nan, jd)
+
+
+def julian2num(jd):
+    """Convert CNES julian days to matplotlib date numbers, for date axes."""
+    return mdates.date2num(julian2datetime64(jd))
+
+
+def format_julian(jd):
+    """Format CNES julian days as `str(julian2dt(jd))` does, for an array."""
+    t = julian2datetime64(jd)
+    text = np.char.replace(np.datetime_as_string(t, unit='us'), 'T', ' ')
+    # like datetime, microseconds are only shown when not zero
+    text = np.where(np.char.endswith(text, '.000000'), text.astype('U19'), text)
+    return np.where(np.isnat(t), 'NaT', text)
+
+
+def parse_time(value):
+    """Convert an ISO 8601 date or a number of CNES julian days to CNES julian days."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'invalid date: {!r}, expected YYYY-MM-DD[THH:MM:SS] or julian days'.format(value))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt2julian(dt)
+
+
 def get_cycle_label(nc):
     """Return a cruise/cycle label from the dataset attributes or filename."""
     if 'cycle_mesure' in nc.ncattrs():
@@ -148,21 +322,1483 @@ def Dec2dms(position, hemi):
             intg, DEGREE, min + sec/100*60, geo)
     return str
 
+# interpolate profiles on y axis
+def regrid_profiles(y, z, yi, out=None, block=512):
+    """Linearly interpolate every profile z(y) onto the common levels yi.
+
+    Profiles are rows of the 2-D arrays y and z. Masked or NaN levels are
+    dropped and each profile is sorted by y, so non-monotonic pressure is
+    handled. Like `np.interp`, values outside a profile are clamped to its
+    first and last valid levels, unless the profile was cut short by
+    masked levels on that side, where NaN is returned instead of inventing
+    data. Profiles without valid levels give NaN.
+    Rows are processed `block` at a time to bound temporary memory, and the
+    result is written into `out`, of shape (len(y), len(yi)), if given.
+    z may also stack several variables sharing y, as (nvar, nprof, nlev),
+    regridded into (nvar, nprof, len(yi)). When the variables are missing
+    on the same levels, the level search and weights are shared by all.
+    """
+    y = np.ma.filled(np.ma.asarray(y, dtype=float), np.nan)
+    z = np.ma.filled(np.ma.asarray(z, dtype=float), np.nan)
+    yi = np.asarray(yi, dtype=float)
+    if z.ndim == 3:
+        nvar = z.shape[0]
+        if out is None:
+            out = np.empty((nvar, y.shape[0], len(yi)))
+        finite = np.isfinite(z)
+        if not (finite == finite[0]).all():
+            # each variable has its own valid levels, regrid them as extra rows
+            regrid_profiles(np.tile(y, (nvar, 1)), z.reshape(-1, z.shape[2]), yi,
+                            out.reshape(-1, len(yi)), block)
+            return out
+        stacked = z
+    else:
+        if out is None:
+            out = np.empty((y.shape[0], len(yi)))
+        stacked = z[None]
+    out3 = out.reshape(stacked.shape[0], y.shape[0], len(yi))
+    nprof, nlev = y.shape
+    if nprof == 0 or nlev == 0:
+        out[:] = np.nan
+        return out
+
+    valid = np.isfinite(y) & np.isfinite(stacked[0])
+    if not valid.any():
+        out[:] = np.nan
+        return out
+    lo = min(np.min(y[valid]), np.min(yi))
+    hi = max(np.max(y[valid]), np.max(yi))
+    # rows are shifted by `span` so that one searchsorted call serves them all
+    span = hi - lo + 1.0
+    for r0 in range(0, nprof, block):
+        r1 = min(r0 + block, nprof)
+        rows = np.arange(r1 - r0)[:, None]
+        ok = valid[r0:r1]
+        n = ok.sum(axis=1)
+        # profiles starting or ending with masked levels are not extrapolated
+        short_top = ~ok[:, 0]
+        short_bottom = ~ok[:, -1]
+        # invalid levels are set to hi, they sort last and are never used
+        ys = np.where(ok, y[r0:r1], hi)
+        zs = stacked[:, r0:r1]
+        # sorting is skipped for the usual monotonic profiles
+        if not np.all(ys[:, 1:] >= ys[:, :-1]):
+            order = np.argsort(ys, axis=1, kind='stable')
+            ys = np.take_along_axis(ys, order, axis=1)
+            zs = np.take_along_axis(zs, order[None], axis=2)
+
+        flat = (ys - lo + rows * span).ravel()
+        query = (yi[None, :] - lo + rows * span).ravel()
+        j = np.searchsorted(flat, query, side='right').reshape(r1 - r0, -1)
+        j -= rows * nlev
+        last = np.maximum(n - 1, 0)[:, None]
+        i0 = np.clip(j - 1, 0, last)
+        i1 = np.clip(j, 0, last)
+
+        x0 = np.take_along_axis(ys, i0, axis=1)
+        x1 = np.take_along_axis(ys, i1, axis=1)
+        z0 = np.take_along_axis(zs, i0[None], axis=2)
+        z1 = np.take_along_axis(zs, i1[None], axis=2)
+        dx = x1 - x0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            w = np.where(dx > 0, (yi[None, :] - x0) / dx, 0.0)
+        w = np.clip(w, 0.0, 1.0)
+        block_out = out3[:, r0:r1]
+        np.multiply(z1 - z0, w, out=block_out)
+        block_out += z0
+        first = ys[:, :1]
+        bottom = np.take_along_axis(ys, last, axis=1)
+        block_out[:, short_top[:, None] & (yi[None, :] < first)] = np.nan
+        block_out[:, short_bottom[:, None] & (yi[None, :] > bottom)] = np.nan
+        block_out[:, n == 0] = np.nan
+    return out
+
+
 # interpolate data on x axis
-def interpx(xinterp, x, xi, yi, zi):
-    """Interpolate an already vertically-gridded section on the horizontal axis."""
-    xx, yy = np.meshgrid(xi, yi, indexing='ij')
-    xi = np.linspace(x[0], x[-1], xinterp)
-    zi = griddata((xx.ravel(), yy.ravel()), zi.ravel(),
-                    (xi[None, :], yi[:, None]))
-    return (xi,zi)
+def interpx(xinterp, x, xi, yi, zi, method='linear', max_gap=None):
+    """Interpolate an already vertically-gridded section on the horizontal axis.
+
+    zi holds one row per profile, located at xi, and one column per level of
+    yi. It is resampled on `xinterp` points between x[0] and x[-1] and
+    returned transposed, as (len(yi), xinterp), ready for contouring.
+
+    `linear` interpolates each level between the two neighbouring profiles,
+    using the regular structure of the grid, and gives NaN next to missing
+    values. `gap` skips missing values and bridges them with the nearest
+    valid profiles on each side, unless they are more than `max_gap` x units
+    apart. `griddata` is the former Delaunay based interpolation, kept for
+    comparison.
+    """
+    xn = np.linspace(x[0], x[-1], xinterp)
+    if method == 'griddata':
+        from scipy.interpolate import griddata
+        xx, yy = np.meshgrid(xi, yi, indexing='ij')
+        zi = griddata((xx.ravel(), yy.ravel()), zi.ravel(),
+                      (xn[None, :], yi[:, None]))
+        return (xn, zi)
+
+    xs = np.asarray(xi, dtype=float)
+    zs = np.asarray(zi, dtype=float)
+    if len(xs) < 2:
+        return (xn, np.repeat(zs.T, xinterp, axis=1))
+    if xs[0] > xs[-1]:
+        xs = xs[::-1]
+        zs = zs[::-1]
+    nbxi = len(xs)
+    # left neighbour of each new point and its weight, shared by all levels
+    j = np.clip(np.searchsorted(xs, xn, side='right') - 1, 0, nbxi - 2)
+
+    if method == 'linear':
+        w = np.clip((xn - xs[j]) / (xs[j + 1] - xs[j]), 0.0, 1.0)[:, None]
+        left = zs[j]
+        right = zs[j + 1]
+        with np.errstate(invalid='ignore'):
+            out = np.where(w == 0, left, np.where(w == 1, right, left + w * (right - left)))
+        return (xn, out.T)
+
+    if method == 'gap':
+        valid = np.isfinite(zs)
+        col = np.arange(nbxi)[:, None]
+        # nearest valid profile at or before / at or after each column, per level
+        prev = np.maximum.accumulate(np.where(valid, col, -1), axis=0)
+        nxt = np.minimum.accumulate(np.where(valid, col, nbxi)[::-1], axis=0)[::-1]
+        il = prev[j]
+        ir = nxt[j + 1]
+        found = (il >= 0) & (ir < nbxi)
+        il = np.clip(il, 0, nbxi - 1)
+        ir = np.clip(ir, 0, nbxi - 1)
+        x0 = xs[il]
+        x1 = xs[ir]
+        z0 = np.take_along_axis(zs, il, axis=0)
+        z1 = np.take_along_axis(zs, ir, axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out = z0 + (xn[:, None] - x0) / (x1 - x0) * (z1 - z0)
+        out[~found] = np.nan
+        if max_gap is not None:
+            out[x1 - x0 > max_gap] = np.nan
+        # new points falling on a valid profile keep its value
+        on_left = (xn == xs[j])[:, None] & valid[j]
+        on_right = (xn == xs[j + 1])[:, None] & valid[j + 1]
+        out = np.where(on_left, zs[j], np.where(on_right, zs[j + 1], out))
+        return (xn, out.T)
+
+    raise ValueError('unknown horizontal interpolation method: {}'.format(method))
+
+
+# section contours
+class SectionContours():
+    """Contour geometry of a gridded section, traced once for all its panels.
+
+    Each `Axes.contourf` or `Axes.contour` call sets up its own contour
+    generator and traces the whole grid, so a section split in two panels
+    was traced six times. Here one generator, set up like the one of
+    matplotlib, traces each filled band and each isoline once, on first
+    request, and a sublevel equal to a level reuses its isolines.
+    `contour_set` gives a panel only the polygons and lines crossing its
+    y range, the others being hidden by the axes anyway.
+    """
+    def __init__(self, xi, yi, zi):
+        import contourpy
+        z = np.ma.masked_invalid(zi, copy=False)
+        x, y = np.meshgrid(np.asarray(xi, dtype=np.float64), np.asarray(yi, dtype=np.float64))
+        # the data limits and lowest value that matplotlib derives from the grid
+        self.limits = [(np.ma.min(x), np.ma.min(y)), (np.ma.max(x), np.ma.max(y))]
+        self.zmin = z.min().astype(float)
+        self.generator = contourpy.contour_generator(
+            x, y, z, name=plt.rcParams['contour.algorithm'],
+            corner_mask=plt.rcParams['contour.corner_mask'],
+            line_type=contourpy.LineType.SeparateCode,
+            fill_type=contourpy.FillType.OuterCode)
+        self._bands = {}
+        self._lines = {}
+
+    @staticmethod
+    def _parts(vertices, codes):
+        """Pair each polygon or line with its y range."""
+        return [(v, c, v[:, 1].min(), v[:, 1].max()) for v, c in zip(vertices, codes)]
+
+    def band(self, lower, upper):
+        """Return the polygons filled between lower and upper."""
+        if (lower, upper) not in self._bands:
+            self._bands[lower, upper] = self._parts(*self.generator.filled(lower, upper))
+        return self._bands[lower, upper]
+
+    def isoline(self, level):
+        """Return the lines of level."""
+        if level not in self._lines:
+            self._lines[level] = self._parts(*self.generator.lines(level))
+        return self._lines[level]
+
+    def contour_set(self, ax, levels, filled=False, **kwargs):
+        """Add to ax the contours of levels crossing its y range, like contour or contourf.
+
+        kwargs are those of `Axes.contour`. Return the ContourSet.
+        """
+        levels = np.asarray(levels, dtype=np.float64)
+        if filled:
+            lowers = levels[:-1].copy()
+            # as matplotlib, include the lowest value in the lowest band
+            if self.zmin == lowers[0]:
+                lowers[0] -= 1
+            sets = [self.band(lo, up) for lo, up in zip(lowers, levels[1:])]
+        else:
+            sets = [self.isoline(level) for level in levels]
+        bottom, top = sorted(ax.get_ylim())
+        allsegs, allkinds = [], []
+        for parts in sets:
+            inside = [(v, c) for v, c, y0, y1 in parts if y1 >= bottom and y0 <= top]
+            if inside:
+                allsegs.append([np.concatenate([v for v, _ in inside])])
+                allkinds.append([np.concatenate([c for _, c in inside])])
+            else:
+                allsegs.append([np.empty((0, 2))])
+                allkinds.append([None])
+        if not any(len(segs[0]) for segs in allsegs):
+            # ContourSet needs a point for its limits, a lone move draws nothing
+            allsegs[0] = [np.array(self.limits[:1])]
+            allkinds[0] = [np.array([1], dtype=np.uint8)]
+        cs = mcontour.ContourSet(ax, levels, allsegs, allkinds, filled=filled, **kwargs)
+        # limits and sticky edges of the whole grid, as contourf sets them
+        (x0, y0), (x1, y1) = self.limits
+        cs.sticky_edges.x[:] = [x0, x1]
+        cs.sticky_edges.y[:] = [y0, y1]
+        ax.update_datalim(self.limits)
+        ax.autoscale_view(tight=True)
+        return cs
+
+
+# aggregate surface samples
+def _track_cells(lon, lat, extent, shape):
+    """Return the flat raster cell of each sample and the valid sample mask.
+
+    Cells are regular in longitude and in Mercator y, so that they are
+    square on the Mercator maps drawn by `Plots.scatters`.
+    """
+    lon = np.ma.filled(np.ma.asarray(lon, dtype=float), np.nan)
+    lat = np.ma.filled(np.ma.asarray(lat, dtype=float), np.nan)
+    ny, nx = shape
+    x1, x2, y1, y2 = [float(v) for v in extent]
+    my1, my2 = mercator_y(y1), mercator_y(y2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ix = np.floor((lon - x1) / ((x2 - x1) or 1.0) * nx)
+        iy = np.floor((mercator_y(lat) - my1) / ((my2 - my1) or 1.0) * ny)
+    valid = np.isfinite(ix) & np.isfinite(iy)
+    ix = np.clip(np.nan_to_num(ix), 0, nx - 1).astype(np.int64)
+    iy = np.clip(np.nan_to_num(iy), 0, ny - 1).astype(np.int64)
+    return iy * nx + ix, valid
+
+
+def mercator_y(lat):
+    """Return the Mercator ordinate of latitudes given in degrees."""
+    return np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def aggregate_track(lon, lat, values, extent, shape, how='mean'):
+    """Bin samples into a (ny, nx) raster covering extent [x1, x2, y1, y2].
+
+    how is `mean`, `median` or `last`, the last sample in record order.
+    Return the longitude and latitude cell edges and the masked raster,
+    ready for `pcolormesh`.
+    """
+    raster = TrackRaster(extent, shape, how)
+    raster.add(lon, lat, values)
+    return raster.result()
+
+
+class TrackRaster():
+    """Accumulate track samples into a raster chunk by chunk, see `aggregate_track`.
+
+    `mean` and `last` only keep per-cell state. `median` needs every binned
+    value of the variable until `result()` is called.
+    """
+    def __init__(self, extent, shape, how='mean'):
+        if how not in ('mean', 'median', 'last'):
+            raise ValueError('unknown aggregation: {}'.format(how))
+        self.extent = [float(v) for v in extent]
+        self.shape = shape
+        self.how = how
+        size = shape[0] * shape[1]
+        self.count = np.zeros(size, dtype=np.int64)
+        self.total = np.zeros(size)
+        self.grid = np.full(size, np.nan)
+        self.cells = []
+        self.values = []
+
+    def add(self, lon, lat, values):
+        """Bin one chunk of samples, in record order."""
+        size = self.grid.size
+        cells, valid = _track_cells(lon, lat, self.extent, self.shape)
+        values = np.ma.filled(np.ma.asarray(values, dtype=float), np.nan)
+        valid &= np.isfinite(values)
+        cells = cells[valid]
+        values = values[valid]
+        if self.how == 'mean':
+            self.count += np.bincount(cells, minlength=size)
+            self.total += np.bincount(cells, weights=values, minlength=size)
+        elif self.how == 'median':
+            self.cells.append(cells)
+            self.values.append(values)
+        else:
+            uniq, first = np.unique(cells[::-1], return_index=True)
+            self.grid[uniq] = values[::-1][first]
+
+    def result(self):
+        """Return the longitude and latitude cell edges and the masked raster."""
+        grid = self.grid.copy()
+        if self.how == 'mean':
+            filled = self.count > 0
+            grid[filled] = self.total[filled] / self.count[filled]
+        elif self.how == 'median' and self.cells:
+            cells = np.concatenate(self.cells)
+            values = np.concatenate(self.values)
+            order = np.lexsort((values, cells))
+            cells = cells[order]
+            values = values[order]
+            uniq, first, count = np.unique(cells, return_index=True, return_counts=True)
+            grid[uniq] = 0.5 * (values[first + (count - 1) // 2] + values[first + count // 2])
+
+        ny, nx = self.shape
+        x1, x2, y1, y2 = self.extent
+        lon_edges = np.linspace(x1, x2, nx + 1)
+        lat_edges = np.degrees(2 * np.arctan(np.exp(
+            np.linspace(mercator_y(y1), mercator_y(y2), ny + 1))) - np.pi / 2)
+        return lon_edges, lat_edges, np.ma.masked_invalid(grid.reshape(ny, nx))
+
+
+def thin_track(lon, lat, extent, shape, previous=None):
+    """Return the indices of the samples starting a new raster cell along track.
+
+    previous is the cell of the last valid sample of the preceding chunk,
+    when the track is thinned chunk by chunk. Return the indices and the cell
+    of the last valid sample of this chunk.
+    """
+    cells, valid = _track_cells(lon, lat, extent, shape)
+    index = np.flatnonzero(valid)
+    cells = cells[index]
+    keep = np.ones(len(cells), dtype=bool)
+    keep[1:] = cells[1:] != cells[:-1]
+    if previous is not None and len(cells):
+        keep[0] = cells[0] != previous
+    last = cells[-1] if len(cells) else previous
+    return index[keep], last
+
+
+# class SeriesBins
+class SeriesBins():
+    """Reduce a time series to the samples drawn in each pixel column of its panel.
+
+    The first, last, minimum and maximum sample of each of `width` columns
+    over [t0, t1] are kept (M4 downsampling): a line through them covers
+    the same pixels as a line through all the samples, so spikes and depth
+    minima survive while the line has at most 4 vertices per column.
+    Samples are added chunk by chunk, in any order.
+    """
+    def __init__(self, t0, t1, width):
+        self.t0 = t0
+        self.width = width
+        self.scale = width / (t1 - t0) if t1 > t0 else 0.0
+        # time and value of the first, last, minimum and maximum sample of each column
+        self.t = np.full((4, width), np.nan)
+        self.v = np.full((4, width), np.nan)
+        self.count = 0
+
+    def add(self, time, values):
+        """Add the samples of a chunk, NaN times or values are skipped."""
+        valid = np.isfinite(time) & np.isfinite(values)
+        time = time[valid]
+        values = values[valid]
+        if not len(time):
+            return
+        self.count += len(time)
+        if np.any(time[1:] < time[:-1]):
+            order = np.argsort(time, kind='stable')
+            time = time[order]
+            values = values[order]
+        # samples are in time order, so each column is a run of samples
+        cols = np.clip(((time - self.t0) * self.scale).astype(int), 0, self.width - 1)
+        starts = np.r_[0, np.flatnonzero(np.diff(cols)) + 1]
+        lengths = np.diff(np.r_[starts, len(cols)])
+        picks = [starts, starts + lengths - 1]
+        for reduce in (np.minimum, np.maximum):
+            at = np.flatnonzero(values == np.repeat(reduce.reduceat(values, starts), lengths))
+            # the first sample of each column reaching its extreme
+            picks.append(at[np.r_[0, np.flatnonzero(np.diff(cols[at])) + 1]])
+        col = cols[starts]
+        for row, (pick, better) in enumerate(zip(picks, (np.less, np.greater) * 2)):
+            kept = self.t if row < 2 else self.v
+            key = time if row < 2 else values
+            new = np.isnan(kept[row, col]) | better(key[pick], kept[row, col])
+            self.t[row, col[new]] = time[pick[new]]
+            self.v[row, col[new]] = values[pick[new]]
+
+    def result(self):
+        """Return the times and values of the kept samples, in time order.
+
+        When there are more samples than columns, an empty column between two
+        others is a gap of the record, and breaks the line with a NaN.
+        """
+        cols = np.flatnonzero(np.isfinite(self.t[0]))
+        t = self.t[:, cols].T
+        v = self.v[:, cols].T
+        order = np.argsort(t, axis=1, kind='stable')
+        t = np.take_along_axis(t, order, axis=1)
+        v = np.take_along_axis(v, order, axis=1)
+        keep = np.ones((len(cols), 5), dtype=bool)
+        # the same sample may be the first, last, minimum and maximum of its column
+        keep[:, 1:4] = (t[:, 1:] != t[:, :-1]) | (v[:, 1:] != v[:, :-1])
+        keep[:, 4] = False
+        if self.count > self.width:
+            keep[:-1, 4] = np.diff(cols) > 1
+        gap = np.full((len(cols), 1), np.nan)
+        return np.hstack([t, gap])[keep], np.hstack([v, gap])[keep]
+
+
+def input_digest(*parts):
+    """Return a SHA-256 digest of the arrays and parameters a figure is made of.
+
+    Arrays are hashed as float64 values with masked elements set to NaN, so
+    the digest does not depend on what lies under a mask. Other parts are
+    hashed through their JSON representation.
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray) or np.isscalar(part) and not isinstance(part, str):
+            data = np.ma.filled(np.ma.asarray(part, dtype=float), np.nan)
+            h.update(str(data.shape).encode())
+            h.update(np.ascontiguousarray(data).tobytes())
+        else:
+            h.update(json.dumps(part, sort_keys=True, default=_json_default).encode())
+    return h.hexdigest()
+
+
+def _json_default(obj):
+    """Serialize numpy values found in rendering parameters."""
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    return str(obj)
+
+
+# class Timings
+class _Stage():
+    """Time one stage of a `Timings` instance, as a context manager.
+
+    Stages may be nested, the time and peak memory of inner stages are then
+    reported by the inner stages only, not by the enclosing one as well.
+    """
+    __slots__ = ('timings', 'name', 'figure', 't0', 'inner', 'peak')
+
+    def __init__(self, timings, name, figure):
+        self.timings = timings
+        self.name = name
+        self.figure = figure
+        self.inner = 0.0
+        self.peak = 0
+
+    def __enter__(self):
+        stack = self.timings._stack
+        if self.timings.memory:
+            if stack:
+                # keep the peak of the enclosing stage before it is reset
+                stack[-1].peak = max(stack[-1].peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        stack.append(self)
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.t0
+        stack = self.timings._stack
+        stack.pop()
+        extra = {}
+        if self.timings.memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            extra['peak_mb'] = round(self.peak / 1048576, 3)
+        if stack:
+            stack[-1].inner += elapsed
+            stack[-1].peak = max(stack[-1].peak, self.peak)
+        self.timings.record(self.name, self.figure, elapsed - self.inner, **extra)
+        return False
+
+
+class _NoStage():
+    """Stand-in for `_Stage` when timings are disabled."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+class Timings():
+    """Time the named stages of a run, per figure, and hand records to hooks.
+
+    Stages are open, read, regrid, interp, draw, contour, encode and write.
+    Each record is a dict with the file, figure (None for work shared by
+    several figures), stage and seconds, plus the peak memory allocated
+    during the stage in MB when `memory` is set, traced with tracemalloc.
+    Hooks are callables receiving every record as it is made. A disabled
+    instance only costs a method call per stage.
+    """
+    def __init__(self, enabled=True, memory=False, hooks=(), label=None):
+        self.enabled = enabled
+        self.memory = enabled and memory
+        self.hooks = list(hooks)
+        self.label = label
+        self.records = []
+        self._stack = []
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def add_hook(self, hook):
+        """Call hook(record) for every record made from now on."""
+        self.hooks.append(hook)
+
+    def stage(self, name, figure=None):
+        """Return a context manager timing the stage `name` of `figure`."""
+        if not self.enabled:
+            return _NO_STAGE
+        return _Stage(self, name, figure)
+
+    def record(self, name, figure, seconds, **extra):
+        """Emit the record of a stage timed by the caller, such as another thread."""
+        if self.enabled:
+            self.emit(dict({'file': self.label, 'figure': figure, 'stage': name,
+                            'seconds': round(seconds, 6)}, **extra))
+
+    def emit(self, record):
+        """Keep a record and hand it to the hooks."""
+        self.records.append(record)
+        for hook in self.hooks:
+            hook(record)
+
+    def extend(self, records):
+        """Emit records made elsewhere, such as in pool workers."""
+        for record in records:
+            self.emit(record)
+
+    def take_records(self):
+        """Return and forget the records made so far."""
+        records, self.records = self.records, []
+        return records
+
+    def summary(self, slowest=5, wall=None):
+        """Return a table of the time spent per stage and the slowest figures.
+
+        wall is the wall time of the whole run, in seconds, when known.
+        """
+        stages = {}
+        figures = {}
+        for r in self.records:
+            total, count, peak = stages.get(r['stage'], (0.0, 0, None))
+            if 'peak_mb' in r:
+                peak = max(peak or 0.0, r['peak_mb'])
+            stages[r['stage']] = (total + r['seconds'], count + 1, peak)
+            if r['figure'] is not None:
+                figures[r['figure']] = figures.get(r['figure'], 0.0) + r['seconds']
+        run = sum(total for total, _, _ in stages.values()) or 1.0
+        lines = ['{:<10} {:>10} {:>7} {:>7} {:>10}'.format(
+            'stage', 'time [s]', 'share', 'count', 'peak [MB]')]
+        for name, (total, count, peak) in sorted(stages.items(), key=lambda i: -i[1][0]):
+            lines.append('{:<10} {:>10.3f} {:>6.1f}% {:>7} {:>10}'.format(
+                name, total, 100 * total / run, count, '' if peak is None else peak))
+        lines.append('{} figure(s), {:.3f}s in timed stages'.format(len(figures), run)
+                     + ('' if wall is None else ', {:.3f}s run'.format(wall)))
+        for name, total in sorted(figures.items(), key=lambda i: -i[1])[:slowest]:
+            lines.append('  {:>8.3f}s  {}'.format(total, name))
+        return '\n'.join(lines)
+
+
+def report_timings(timings, target, wall):
+    """Print the summary of timings to stderr, or append its records to target.
+
+    target is None or a file receiving one JSON record per line, followed by
+    a 'run' record holding the wall time of the whole run.
+    """
+    if target is None:
+        print(timings.summary(wall=wall), file=sys.stderr)
+        return
+    run = {'file': timings.label, 'figure': None, 'stage': 'run', 'seconds': round(wall, 6)}
+    with open(target, 'a') as f:
+        for record in timings.records + [run]:
+            f.write(json.dumps(record) + '\n')
+
+
+def render_rgba(fig, dpi=None):
+    """Draw fig at dpi, figure dpi by default, and return a copy of its RGBA pixels.
+
+    Encoding the pixels with matplotlib.image.imsave at the same dpi gives
+    the same bytes as fig.savefig.
+    """
+    saved = fig.dpi
+    if dpi:
+        fig.dpi = dpi
+    try:
+        fig.canvas.draw()
+        return np.array(fig.canvas.buffer_rgba()), fig.dpi
+    finally:
+        fig.dpi = saved
+
+
+# class AsyncWriter
+class AsyncWriter():
+    """Encode and write rendered images on a background thread.
+
+    Figures are rendered to RGBA pixels by the caller, then compressed and
+    written while the next figure is drawn. At most `depth` images wait in
+    memory, and an error of the thread is raised again by the next call to
+    `submit` or `flush`. The `done` callback of an image is called by these
+    same calls, in the calling thread, once the image is written.
+    """
+    def __init__(self, depth=ASYNC_WRITE_DEPTH, timings=None):
+        self.depth = depth
+        self.timings = timings
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        self._pending = []
+
+    def submit(self, dest, rgba, fmt, dpi, pil_kwargs=None, figure=None, done=None):
+        """Queue the pixels rgba to be written to dest in format fmt."""
+        while len(self._pending) >= self.depth:
+            self._wait()
+        future = self._pool.submit(self._write, dest, rgba, fmt, dpi, pil_kwargs, figure)
+        self._pending.append((future, done))
+
+    def _wait(self):
+        """Wait for the oldest queued image, then call its callback."""
+        future, done = self._pending.pop(0)
+        future.result()
+        if done is not None:
+            done()
+
+    def _write(self, dest, rgba, fmt, dpi, pil_kwargs, figure):
+        t0 = time.perf_counter()
+        mimage.imsave(dest, rgba, format=fmt, dpi=dpi, pil_kwargs=pil_kwargs)
+        if self.timings is not None:
+            self.timings.record('write', figure, time.perf_counter() - t0)
+
+    def flush(self):
+        """Wait until every queued image is written."""
+        while self._pending:
+            self._wait()
+
+    def close(self):
+        """Write the queued images and stop the thread."""
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown()
+
+
+# class RenderCache
+class RenderCache():
+    """Record the input digest of every figure written to an output directory.
+
+    The digests are kept in a JSON sidecar manifest, so a figure is rendered
+    again only when the data it was made of or its rendering parameters
+    changed, or when the image file is missing.
+    """
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.path = os.path.join(output_path, RENDER_CACHE_NAME)
+        self.entries = self._load()
+        self.pending = {}
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as fid:
+                return json.load(fid)
+        except (OSError, ValueError):
+            return {}
+
+    def is_fresh(self, figname, digest):
+        """Return True when figname exists and was made from the same inputs."""
+        return (self.entries.get(figname) == digest and
+                os.path.isfile(os.path.join(self.output_path, figname)))
+
+    def record(self, figname, digest):
+        """Remember the digest of a figure that has just been written."""
+        self.entries[figname] = digest
+        self.pending[figname] = digest
+
+    def update(self, entries):
+        """Record entries written by another process, ex: a pool worker."""
+        for figname, digest in entries.items():
+            self.record(figname, digest)
+
+    def take_pending(self):
+        """Return and forget the entries recorded since the last call."""
+        pending, self.pending = self.pending, {}
+        return pending
+
+    def save(self):
+        """Merge the new entries into the manifest on disk."""
+        if not self.pending:
+            return
+        entries = self._load()
+        entries.update(self.pending)
+        os.makedirs(self.output_path, exist_ok=True)
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp, 'w', encoding='utf-8') as fid:
+            json.dump(entries, fid, indent=0, sort_keys=True)
+        os.replace(tmp, self.path)
+        self.entries.update(entries)
+        self.pending = {}
+
+
+# class Archive
+class Archive():
+    """Stream the figures of a run into a single ZIP, TAR or multipage PDF file.
+
+    Writing thousands of small files costs one directory lookup, creation
+    and close each, which is slow on network drives; an archive is opened
+    and closed once per run. ZIP and TAR archives hold an index.json member
+    mapping each figure to the digest it was made from, its size and the
+    time it was added, and are appended to, so the archive also stands for
+    the render cache: `is_fresh`, `record` and `save` have the same meaning.
+    A figure made again is appended under the same name, readers take the
+    last member of a name. PDF archives hold one page per figure and are
+    written again on every run, so a run plotting several files shares a
+    single instance.
+    """
+    KINDS = ('.zip', '.tar', '.pdf')
+    INDEX = 'index.json'
+
+    def __init__(self, path):
+        self.path = path
+        self.kind = os.path.splitext(path)[1].lower()
+        if self.kind not in self.KINDS:
+            raise ValueError('unknown archive type: {}'.format(path))
+        self.index = {}
+        self.pending = {}
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        exists = os.path.isfile(path)
+        if self.kind == '.zip':
+            self.container = zipfile.ZipFile(path, 'a' if exists else 'w')
+            if self.INDEX in self.container.namelist():
+                self.index = json.loads(self.container.read(self.INDEX))
+        elif self.kind == '.tar':
+            if exists:
+                with tarfile.open(path) as tar:
+                    try:
+                        self.index = json.load(tar.extractfile(self.INDEX))
+                    except KeyError:
+                        pass
+            self.container = tarfile.open(path, 'a' if exists else 'w')
+        else:
+            from matplotlib.backends.backend_pdf import PdfPages
+            self.container = PdfPages(path)
+
+    def is_fresh(self, figname, digest):
+        """Return True when figname is in the archive, made from the same inputs."""
+        return self.index.get(figname, {}).get('digest') == digest
+
+    def encode(self, fig, savefig_kwargs):
+        """Return the image of fig, or add it as a page of a PDF archive and return None."""
+        if self.kind == '.pdf':
+            self.container.savefig(fig)
+            return None
+        buf = io.BytesIO()
+        fig.savefig(buf, **savefig_kwargs)
+        return buf.getvalue()
+
+    def write(self, figname, data, digest=None):
+        """Add the image data of figname, as returned by `encode`."""
+        entry = {'digest': digest, 'size': None if data is None else len(data),
+                 'time': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}
+        if data is not None:
+            self._add(figname, data)
+        self.index[figname] = entry
+        self.pending[figname] = entry
+
+    def _add(self, name, data):
+        if self.kind == '.zip':
+            # figures are already compressed, the index is not
+            compress = zipfile.ZIP_DEFLATED if name == self.INDEX else zipfile.ZIP_STORED
+            with warnings.catch_warnings():
+                warnings.filterwarnings('ignore', 'Duplicate name', UserWarning)
+                self.container.writestr(name, data, compress_type=compress)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.time()
+            self.container.addfile(info, io.BytesIO(data))
+
+    def record(self, figname, digest):
+        """Figures are recorded as they are written, see `write`."""
+
+    def update(self, entries):
+        self.index.update(entries)
+
+    def take_pending(self):
+        pending, self.pending = self.pending, {}
+        return pending
+
+    def save(self):
+        """Write the index of a ZIP or TAR archive, then close the archive."""
+        if self.container is None:
+            return
+        if self.kind != '.pdf' and self.pending:
+            self._add(self.INDEX, json.dumps(self.index, indent=0, sort_keys=True).encode())
+        self.container.close()
+        self.container = None
+
+
+# class GridCache
+class GridCache():
+    """Keep gridded sections on disk, as one .npz file per variable.
+
+    Each file holds the regular grid xi, yi and the field zi contoured by
+    `render_section`, with the profile x positions and numbers, the range
+    of the raw data and a digest of the data it was gridded from. Files are
+    named after a key made of the NetCDF file identity and the gridding
+    parameters. When the directory grows over `budget` MB, the least
+    recently used files are removed.
+    """
+    FIELDS = ('xi', 'yi', 'zi', 'x', 'list_profiles', 'zrange', 'data')
+
+    def __init__(self, path, budget=DEFAULT_GRID_CACHE_BUDGET):
+        self.path = path
+        self.budget = budget
+
+    def key(self, file, *parts):
+        """Return the key of a grid made from file(s), as last modified, and parts."""
+        files = []
+        for f in file_list(file):
+            st = os.stat(f)
+            files += [os.path.abspath(f), str(st.st_size), str(st.st_mtime_ns)]
+        return input_digest(*files, *parts)
+
+    def load(self, key):
+        """Return the grid stored under key as a dict, None when missing or unreadable."""
+        path = os.path.join(self.path, key + '.npz')
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                grid = {name: npz[name] for name in self.FIELDS}
+            # mark the grid as recently used, eviction follows modification times
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        grid['list_profiles'] = grid['list_profiles'].tolist()
+        # numpy scalars, so that color levels keep the dtype of the data
+        grid['zrange'] = list(grid['zrange'])
+        grid['data'] = str(grid['data'])
+        return grid
+
+    def store(self, key, grid, **metadata):
+        """Write grid under key, with metadata strings for other tools, then evict."""
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, key + '.npz')
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        arrays = {name: np.asarray(grid[name]) for name in self.FIELDS}
+        arrays.update((name, np.asarray(str(value))) for name, value in metadata.items())
+        with open(tmp, 'wb') as fid:
+            np.savez(fid, **arrays)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used grids until the budget is met."""
+        files = []
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.name.endswith('.npz'):
+                    st = entry.stat()
+                    files.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.budget * 1048576:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+# class MapCache
+class MapCache(GridCache):
+    """Keep the projected coastlines of scatter maps on disk, one .npz file per map.
+
+    Reading the coastline shapefile and projecting it on the map is done
+    once for an extent and a projection, later runs over the same area load
+    the resulting path. Paths are also kept in memory, so the two panels of
+    a scatter figure share them. source is a coastline shapefile, or a
+    directory holding the Natural Earth shapefiles as laid out by cartopy;
+    None lets cartopy find them, downloading them when missing.
+    """
+    FIELDS = ('vertices', 'codes')
+
+    def __init__(self, path, budget=DEFAULT_MAP_CACHE_BUDGET, source=None):
+        super().__init__(path, budget)
+        self.source = source
+        self.paths = {}
+
+    def load(self, key):
+        """Return the path stored under key, None when missing or unreadable."""
+        path = os.path.join(self.path, key + '.npz')
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                vertices, codes = npz['vertices'], npz['codes']
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        return mpath.Path(vertices, codes if len(codes) else None)
+
+    def coastlines(self, ax):
+        """Return the coastlines crossing the extent of the map ax, in map coordinates."""
+        import cartopy
+        import cartopy.feature as cfeature
+        import cartopy.io.shapereader as shpreader
+        from cartopy.mpl.path import shapely_to_path
+        from shapely.geometry import box
+
+        crs = ccrs.PlateCarree()
+        extent = [round(float(v), 6) for v in ax.get_extent(crs)]
+        local = self.source is not None and os.path.isfile(self.source)
+        if local:
+            key = self.key(self.source, extent, ax.projection.proj4_init)
+        else:
+            if self.source is not None:
+                cartopy.config['pre_existing_data_dir'] = self.source
+            scale = cfeature.COASTLINE.scaler.scale_from_extent(extent)
+            key = input_digest('natural_earth', self.source, scale, extent,
+                               ax.projection.proj4_init)
+        if key in self.paths:
+            return self.paths[key]
+        path = self.load(key) if self.path else None
+        if path is None:
+            if local:
+                area = box(extent[0], extent[2], extent[1], extent[3])
+                geoms = (g for g in shpreader.Reader(self.source).geometries()
+                         if g is not None and g.intersects(area))
+            else:
+                geoms = cfeature.COASTLINE.intersecting_geometries(extent)
+            path = mpath.Path.make_compound_path(
+                *(shapely_to_path(ax.projection.project_geometry(g, crs)) for g in geoms))
+            if self.path:
+                codes = path.codes if path.codes is not None else np.zeros(0, np.uint8)
+                self.store(key, {'vertices': path.vertices, 'codes': codes}, source=self.source)
+        self.paths[key] = path
+        return path
+
+
+# class ProfileStore
+class ProfileStore():
+    """Keep whole profile variables in memory, indexed by profile ID.
+
+    Each key is read from the dataset once, on first use, as one contiguous
+    masked 2-D array. Keys that would push the store over its memory budget
+    are not loaded and are read from the dataset on every access instead.
+    """
+    def __init__(self, nc, budget=DEFAULT_STORE_BUDGET):
+        self.nc = nc
+        self.budget = int(budget * 1024 * 1024)
+        self.nbytes = 0
+        self.data = {}
+        self.last_valid = {}
+        self.skipped = set()
+        ids = np.asarray(nc.variables['PROFILE'][:])
+        self.rows = {int(p): i for i, p in enumerate(ids)}
+
+    def load(self, key):
+        """Load a key in memory if it fits in the budget, return True when loaded."""
+        if key in self.data:
+            return True
+        if key in self.skipped:
+            return False
+        var = self.nc.variables[key]
+        # data plus a boolean mask per element
+        size = var.size * (np.dtype(var.dtype).itemsize + 1)
+        if self.nbytes + size > self.budget:
+            logging.warning('Profile store budget of %.0f MB exceeded, %s is read from file',
+                            self.budget / 1048576, key)
+            self.skipped.add(key)
+            return False
+        data = np.ma.asarray(var[:])
+        data.mask = np.ma.getmaskarray(data)
+        self.data[key] = data
+        self.nbytes += data.nbytes + data.mask.nbytes
+        if data.ndim == 2:
+            # index of the last unmasked level of each profile, -1 if none
+            valid = ~data.mask
+            last = data.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+            last[~valid.any(axis=1)] = -1
+            self.last_valid[key] = last
+        return True
+
+    def read(self, key, index):
+        """Return key[index] from memory, or from the dataset when not loaded."""
+        if self.load(key):
+            return self.data[key][index]
+        return self.nc.variables[key][index]
+
+    def depth(self, keys, row):
+        """Return the number of levels of a profile holding valid data for keys."""
+        y, *xs = [self.last_valid[k][row] if self.load(k) else None for k in keys]
+        if y is None or any(x is None for x in xs):
+            return None
+        return min(y, max(xs)) + 1
+
+    def report(self):
+        """Return a one-line summary of the memory held by the store."""
+        return 'Profile store: {} key(s), {:.1f} MB of {:.0f} MB'.format(
+            len(self.data), self.nbytes / 1048576, self.budget / 1048576)
+
+
+class TrackReader():
+    """Read the samples of a trajectory dataset, such as TSG, chunk by chunk.
+
+    Samples are returned as float arrays, with NaN in place of masked values,
+    restricted to the [start, end] time window given in CNES julian days.
+    When the whole record fits in one chunk, it is read once and kept.
+    names are the variables read, by default the position and keys.
+    """
+    def __init__(self, nc, dims, keys, start=None, end=None, chunk=DEFAULT_TRACK_CHUNK,
+                 names=None):
+        self.nc = nc
+        self.time, self.lat, self.lon = dims
+        self.names = names or [self.lat, self.lon] + [k for k in keys if k not in dims]
+        self.start = start
+        self.end = end
+        self.chunk = max(1, int(chunk))
+        self.size = nc.variables[self.time].shape[0]
+        self._cached = None
+
+    def _read(self, name, index):
+        return read_float(self.nc.variables[name], index)
+
+    def chunks(self, names=None):
+        """Yield one dict of arrays per chunk, for names or all the variables."""
+        if self._cached is not None:
+            yield self._cached
+            return
+        names = self.names if names is None else names
+        for begin in range(0, self.size, self.chunk):
+            index = slice(begin, min(begin + self.chunk, self.size))
+            inside = None
+            if self.start is not None or self.end is not None:
+                time = self._read(self.time, index)
+                inside = np.ones(len(time), dtype=bool)
+                if self.start is not None:
+                    inside &= time >= self.start
+                if self.end is not None:
+                    inside &= time <= self.end
+                rows = np.flatnonzero(inside)
+                if not len(rows):
+                    continue
+                # only read the part of the chunk inside the window
+                index = slice(begin + rows[0], begin + rows[-1] + 1)
+                inside = inside[rows[0]:rows[-1] + 1]
+            data = {}
+            for name in names:
+                values = self._read(name, index)
+                data[name] = values if inside is None else values[inside]
+            if self.size <= self.chunk and names is self.names:
+                self._cached = data
+            yield data
+
+    def extent(self):
+        """Return the [x1, x2, y1, y2] extent of the samples, None without any."""
+        names = None if self.size <= self.chunk else [self.lat, self.lon]
+        bounds = []
+        for data in self.chunks(names):
+            lon = data[self.lon][np.isfinite(data[self.lon])]
+            lat = data[self.lat][np.isfinite(data[self.lat])]
+            if len(lon) and len(lat):
+                bounds.append([lon.min(), lon.max(), lat.min(), lat.max()])
+        if not bounds:
+            return None
+        bounds = np.array(bounds)
+        return [bounds[:, 0].min(), bounds[:, 1].max(), bounds[:, 2].min(), bounds[:, 3].max()]
+
+    def time_range(self):
+        """Return the first and last time of the samples, None without any."""
+        names = None if self.size <= self.chunk else [self.time]
+        bounds = []
+        for data in self.chunks(names):
+            time = data[self.time][np.isfinite(data[self.time])]
+            if len(time):
+                bounds.append([time.min(), time.max()])
+        if not bounds:
+            return None
+        bounds = np.array(bounds)
+        return bounds[:, 0].min(), bounds[:, 1].max()
+
+
+# class Session
+class Session():
+    """Keep datasets and resolved profile selections warm between batch jobs."""
+    def __init__(self):
+        self.datasets = {}
+        self.selections = {}
+        self.stores = {}
+
+    def dataset(self, file, reader='netcdf4'):
+        """Return an open dataset for file, opening it on first use only."""
+        path = (tuple(os.path.abspath(f) for f in file_list(file)), reader)
+        if path not in self.datasets:
+            self.datasets[path] = open_dataset(file, reader)
+        return self.datasets[path]
+
+    def store(self, file, budget, reader='netcdf4'):
+        """Return the profile store of file, shared by every job of the session."""
+        path = (tuple(os.path.abspath(f) for f in file_list(file)), reader)
+        if path not in self.stores:
+            self.stores[path] = ProfileStore(self.dataset(file, reader), budget)
+        return self.stores[path]
+
+    def forget(self, file):
+        """Close the dataset of file and drop what was read from it, once it changed."""
+        paths = tuple(os.path.abspath(f) for f in file_list(file))
+        for key in [k for k in self.datasets if k[0] == paths]:
+            self.datasets.pop(key).close()
+        for cache in (self.stores, self.selections):
+            for key in [k for k in cache if k[0] == paths]:
+                del cache[key]
+
+    def close(self):
+        """Close every dataset opened by this session."""
+        for nc in self.datasets.values():
+            nc.close()
+        self.datasets.clear()
+        self.selections.clear()
+        self.stores.clear()
+
+
+# class MultiDataset
+class MultiDataset():
+    """Read several profile datasets, such as consecutive legs, as a single one.
+
+    Variables found in every dataset are concatenated along their first
+    dimension, in the order of the datasets, and shorter level dimensions
+    are padded with masked values. Global and variable attributes are those
+    of the first dataset. Profile numbers must not repeat across datasets.
+    """
+    def __init__(self, datasets):
+        self.datasets = datasets
+        first = datasets[0]
+        self.variables = {name: MultiVariable([nc.variables[name] for nc in datasets])
+                          for name in first.variables
+                          if all(name in nc.variables for nc in datasets[1:])}
+        if 'PROFILE' in self.variables:
+            ids = np.asarray(self.variables['PROFILE'][:])
+            if len(np.unique(ids)) != len(ids):
+                self.close()
+                sys.exit('Profile numbers repeat across the aggregated files')
+
+    def ncattrs(self):
+        return self.datasets[0].ncattrs()
+
+    def filepath(self):
+        return self.datasets[0].filepath()
+
+    def __getattr__(self, name):
+        # global attributes, ex: cycle_mesure
+        return getattr(self.datasets[0], name)
+
+    def close(self):
+        for nc in self.datasets:
+            nc.close()
+
+
+class MultiVariable():
+    """One variable of a `MultiDataset`, read from every dataset on first use."""
+    def __init__(self, parts):
+        self.parts = parts
+        self.dtype = parts[0].dtype
+        self.dimensions = parts[0].dimensions
+        self.shape = (sum(v.shape[0] for v in parts),) + tuple(
+            max(v.shape[i] for v in parts) for i in range(1, len(parts[0].shape)))
+        self.size = int(np.prod(self.shape))
+        self._data = None
+
+    def ncattrs(self):
+        return self.parts[0].ncattrs()
+
+    def getncattr(self, name):
+        return self.parts[0].getncattr(name)
+
+    def __getattr__(self, name):
+        # variable attributes, ex: long_name
+        return getattr(self.parts[0], name)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        if self._data is None:
+            if not self.shape:
+                self._data = self.parts[0][...]
+            else:
+                data = np.ma.masked_all(self.shape, dtype=self.dtype)
+                row = 0
+                for v in self.parts:
+                    n = v.shape[0]
+                    data[(slice(row, row + n),) + tuple(slice(0, k) for k in v.shape[1:])] = v[:]
+                    row += n
+                self._data = data
+        return self._data[index]
+
+
+# class ClassicDataset
+# external types of the classic NetCDF format, by type code
+NC_TYPES = {1: 'i1', 2: 'S1', 3: '>i2', 4: '>i4', 5: '>f4', 6: '>f8'}
+# values masked by netCDF4 when a variable has no _FillValue, bytes included
+NC_DEFAULT_FILLS = {'S1': b'\x00', 'i1': -127, 'i2': -32767, 'i4': -2147483647,
+                    'f4': 9.969209968386869e36, 'f8': 9.969209968386869e36}
+
+
+class _ClassicHeader():
+    """Cursor over the header of a classic or 64-bit offset NetCDF file."""
+    def __init__(self, buf, version):
+        self.buf = buf
+        self.pos = 4
+        self.offset = '>i' if version == 1 else '>q'
+
+    def unpack(self, fmt):
+        value, = struct.unpack_from(fmt, self.buf, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return value
+
+    def raw(self, size):
+        data = bytes(self.buf[self.pos:self.pos + size])
+        # every header item is padded to 4 bytes
+        self.pos += -(-size // 4) * 4
+        return data
+
+    def name(self):
+        return self.raw(self.unpack('>i')).decode('utf-8')
+
+    def count(self, tag):
+        """Return the number of elements of a list, 0 when it is absent."""
+        found, n = self.unpack('>i'), self.unpack('>i')
+        if found not in (0, tag):
+            raise ValueError('corrupt NetCDF header')
+        return n
+
+    def attributes(self):
+        attrs = {}
+        for _ in range(self.count(0x0C)):
+            name = self.name()
+            dtype = np.dtype(NC_TYPES[self.unpack('>i')])
+            n = self.unpack('>i')
+            raw = self.raw(n * dtype.itemsize)
+            if dtype.char == 'S':
+                attrs[name] = raw.decode('utf-8', 'replace').replace('\x00', '')
+            else:
+                values = np.frombuffer(raw, dtype).astype(dtype.newbyteorder('='))
+                attrs[name] = values[0] if n == 1 else values
+        return attrs
+
+
+class ClassicDataset():
+    """Read a classic or 64-bit offset NetCDF file through a memory map.
+
+    Variables are NumPy views of the mapped file, so a read only touches
+    the pages it needs, and worker processes reading the same file share
+    them in the OS page cache. Reads return masked arrays like netCDF4,
+    built with vectorized comparisons. Raise ValueError for other formats.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fid:
+            try:
+                self._mm = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError('{} is empty'.format(path))
+        version = self._mm[3] if self._mm[:3] == b'CDF' else None
+        if version not in (1, 2):
+            self._mm.close()
+            raise ValueError('{} is not a classic NetCDF file'.format(path))
+        self.file_format = 'NETCDF3_CLASSIC' if version == 1 else 'NETCDF3_64BIT_OFFSET'
+
+        header = _ClassicHeader(self._mm, version)
+        numrecs = header.unpack('>i')
+        dims = []
+        for _ in range(header.count(0x0A)):
+            name = header.name()
+            dims.append((name, header.unpack('>i')))
+        self._attrs = header.attributes()
+        specs = []
+        for _ in range(header.count(0x0B)):
+            name = header.name()
+            dimids = [header.unpack('>i') for _ in range(header.unpack('>i'))]
+            attrs = header.attributes()
+            dtype = np.dtype(NC_TYPES[header.unpack('>i')])
+            vsize = header.unpack('>i')
+            begin = header.unpack(header.offset)
+            specs.append((name, [dims[i] for i in dimids], attrs, dtype, vsize, begin))
+
+        # record variables are interleaved, one record of each after the other
+        records = [spec for spec in specs if spec[1] and spec[1][0][1] == 0]
+        recsize = sum(spec[4] for spec in records)
+        if len(records) == 1:
+            # a single record variable is not padded
+            spec = records[0]
+            recsize = spec[3].itemsize * int(np.prod([n for _, n in spec[1][1:]]))
+        self.variables = {}
+        for name, vdims, attrs, dtype, vsize, begin in specs:
+            shape = tuple(numrecs if n == 0 and i == 0 else n for i, (_, n) in enumerate(vdims))
+            strides = None
+            if vdims and vdims[0][1] == 0:
+                strides = (recsize,) + np.empty(shape[1:], dtype).strides
+            view = np.ndarray(shape, dtype, buffer=self._mm, offset=begin, strides=strides)
+            self.variables[name] = ClassicVariable(view, tuple(d for d, _ in vdims), attrs)
+
+    def ncattrs(self):
+        return list(self._attrs)
+
+    def getncattr(self, name):
+        return self._attrs[name]
+
+    def filepath(self):
+        return self.path
+
+    def __getattr__(self, name):
+        # global attributes, ex: cycle_mesure
+        try:
+            return self.__dict__['_attrs'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def close(self):
+        # views must be released before the map can be closed
+        self.variables = {}
+        try:
+            self._mm.close()
+        except BufferError:
+            pass
+
+
+class ClassicVariable():
+    """One variable of a `ClassicDataset`, read like a netCDF4 variable.
+
+    Values are masked where they equal missing_value or _FillValue, the
+    default fill value of their type otherwise, or fall outside valid_min,
+    valid_max or valid_range, then scaled by scale_factor and add_offset.
+    """
+    def __init__(self, view, dimensions, attrs):
+        self._view = view
+        self._attrs = attrs
+        self.dimensions = dimensions
+        self.dtype = view.dtype.newbyteorder('=')
+        self.shape = view.shape
+        self.ndim = view.ndim
+        self.size = view.size
+        code = self.dtype.str[1:]
+        cast = lambda value: np.asarray(value).astype(self.dtype)
+        self._missing = cast(attrs['missing_value']).ravel() if 'missing_value' in attrs else []
+        if '_FillValue' in attrs:
+            self._fill = cast(attrs['_FillValue'])
+        else:
+            self._fill = NC_DEFAULT_FILLS.get(code)
+        valid = np.asarray(attrs.get('valid_range', ()))
+        if valid.size == 2:
+            self._valid = (cast(valid[0]), cast(valid[1]))
+        else:
+            self._valid = (cast(attrs['valid_min']) if 'valid_min' in attrs else None,
+                           cast(attrs['valid_max']) if 'valid_max' in attrs else None)
+        if self.dtype.char == 'S':
+            self._valid = (None, None)
+
+    def ncattrs(self):
+        return list(self._attrs)
+
+    def getncattr(self, name):
+        return self._attrs[name]
+
+    def __getattr__(self, name):
+        # variable attributes, ex: long_name
+        try:
+            return self.__dict__['_attrs'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _invalid(self, data):
+        """Return the mask of the missing values of data, in the file type."""
+        mask = np.zeros(data.shape, dtype=bool)
+        for value in self._missing:
+            mask |= np.isnan(data) if np.isnan(value) else data == value
+        if self._fill is not None:
+            fill = np.asarray(self._fill)
+            mask |= np.isnan(data) if fill.dtype.kind == 'f' and np.isnan(fill) else data == fill
+        low, high = self._valid
+        if low is not None:
+            mask |= data < low
+        if high is not None:
+            mask |= data > high
+        return mask
+
+    def _scale(self, data):
+        if 'scale_factor' in self._attrs:
+            data = data * self._attrs['scale_factor']
+        if 'add_offset' in self._attrs:
+            data = data + self._attrs['add_offset']
+        return data
+
+    def __getitem__(self, index):
+        data = np.asarray(self._view[index]).astype(self.dtype)
+        data = self._scale(np.ma.masked_array(data, mask=self._invalid(data)))
+        if data.shape == () and data.mask.all():
+            return np.ma.masked
+        return data
+
+    def read_float(self, index=slice(None)):
+        """Return self[index] as floats, with NaN in place of missing values."""
+        raw = np.asarray(self._view[index])
+        data = self._scale(raw.astype(float))
+        data[self._invalid(raw)] = np.nan
+        return data
+
 
 # class Plots
 class Plots():
-    """Wrap NetCDF access and figure generation for profiles, sections and scatters."""
+    """Wrap NetCDF access and figure generation for profiles, sections, scatters and time series."""
     def __init__(self, file, dims, keys, ti, colors, append, output_path,
-                 force=False, grid=False, screen=False):
-        self.nc = Dataset(file, mode='r')
+                 force=False, grid=False, screen=False, session=None, store=None,
+                 template=False, timings=None, fmt='png', dpi=None, compression=None,
+                 async_write=False, grid_cache=None, grid_cache_size=DEFAULT_GRID_CACHE_BUDGET,
+                 reader='netcdf4', images=None, map_cache=None, coastlines=None,
+                 archive=None):
+        self.file = file
+        self.session = session
+        # stage timings, disabled unless given
+        self.timings = timings if timings is not None else Timings(enabled=False)
+        with self.timings.stage('open'):
+            self.nc = session.dataset(file, reader) if session else open_dataset(file, reader)
+        load_pyplot(['--screen'] if screen else [])
+        # optional in-memory profile store, store is its budget in MB
+        self.store = None
+        if store:
+            self.store = (session.store(file, store, reader) if session
+                          else ProfileStore(self.nc, store))
+        self._rows = None
+        self._attrs = {}
+        self._times = None
+        self._dates = None
+        self.cache = RenderCache(output_path)
+        # optional single file holding every figure, which then keeps their digests,
+        # given as a path or as an Archive shared with the other files of the run
+        self.archive = None
+        if archive and images is None:
+            self.archive = self.cache = (archive if isinstance(archive, Archive)
+                                         else Archive(archive))
+        # optional on-disk cache of gridded sections, grid_cache is its directory
+        self.grids = GridCache(grid_cache, grid_cache_size) if grid_cache else None
+        # projected coastlines of scatter maps, kept in map_cache unless None
+        self.maps = MapCache(map_cache, source=coastlines)
+        # reuse one profile figure, only updating its data, unless on screen
+        self.template = template and not screen
+        self._template = None
         self.dims = dims
         self.keys = keys
         self.colors = colors
@@ -174,6 +1810,24 @@ class Plots():
         self.screen = screen
         self.fig = None
         self.ax = None
+        # image encoding, dpi None keeps the size of the figure
+        self.fmt = fmt
+        self.dpi = dpi
+        self.compression = compression
+        self.savefig_kwargs = {'format': fmt}
+        if dpi:
+            self.savefig_kwargs['dpi'] = dpi
+        if compression is not None and fmt == 'png':
+            self.savefig_kwargs['pil_kwargs'] = {'compress_level': compression}
+        self.rasterized = fmt in VECTOR_FORMATS or (self.archive is not None and
+                                                    self.archive.kind == '.pdf')
+        # when given, figures are encoded into this dict, by name, instead of files
+        self.images = images
+        self.writer = None
+        if (async_write and not screen and images is None and self.archive is None
+                and fmt not in VECTOR_FORMATS):
+            self.writer = AsyncWriter(timings=self.timings)
+        self._folders = set()
 
     def __getitem__(self, key):
         """Allow dict-like access to already attached instance attributes."""
@@ -183,11 +1837,78 @@ class Plots():
             'plot_profiles.py: invalid attribute: "%s"', key)
         return None
 
-    def plot(self, figname):
-        """Save the current figure, creating the output directory when needed."""
+    def profile_rows(self):
+        """Return a dict mapping each profile ID to its row in the dataset."""
+        if self.store:
+            return self.store.rows
+        if self._rows is None:
+            ids = np.asarray(self.nc.variables['PROFILE'][:])
+            self._rows = {int(p): i for i, p in enumerate(ids)}
+        return self._rows
+
+    def profile_times(self):
+        """Return the time of every profile row, in CNES julian days."""
+        if self._times is None:
+            self._times = read_float(self.nc.variables[self.dims[0]])
+        return self._times
+
+    def profile_dates(self):
+        """Return the date of every profile row, formatted once for all headers."""
+        if self._dates is None:
+            self._dates = format_julian(self.profile_times())
+        return self._dates
+
+    def profiles_between(self, start=None, end=None):
+        """Return the IDs of the profiles in the [start, end] julian days window."""
+        times = self.profile_times()
+        inside = np.isfinite(times)
+        if start is not None:
+            inside &= times >= start
+        if end is not None:
+            inside &= times <= end
+        return [p for p, row in self.profile_rows().items() if inside[row]]
+
+    def attrs(self, key):
+        """Return the attributes of a variable, read from the dataset only once."""
+        if key not in self._attrs:
+            var = self.nc.variables[key]
+            self._attrs[key] = {name: var.getncattr(name) for name in var.ncattrs()}
+        return self._attrs[key]
+
+    def read(self, key, index):
+        """Return key[index], from the profile store when one is enabled."""
+        if self.store:
+            return self.store.read(key, index)
+        return self.nc.variables[key][index]
+
+    def plot(self, figname, close=True, digest=None):
+        """Save the current figure, creating the output directory when needed.
+
+        When given, digest is recorded in the render cache for figname.
+        """
+        if self.images is not None:
+            with self.timings.stage('encode', figname):
+                buf = io.BytesIO()
+                self.fig.savefig(buf, **self.savefig_kwargs)
+            self.images[figname] = buf.getvalue()
+            if close:
+                plt.close(self.fig)
+            return
+        if self.archive is not None:
+            print('Printing: ', os.path.join(self.archive.path, figname))
+            with self.timings.stage('encode', figname):
+                data = self.archive.encode(self.fig, self.savefig_kwargs)
+            with self.timings.stage('write', figname):
+                self.archive.write(figname, data, digest)
+            if close:
+                plt.close(self.fig)
+            return
+
         dest = os.path.normpath(os.path.join(self.output_path, figname))
-        if not os.path.exists(os.path.dirname(dest)):
-            os.makedirs(os.path.dirname(dest), exist_ok=True)
+        folder = os.path.dirname(dest)
+        if folder not in self._folders:
+            os.makedirs(folder, exist_ok=True)
+            self._folders.add(folder)
 
         print('Printing: ', dest)
         if self.screen:
@@ -195,57 +1916,128 @@ class Plots():
                 print(BACKEND_WARNING, file=sys.stderr)
             plt.show()
 
-        self.fig.savefig(dest)
-        plt.close(self.fig)
+        if self.writer is not None:
+            # only draw here, the writer thread compresses while the next figure is drawn
+            with self.timings.stage('encode', figname):
+                rgba, dpi = render_rgba(self.fig, self.dpi)
+            pil_kwargs = self.savefig_kwargs.get('pil_kwargs')
+            # the digest is recorded once the image is on disk, not when it is queued
+            done = None
+            if digest is not None:
+                done = functools.partial(self.cache.record, figname, digest)
+            self.writer.submit(dest, rgba, self.fmt, dpi,
+                               dict(pil_kwargs) if pil_kwargs else None, figname, done)
+            if close:
+                plt.close(self.fig)
+            return
+        else:
+            # encode in memory first, so that encoding and writing are timed apart
+            with self.timings.stage('encode', figname):
+                buf = io.BytesIO()
+                self.fig.savefig(buf, **self.savefig_kwargs)
+            with self.timings.stage('write', figname):
+                with open(dest, 'wb') as f:
+                    f.write(buf.getbuffer())
+        if close:
+            plt.close(self.fig)
+        if digest is not None:
+            self.cache.record(figname, digest)
 
     def profiles(self, profile):
         """Plot all requested variables for a single CTD/XBT/ADCP profile."""
 
         # find the profile index
-        profiles = self.nc.variables['PROFILE'][:].tolist()
-        try:
-            index = profiles.index(profile)
-        except:
+        index = self.profile_rows().get(profile)
+        if index is None:
             return
 
         # construct plot file name
         sep = "_" if self.append else ""
-        figname = '{}-{:05d}_{}{}{}.png'.format(
-            get_cycle_label(self.nc), profile, self.type, sep, self.append)
-        dest = os.path.join(self.output_path, figname)
-        # test if file exist
-        if os.path.isfile(dest) and not self.force:
+        figname = '{}-{:05d}_{}{}{}.{}'.format(
+            get_cycle_label(self.nc), profile, self.type, sep, self.append, self.fmt)
+
+        with self.timings.stage('read', figname):
+            # drop trailing fill values when the store knows the last valid level
+            levels = self.store.depth(self.keys, index) if self.store else None
+            levels = slice(None) if levels is None else slice(0, max(levels, 1))
+            # the first parameter, DEPTH or PRES, is the y axis of every plot
+            y = self.read(self.keys[0], index)[levels]
+            xs = [self.read(key, index)[levels] for key in self.keys[1:]]
+            header = '{}, {}, Profile: {:03d} Date: {} Lat: {} Long: {}'.format(
+                get_cycle_label(self.nc),
+                self.type,
+                profile,
+                self.profile_dates()[index],
+                Dec2dms(self.read(self.dims[1], index), 'N'),
+                Dec2dms(self.read(self.dims[2], index), 'W'))
+
+        # skip the figure if it was already made from the same inputs
+        digest = input_digest('profile', y, xs, header, self.keys, self.colors,
+                              self.grid, [self.attrs(key) for key in self.keys],
+                              self.dpi, self.compression)
+        if self.cache.is_fresh(figname, digest) and not self.force:
             return
 
+        with self.timings.stage('draw', figname):
+            if self._template is None:
+                self.fig, self.ax, lines, text = self.profile_figure(y, xs)
+                text.set_text(header)
+                if self.template:
+                    self._template = (self.fig, self.ax, lines, text)
+            else:
+                # only the data, the y range and the header change between profiles
+                self.fig, self.ax, lines, text = self._template
+                for line, x in zip(lines, xs):
+                    line.set_data(x, y)
+                self.ax.set_ylim(min(y), max(y))
+                self.ax.invert_yaxis()
+                text.set_text(header)
+        self.plot(figname, close=not self.template, digest=digest)
+
+    def profile_figure(self, y, xs):
+        """Build the stacked x-axes figure of a profile.
+
+        Return the figure, its main axes, the line of each x key and the
+        empty header text, so that the figure can be reused as a template.
+        """
+        return self.stacked_figure(xs, y, min(y), max(y))
+
+    def stacked_figure(self, xs, y, ymin, ymax, draw=None):
+        """Build the figure of profiles, one x-axis stacked on top for each key after the first.
+
+        draw(ax, x, y, fmt, label) plots the data x of a key against y and
+        returns the line giving the color of the axis, `Axes.plot` by
+        default. Return the figure, its main axes, the line of each x key
+        and the empty header text.
+        """
+        if draw is None:
+            def draw(ax, x, y, fmt, label):
+                return ax.plot(x, y, fmt, label=label)[0]
+
         # initialize subplots
-        self.fig, self.ax = plt.subplots(figsize=(10, 7))
-        self.fig.subplots_adjust(top=0.95-((len(self.keys)-1)*0.06))
+        fig, ax = plt.subplots(figsize=(10, 7))
+        fig.subplots_adjust(top=0.95-((len(self.keys)-1)*0.06))
         offset = 0.14
         tkw = dict(size=4, width=1.5)
 
         # the first plot with the first parameter, DEPTH or PRES
-        y = self.nc.variables[self.keys[0]][index, :]
-        x = self.nc.variables[self.keys[1]][index, :]
-        p, = self.ax.plot(x, y, self.colors[1],
-                          label=self.nc.variables[self.keys[1]].long_name)
-        self.ax.set_ylim(min(y), max(y))
-        self.ax.invert_yaxis()
-        self.ax.set_xlim(self.nc.variables[self.keys[1]].valid_min,
-                         self.nc.variables[self.keys[1]].valid_max)
-        self.ax.set_ylabel('{} [{}]'.format(self.nc.variables[self.keys[0]].long_name,
-                                            self.nc.variables[self.keys[0]].units))
-        self.ax.set_xlabel('{} [{}]'.format(self.nc.variables[self.keys[1]].long_name,
-                                            self.nc.variables[self.keys[1]].units))
-        self.ax.xaxis.label.set_color(p.get_color())
-        self.ax.tick_params(axis='x', colors=p.get_color(), **tkw)
-        self.ax.tick_params(axis='y', **tkw)
-
-        position = 'bottom'
+        ya = self.attrs(self.keys[0])
+        xa = self.attrs(self.keys[1])
+        p = draw(ax, xs[0], y, self.colors[1], xa['long_name'])
+        lines = [p]
+        ax.set_ylim(ymin, ymax)
+        ax.invert_yaxis()
+        ax.set_xlim(xa['valid_min'], xa['valid_max'])
+        ax.set_ylabel('{} [{}]'.format(ya['long_name'], ya['units']))
+        ax.set_xlabel('{} [{}]'.format(xa['long_name'], xa['units']))
+        ax.xaxis.label.set_color(p.get_color())
+        ax.tick_params(axis='x', colors=p.get_color(), **tkw)
+        ax.tick_params(axis='y', **tkw)
 
         # loop over the last parameters
         for k in range(2, len(self.keys)):
             i = k-2
-            par = self.ax.twiny()
+            par = ax.twiny()
             key = self.keys[k]
 
             position = 'top'
@@ -253,141 +2045,300 @@ class Plots():
             make_patch_spines_invisible(par)
             par.spines[position].set_visible(True)
 
-            # get data
-            x = self.nc.variables[key][index, :]
-            p, = par.plot(x, y, self.colors[k],
-                          label=self.nc.variables[key].long_name)
-            par.set_xlim(self.nc.variables[key].valid_min,
-                         self.nc.variables[key].valid_max)
-            par.set_xlabel('{} [{}]'.format(self.nc.variables[key].long_name,
-                                            self.nc.variables[key].units))
+            xa = self.attrs(key)
+            p = draw(par, xs[k-1], y, self.colors[k], xa['long_name'])
+            lines.append(p)
+            par.set_xlim(xa['valid_min'], xa['valid_max'])
+            par.set_xlabel('{} [{}]'.format(xa['long_name'], xa['units']))
             par.xaxis.label.set_color(p.get_color())
             par.tick_params(axis='x', colors=p.get_color(), **tkw)
 
         # add grid on plot
         if(self.grid):
-            self.ax.grid()
-
-        self.fig.text(0.15, 0.95,
-                      '{}, {}, Profile: {:03d} Date: {} Lat: {} Long: {}'
-                      .format(get_cycle_label(self.nc),
-                              self.type,
-                              profile,
-                              julian2dt(
-                                  self.nc.variables[self.dims[0]][index]),
-                              Dec2dms(
-                                  self.nc.variables[self.dims[1]][index], 'N'),
-                              Dec2dms(
-                                  self.nc.variables[self.dims[2]][index], 'W'),
-                              va='center', rotation='horizontal'))
-        self.plot(figname)
+            ax.grid()
 
-    # plot one or more sections
-    def section(self, start, end, xaxis, yscale, exclude,
-                xinterp=None, yinterp=1, clevels=20, autoscale=0, display=None):
-        """Plot one or more section variables over a profile range."""
+        text = fig.text(0.15, 0.95, '')
+        return fig, ax, lines, text
 
-        # Y variable, PRES or DEPTH, must be first, add test
-        yaxis = self.keys[0]
-        # get the profile list
-        profiles = self.nc.variables['PROFILE'][:].tolist()
-        ymax = np.max(yscale)
+    def overlay(self, start, end, exclude, color_by='key'):
+        """Plot the profiles start..end, without exclusions, on a single figure.
+
+        Each key is drawn as one LineCollection made from the 2-D array of
+        all the profiles, masked levels breaking the lines, so thousands of
+        profiles draw about as fast as one. Lines take the color of their
+        key, or with color_by `time` or `latitude`, the color of the time or
+        latitude of their profile.
+        """
+        rows = self.select_profiles(start, end, exclude)
+        sep = "_" if self.append else ""
+        figname = '{}-OVERLAY-{:05d}-{:05d}_{}{}{}.{}'.format(
+            get_cycle_label(self.nc), start, end, self.type, sep, self.append, self.fmt)
+
+        with self.timings.stage('read', figname):
+            # one contiguous read per key, then the selected rows
+            first = int(rows.min())
+            block = slice(first, int(rows.max()) + 1)
+            take = rows - first
+            y = np.ma.masked_invalid(self.read(self.keys[0], block)[take])
+            xs = [np.ma.masked_invalid(self.read(key, block)[take]) for key in self.keys[1:]]
+            values = None
+            if color_by != 'key':
+                dim = self.dims[0] if color_by == 'time' else self.dims[1]
+                values = read_float(self.nc.variables[dim], block)[take]
+            header = '{}, {}, Profiles: {} to {} ({} profiles)'.format(
+                get_cycle_label(self.nc), self.type, start, end, len(rows))
+
+        digest = input_digest('overlay', y, *xs, values, header, self.keys, self.colors,
+                              self.grid, color_by, [self.attrs(key) for key in self.keys],
+                              self.dpi, self.compression)
+        if self.cache.is_fresh(figname, digest) and not self.force:
+            return
+
+        with self.timings.stage('draw', figname):
+            norm = None
+            if values is not None:
+                if color_by == 'time':
+                    values = julian2num(values)
+                norm = plt.Normalize(np.nanmin(values), np.nanmax(values))
+
+            def draw(ax, x, y, fmt, label):
+                # an empty line gives the color and style of fmt, and the legend entry
+                line, = ax.plot([], [], fmt, label=label)
+                segments = np.ma.stack([x, y], axis=-1)
+                collection = mcollections.LineCollection(
+                    segments, linestyles=line.get_linestyle(),
+                    linewidths=line.get_linewidth(), rasterized=self.rasterized)
+                if norm is None:
+                    collection.set_color(line.get_color())
+                else:
+                    collection.set(array=values, cmap='jet', norm=norm)
+                ax.add_collection(collection, autolim=False)
+                return line
+
+            self.fig, ax, _, text = self.stacked_figure(xs, y, y.min(), y.max(), draw)
+            text.set_text(header)
+            if norm is not None:
+                bar = self.fig.colorbar(plt.cm.ScalarMappable(norm=norm, cmap='jet'), ax=ax,
+                                        orientation='horizontal', pad=0.1, fraction=0.05)
+                bar.set_label(self.attrs(self.dims[0] if color_by == 'time'
+                                         else self.dims[1])['standard_name'])
+                if color_by == 'time':
+                    bar.ax.xaxis.set_major_locator(mdates.AutoDateLocator(maxticks=6))
+                    bar.ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y/%m/%d'))
+        self.plot(figname, digest=digest)
+
+    def close_figures(self):
+        """Close the template figure kept between profiles, if any."""
+        if self._template is not None:
+            plt.close(self._template[0])
+            self._template = None
+
+    def flush(self):
+        """Wait until the background writer, if any, has written every image."""
+        if self.writer is not None:
+            self.writer.flush()
+
+    def select_profiles(self, start, end, exclude):
+        """Return the dataset indices of profiles start..end, without exclusions.
+
+        The result is memoized in the session, so batch jobs plotting several
+        variables over the same file and range resolve it only once.
+        """
+        cache_key = (tuple(os.path.abspath(f) for f in file_list(self.file)), start, end,
+                     tuple(exclude))
+        if self.session and cache_key in self.session.selections:
+            return self.session.selections[cache_key]
+
+        # profile ID -> dataset row
+        rows = self.profile_rows()
         # construct the vector index of the profiles list, without excluded value(s)
         # this vector is use to extract the profiles from netcdf file
         index_profiles = []
-        index_exclude = []
+        index_exclude = set()
         for i in exclude:
-            try:
-                index_exclude.append(profiles.index(i))
-            except ValueError:
+            if i in rows:
+                index_exclude.add(rows[i])
+            else:
                 logging.warning('Excluded profile %s is missing from the dataset', i)
         for i in range(start, end + 1):
-            try:
-                index_profiles.append(profiles.index(i))
-            except ValueError:
-                print("invalid --list {}-{}, we use last profile = {}".format(start, end,
-                                                                              profiles[-1]))
-                i = i - 1
+            if i not in rows:
+                print("invalid --list {}-{}, we use last profile = {}".format(
+                    start, end, next(reversed(rows))))
                 break
-        # remove the exclude list indice from profile list indice
-        # https://www.geeksforgeeks.org/python-indices-list-of-matching-element-from-other-list/?ref=rp
-        res = [i for i, val in enumerate(index_profiles) if val in index_exclude]
-        index_profiles = np.delete(index_profiles, res)
+            if rows[i] not in index_exclude:
+                index_profiles.append(rows[i])
+        index_profiles = np.asarray(index_profiles, dtype=int)
         if len(index_profiles) == 0:
             sys.exit('No profile left to plot after applying --list/--exclude')
-        list_profiles = self.nc.variables['PROFILE'][index_profiles].tolist()
-
-        nbxi = len(index_profiles)
-        labelrotation = 15 if nbxi > 15 else 0
-        if xaxis == 'LATITUDE':
-            x_formatter = LatitudeFormatter()
-        elif xaxis == 'LONGITUDE':
-            x_formatter = LongitudeFormatter()
-        else:
-            x_formatter = mdates.DateFormatter('%Y/%m/%d %H:%M')
-            labelrotation = 15
-        for k in range(1, len(self.keys)):
-            var = self.keys[k]
-            x = self.nc.variables[xaxis][index_profiles]
+        if self.session:
+            self.session.selections[cache_key] = index_profiles
+        return index_profiles
+
+    # plot one or more sections
+    def section(self, start, end, xaxis, yscale, exclude,
+                xinterp=None, yinterp=1, clevels=20, autoscale=0, display=None,
+                xinterp_method='linear', xgap=None):
+        """Plot one or more section variables over a profile range."""
+        for task in self.section_tasks(start, end, xaxis, yscale, exclude, xinterp, yinterp,
+                                       clevels, autoscale, display, xinterp_method, xgap):
+            self.render_section(task)
+
+    def section_tasks(self, start, end, xaxis, yscale, exclude,
+                      xinterp=None, yinterp=1, clevels=20, autoscale=0, display=None,
+                      xinterp_method='linear', xgap=None):
+        """Grid the section variables, return one render task per figure to make.
+
+        The profile selection, x coordinates, vertical cutoff and target grid
+        are computed once and shared by all the variables, which are regridded
+        together. With a grid cache, variables gridded by a previous run with
+        the same data and gridding parameters are loaded from it instead, so
+        restyling a section goes straight to contouring. Each task holds
+        everything `render_section` needs, so that tasks can also be rendered
+        by pool workers.
+        """
+        # Y variable, PRES or DEPTH, must be first, add test
+        yaxis = self.keys[0]
+        ymax = np.max(yscale)
+        if not isinstance(autoscale, list):
+            sys.exit("autoscale: bad type {}, value <{}>, should be an integer <0>, <1> or <0 30>".format(
+                type(autoscale), autoscale))
+        with self.timings.stage('read'):
+            index_profiles = self.select_profiles(start, end, exclude)
+            list_profiles = self.read('PROFILE', index_profiles).tolist()
+        # the gridded fields only depend on the data and on these parameters
+        gridding = (xaxis, yaxis, float(ymax), xinterp, yinterp, xinterp_method, xgap)
+
+        def styled(task):
+            """Set the digest and color range of task, return False if its figure is fresh."""
+            var = task['var']
+            # skip the figure if it was already made from the same inputs
+            task['digest'] = input_digest('section', task['data'], yscale, clevels, autoscale,
+                                          bool(display), self.append, self.type, self.attrs(var),
+                                          self.attrs(xaxis), self.attrs(yaxis), self.dpi,
+                                          self.compression)
+            if self.cache.is_fresh(task['figname'], task['digest']) and not self.force:
+                return False
+
+            # contourf indeed works a bit differently than other ScalarMappables.
+            # If you specify the number of levels (20 in this case) it will take
+            # them between the minimum and maximum data (approximately).
+            # If you want to have n levels between two specific values vmin and vmax
+            # you would need to supply those to the contouring function.
+            if len(autoscale) == 2:
+                task['zmin'], task['zmax'] = autoscale
+            elif autoscale[0] == 1:
+                task['zmin'], task['zmax'] = task['zrange']
+            elif autoscale[0] == 0:
+                task['zmin'] = self.attrs(var)['valid_min']
+                task['zmax'] = self.attrs(var)['valid_max']
+            else:
+                sys.exit(
+                    "autoscale: bad value <{}>, should be <0>, <1> or <0 30>".format(autoscale[0]))
+            return True
+
+        stale = []
+        missing = []
+        for var in self.keys[1:]:
+            sep = "_" if self.append else ""
+            figname = '{}{}{}-{}-{}.{}'.format(
+                get_cycle_label(self.nc), sep, self.append, self.type, var, self.fmt)
+            task = dict(var=var, figname=figname, key=None)
+            if self.grids is not None:
+                task['key'] = self.grids.key(self.file, index_profiles, var, *gridding)
+                with self.timings.stage('read', figname):
+                    grid = self.grids.load(task['key'])
+                if grid is not None:
+                    task.update(grid)
+                    if styled(task):
+                        stale.append(task)
+                    continue
+            missing.append(task)
+
+        if missing:
+            with self.timings.stage('read'):
+                x = self.read(xaxis, index_profiles)
+                y = self.read(yaxis, np.s_[index_profiles, :])
+            nbxi = len(index_profiles)
             if xaxis == 'TIME':
-                for i in range(0, len(x)):
-                    x[i] = dt2julian(julian2dt(x[i]))
-            y = self.nc.variables[yaxis][index_profiles, :]
+                # matplotlib date numbers, for the date formatter of the x axis
+                x = julian2num(x)
             # find index of the max value given by yscale
             _, c = np.where(y >= ymax)
             if c.size == 0:
                 sys.exit("invalid --yscale {}, max value must be <= {}".format(yscale.tolist(),
                                                                                np.max(y)))
-            y = self.nc.variables[yaxis][index_profiles, :c[0]]
-            z = self.nc.variables[var][index_profiles, :c[0]]
-            xi = np.linspace(x[0], x[-1], nbxi)
-            yi = np.arange(np.round(np.amin(y)),
-                             np.ceil(np.amax(y))+ yinterp, yinterp)
-            nbyi = len(yi)
+            y = y[:, :c[0]]
+
+            gridded = []
+            for task in missing:
+                with self.timings.stage('read', task['figname']):
+                    z = self.read(task['var'], np.s_[index_profiles, :c[0]])
+                task.update(data=input_digest('grid', x, y, z, list_profiles, *gridding),
+                            zrange=[np.min(z), np.max(z)])
+                if styled(task):
+                    task['z'] = z
+                    gridded.append(task)
+
+            if gridded:
+                xi = np.linspace(x[0], x[-1], nbxi)
+                yi = np.arange(np.round(np.amin(y)),
+                                 np.ceil(np.amax(y))+ yinterp, yinterp)
+
+                # verticale interpolation
+                # Regrid all profiles of all variables on a common vertical axis at once.
+                with self.timings.stage('regrid'):
+                    grids = regrid_profiles(y, np.ma.stack([task.pop('z') for task in gridded]), yi)
+
+                for task, zi in zip(gridded, grids):
+                    # horizontal interpolation
+                    # Optional smoothing along-track when a denser x grid is requested.
+                    if xinterp == None:
+                        task.update(xi=xi, zi=zi.transpose())
+                    else:
+                        with self.timings.stage('interp', task['figname']):
+                            task['xi'], task['zi'] = interpx(xinterp, x, xi, yi, zi,
+                                                             xinterp_method, xgap)
+                    task.update(x=x, yi=yi, list_profiles=list_profiles)
+                    if task['key'] is not None:
+                        with self.timings.stage('write', task['figname']):
+                            self.grids.store(task['key'], task, var=task['var'], xaxis=xaxis,
+                                             yaxis=yaxis, source=os.pathsep.join(
+                                                 os.path.abspath(f) for f in file_list(self.file)))
+                stale += gridded
+
+        order = {var: i for i, var in enumerate(self.keys)}
+        stale.sort(key=lambda task: order[task['var']])
+        for task in stale:
+            task.update(xaxis=xaxis, yscale=yscale, clevels=clevels, display=display)
+        return stale
+
+    def render_section(self, task):
+        """Draw and save the section figure of one task made by `section_tasks`."""
+        var = task['var']
+        x, xi, yi, zi = task['x'], task['xi'], task['yi'], task['zi']
+        zmin, zmax = task['zmin'], task['zmax']
+        xaxis, yscale, clevels, display = (task['xaxis'], task['yscale'], task['clevels'],
+                                           task['display'])
+        yaxis = self.keys[0]
 
-            # contourf indeed works a bit differently than other ScalarMappables.
-            # If you specify the number of levels (20 in this case) it will take
-            # them between the minimum and maximum data (approximately).
-            # If you want to have n levels between two specific values vmin and vmax
-            # you would need to supply those to the contouring function.
-            if not isinstance(autoscale, list):
-                sys.exit("autoscale: bad type {}, value <{}>, should be an integer <0>, <1> or <0 30>".format(
-                    type(autoscale), autoscale))
-            elif len(autoscale) == 2:
-                zmin = autoscale[0]
-                zmax = autoscale[1]
+        with self.timings.stage('draw', task['figname']):
+            labelrotation = 15 if len(x) > 15 else 0
+            if xaxis == 'LATITUDE':
+                load_cartopy()
+                x_formatter = LatitudeFormatter()
+            elif xaxis == 'LONGITUDE':
+                load_cartopy()
+                x_formatter = LongitudeFormatter()
             else:
-                if autoscale[0] == 1:
-                    zmin = np.min(z)
-                    zmax = np.max(z)
-                elif autoscale[0] == 0:
-                    zmin = self.nc.variables[var].valid_min
-                    zmax = self.nc.variables[var].valid_max
-                else:
-                    sys.exit(
-                        "autoscale: bad value <{}>, should be <0>, <1> or <0 30>".format(autoscale[0]))
+                x_formatter = mdates.DateFormatter('%Y/%m/%d %H:%M')
+                labelrotation = 15
 
             levels = np.linspace(zmin, zmax, clevels+1)
             sublevels = np.linspace(zmin, zmax, round(clevels/5)+1)
 
-            # verticale interpolation
-            # Regrid each profile on a common vertical axis before contouring.
-            zi = np.array(([]))
-            for i in range(0, len(z)):
-                # convert fill_value from Dataset to numpy
-                yy = np.ma.masked_array(y[i]).filled(np.nan)
-                zz = np.ma.masked_array(z[i]).filled(np.nan)
-                Z = np.interp(yi, yy, zz)
-                zi = np.append(zi, Z, axis=0)
-            zi = zi.reshape(nbxi, nbyi)
-
-            # horizontal interpolation
-            # Optional smoothing along-track when a denser x grid is requested.
-            if xinterp == None:
-                zi = zi.transpose()
-            else:
-                (xi, zi) = interpx(xinterp, x, xi, yi, zi)
-            
+            with self.timings.stage('contour', task['figname']):
+                contours = SectionContours(xi, yi, zi)
+
             # Specifies the geometry of the grid that a subplot will be placed
             self.fig = plt.figure(figsize=(8, 8))
             # set gridspec ration, one or two subplots
@@ -401,20 +2352,23 @@ class Plots():
                 if i == 0:
                     ax.set_title('{}\n{} {}\n{}, {} [{}]'.format(get_cycle_label(self.nc),
                                                                self.type, self.append.replace('_',' '), 
-                                                               var, self.nc.variables[var].long_name,
-                                                               self.nc.variables[var].units))
+                                                               var, self.attrs(var)['long_name'],
+                                                               self.attrs(var)['units']))
                 # set vertical axes
                 ax.set_ylim(yscale[:]) if yscale.ndim == 1 else ax.set_ylim(
                     yscale[i])
                 ax.invert_yaxis()
                 # plot contour(s)
-                plt1 = ax.contourf(xi, yi, zi, levels=levels, vmin=zmin, vmax=zmax,
-                                   cmap='jet', extend='neither')
-                cs = ax.contour(xi, yi, zi, plt1.levels,
-                                colors='black', linewidths=0.5)
-                cs = ax.contour(xi, yi, zi, sublevels,
-                                colors='black', linewidths=1.5)
-                ax.clabel(cs, inline=True, fmt='%3.1f', fontsize=8)
+                with self.timings.stage('contour', task['figname']):
+                    plt1 = contours.contour_set(ax, levels, filled=True, vmin=zmin, vmax=zmax,
+                                                cmap='jet', extend='neither',
+                                                rasterized=self.rasterized)
+                    cs = contours.contour_set(ax, plt1.levels,
+                                              colors='black', linewidths=0.5)
+                    cs = contours.contour_set(ax, sublevels,
+                                              colors='black', linewidths=1.5)
+                    # only the few sublevels are labelled, on their lines inside the panel
+                    ax.clabel(cs, inline=True, fmt='%3.1f', fontsize=8)
                 # add test for LONGITUDE and TIME
                 ax.set_xticks(
                     np.arange(np.round(np.min(x)), np.ceil(np.max(x))), minor=True)
@@ -429,63 +2383,245 @@ class Plots():
                 ax2 = ax.twiny()
                 ax2.set_xlim(ax.get_xlim())
                 ax2.set_xticks(x)
-                ax2.set_xticklabels(list_profiles, fontsize=6)
+                ax2.set_xticklabels(task['list_profiles'], fontsize=6)
             else:
                 # Matplotlib 2 Subplots, 1 Colorbar
                 # https://stackoverflow.com/questions/13784201/matplotlib-2-subplots-1-colorbar
                 plt.colorbar(plt1, ax=self.fig.axes)
 
-            ax.set_xlabel('{}'.format(self.nc.variables[xaxis].standard_name))
-            ylabel = '{} [{}]'.format(self.nc.variables[yaxis].standard_name,
-                                      self.nc.variables[yaxis].units)
+            ax.set_xlabel('{}'.format(self.attrs(xaxis)['standard_name']))
+            ylabel = '{} [{}]'.format(self.attrs(yaxis)['standard_name'],
+                                      self.attrs(yaxis)['units'])
 
             # display common y label with text instead of ax.set_ylabel
             self.fig.text(0.04, 0.5, ylabel, va='center',
                      ha='center', rotation='vertical')
-            sep = "_" if self.append else ""
-            figname = '{}{}{}-{}-{}.png'.format(
-                get_cycle_label(self.nc), sep, self.append, self.type, var)
-            self.plot(figname)
-
-    def scatters(self):
-        """Plot two surface variables on a map for TSG-like trajectory data."""
-        SSPS = self.nc.variables[self.keys[0]]
-        SSTP = self.nc.variables[self.keys[1]]
+        self.plot(task['figname'], digest=task['digest'])
+
+    def scatters(self, mode='points', cell=4, start=None, end=None, chunk=DEFAULT_TRACK_CHUNK):
+        """Plot two surface variables on a map for TSG-like trajectory data.
+
+        mode `points` draws every sample. `mean`, `median` and `last` bin the
+        samples into a raster of `cell` x `cell` pixel cells drawn as a single
+        mesh, and `thin` only keeps the first sample of each run of samples
+        along the track falling into the same cell. Samples are read `chunk`
+        at a time within the optional [start, end] window, in julian days.
+        """
+        load_cartopy()
         LATITUDE = self.nc.variables[self.dims[1]]
         LONGITUDE = self.nc.variables[self.dims[2]]
         CM = get_cycle_label(self.nc)
-       
-        x1 = min(LONGITUDE) 
-        x2 = max(LONGITUDE) 
-        y1 = min(LATITUDE) 
-        y2 = max(LATITUDE) 
-       
-        area = [x1, x2, y1, y2]
-        self.fig = plt.figure(figsize=(6, 12))
-        gs = gridspec.GridSpec(2,1)
-        ax1 = plt.subplot(gs[0], projection=ccrs.Mercator())
-        ax1.set_extent(area, crs=ccrs.PlateCarree())
-        ax1.coastlines(resolution='auto', color='k')
-        ax1.gridlines(color='lightgrey', linestyle='-', draw_labels=True)
-
-        im1 = ax1.scatter(LONGITUDE[:], LATITUDE[:], c=SSPS[:], s=30, cmap='jet', vmin=32, vmax=37, transform=ccrs.PlateCarree())
-        self.fig.colorbar(im1, ax=ax1, orientation='vertical', pad=0.15)
-        ax1.set(xlabel='{} '.format(LONGITUDE.standard_name), ylabel='{} '.format(LATITUDE.standard_name),
-                title='{} - {}'.format(CM, SSPS.long_name))
-
-        ax2 = plt.subplot(gs[1], projection=ccrs.Mercator())
-        ax2.set_extent(area, crs=ccrs.PlateCarree())
-        ax2.coastlines(resolution='auto', color='k')
-        ax2.gridlines(color='lightgrey', linestyle='-', draw_labels=True)
-
-        im2 = ax2.scatter(LONGITUDE[:], LATITUDE[:], c=SSTP[:], s=30, cmap='jet', vmin=5, vmax=32, transform=ccrs.PlateCarree())
-        self.fig.colorbar(im2, ax=ax2, orientation='vertical', pad=0.15)
-        ax2.set(xlabel='{} '.format(LONGITUDE.standard_name), ylabel='{} '.format(LATITUDE.standard_name),
-                title='{} - {}'.format(CM, SSTP.long_name))
-
-        figname = '{}_TSG_COLCOR_SCATTER.png'.format(CM)
+        figname = '{}_TSG_COLCOR_SCATTER.{}'.format(CM, self.fmt)
+        stage = self.timings.stage
+
+        track = TrackReader(self.nc, self.dims, self.keys, start, end, chunk)
+        with stage('read', figname):
+            area = track.extent()
+        if area is None:
+            sys.exit('No sample left to plot after applying --start/--end')
+
+        with stage('draw', figname):
+            self.fig = plt.figure(figsize=(6, 12))
+            gs = gridspec.GridSpec(2,1)
+            panels = []
+            for i, (key, vmin, vmax) in enumerate(((self.keys[0], 32, 37), (self.keys[1], 5, 32))):
+                ax = plt.subplot(gs[i], projection=ccrs.Mercator())
+                ax.set_extent(area, crs=ccrs.PlateCarree())
+                with stage('coastlines', figname):
+                    # drawn like GeoAxes.coastlines, from the projected path of the map cache
+                    ax.add_collection(mcollections.PathCollection(
+                        [self.maps.coastlines(ax)], facecolor='none', edgecolor='k',
+                        zorder=1.5, transform=ax.transData), autolim=False)
+                ax.gridlines(color='lightgrey', linestyle='-', draw_labels=True)
+                # raster size follows the size of the map on the output image
+                ax.apply_aspect()
+                box = ax.get_position()
+                shape = (max(1, int(box.height * self.fig.bbox.height / cell)),
+                         max(1, int(box.width * self.fig.bbox.width / cell)))
+                panels.append(dict(ax=ax, key=key, vmin=vmin, vmax=vmax, shape=shape, im=None,
+                                   previous=None, raster=None if mode in ('points', 'thin')
+                                   else TrackRaster(area, shape, mode)))
+
+            # a single pass over the samples feeds both panels
+            chunks = track.chunks()
+            while True:
+                with stage('read', figname):
+                    data = next(chunks, None)
+                if data is None:
+                    break
+                lon = data[track.lon]
+                lat = data[track.lat]
+                for panel in panels:
+                    values = data[panel['key']]
+                    if panel['raster'] is not None:
+                        with stage('regrid', figname):
+                            panel['raster'].add(lon, lat, values)
+                        continue
+                    keep = slice(None)
+                    if mode == 'thin':
+                        keep, panel['previous'] = thin_track(lon, lat, area, panel['shape'],
+                                                             panel['previous'])
+                    panel['im'] = panel['ax'].scatter(lon[keep], lat[keep], c=values[keep], s=30,
+                                                      cmap='jet', vmin=panel['vmin'],
+                                                      vmax=panel['vmax'],
+                                                      rasterized=self.rasterized,
+                                                      transform=ccrs.PlateCarree())
+
+            for panel in panels:
+                ax = panel['ax']
+                im = panel['im']
+                if panel['raster'] is not None:
+                    with stage('regrid', figname):
+                        lon_edges, lat_edges, grid = panel['raster'].result()
+                    im = ax.pcolormesh(lon_edges, lat_edges, grid, cmap='jet', vmin=panel['vmin'],
+                                       vmax=panel['vmax'], rasterized=self.rasterized,
+                                       transform=ccrs.PlateCarree())
+                self.fig.colorbar(im, ax=ax, orientation='vertical', pad=0.15)
+                ax.set(xlabel='{} '.format(LONGITUDE.standard_name), ylabel='{} '.format(LATITUDE.standard_name),
+                       title='{} - {}'.format(CM, self.nc.variables[panel['key']].long_name))
+
         self.plot(figname)
 
+    def timeseries(self, start=None, end=None, chunk=DEFAULT_TRACK_CHUNK):
+        """Plot each key against time, in stacked panels sharing the time axis.
+
+        For long 1-D records such as MTO and SND. Samples are read `chunk` at
+        a time within the optional [start, end] window, in julian days, and
+        reduced by `SeriesBins` to at most 4 per pixel column of the panels,
+        so drawing costs the same whatever the length of the record.
+        """
+        CM = get_cycle_label(self.nc)
+        sep = "_" if self.append else ""
+        figname = '{}-{}-TIMESERIES-{}{}{}.{}'.format(
+            CM, self.type, '-'.join(self.keys), sep, self.append, self.fmt)
+        stage = self.timings.stage
+
+        track = TrackReader(self.nc, self.dims, self.keys, start, end, chunk,
+                            names=[self.dims[0]] + [k for k in self.keys if k != self.dims[0]])
+        with stage('read', figname):
+            span = track.time_range()
+        if span is None:
+            sys.exit('No sample left to plot after applying --start/--end')
+
+        with stage('draw', figname):
+            self.fig, axes = plt.subplots(len(self.keys), 1, sharex=True, squeeze=False,
+                                          figsize=(12, 1 + 2.2 * len(self.keys)))
+            axes = axes[:, 0]
+            # the reduction keeps 4 samples per pixel column of the saved image,
+            # its bins are widened to the pixels the panels start and end in
+            dpi = self.dpi or plt.rcParams['savefig.dpi']
+            dpi = self.fig.dpi if dpi == 'figure' else dpi
+            box = axes[0].get_position()
+            left, right = np.array([box.x0, box.x1]) * self.fig.get_figwidth() * dpi
+            per_pixel = (span[1] - span[0]) / (right - left)
+            t0 = span[0] - (left - np.floor(left)) * per_pixel
+            t1 = span[1] + (np.ceil(right) - right) * per_pixel
+            width = int(np.ceil(right) - np.floor(left))
+
+        bins = {key: SeriesBins(t0, t1, width) for key in self.keys}
+        chunks = track.chunks()
+        while True:
+            with stage('read', figname):
+                data = next(chunks, None)
+            if data is None:
+                break
+            with stage('downsample', figname):
+                for key in self.keys:
+                    bins[key].add(data[track.time], data[key])
+        with stage('downsample', figname):
+            series = [bins[key].result() for key in self.keys]
+        header = '{}, {}, {} to {}'.format(CM, self.type, *format_julian(np.array(span)))
+
+        # skip the figure if it was already made from the same reduced series
+        digest = input_digest('timeseries', *[a for pair in series for a in pair], width, header,
+                              self.keys, self.colors, self.grid,
+                              [self.attrs(key) for key in self.keys], self.dpi, self.compression)
+        if self.cache.is_fresh(figname, digest) and not self.force:
+            plt.close(self.fig)
+            return
+
+        with stage('draw', figname):
+            for i, (ax, key, (t, v)) in enumerate(zip(axes, self.keys, series)):
+                attrs = self.attrs(key)
+                ax.plot(julian2num(t), v, self.colors[i % len(self.colors)], linewidth=0.8,
+                        rasterized=self.rasterized)
+                label = attrs.get('long_name', key)
+                if 'units' in attrs:
+                    label = '{} [{}]'.format(label, attrs['units'])
+                ax.set_ylabel(textwrap.fill(label, 24))
+                if self.grid:
+                    ax.grid()
+            axes[0].set_xlim(julian2num(span[0]), julian2num(span[1]))
+            axes[0].set_title(header)
+            axes[-1].xaxis.set_major_locator(mdates.AutoDateLocator())
+            axes[-1].xaxis.set_major_formatter(mdates.DateFormatter('%Y/%m/%d'))
+            axes[-1].set_xlabel(self.attrs(self.dims[0]).get('long_name', self.dims[0]))
+            self.fig.align_ylabels(axes)
+        self.plot(figname, digest=digest)
+
+# parallel rendering
+# Each pool worker builds its own Plots instance, hence its own Dataset and
+# matplotlib state, once in the initializer, then renders tasks sent by main().
+_WORKER_PLOTS = None
+
+
+def _init_worker(plots_args, timings=(False, False)):
+    """Open a private Plots instance in a pool worker process.
+
+    timings tells whether stages are timed and their memory traced.
+    """
+    global _WORKER_PLOTS
+    enabled, memory = timings
+    _WORKER_PLOTS = Plots(**plots_args, timings=Timings(enabled, memory,
+                                                       label=plots_args['file']))
+
+
+def _render_profile(profile):
+    """Render one profile in a pool worker.
+
+    Return its render cache entries and stage timings.
+    """
+    _WORKER_PLOTS.profiles(profile)
+    _WORKER_PLOTS.flush()
+    return _WORKER_PLOTS.cache.take_pending(), _WORKER_PLOTS.timings.take_records()
+
+
+def _render_section(task):
+    """Render one section figure gridded by the parent in a pool worker.
+
+    Return its render cache entries and stage timings.
+    """
+    _WORKER_PLOTS.render_section(task)
+    _WORKER_PLOTS.flush()
+    return _WORKER_PLOTS.cache.take_pending(), _WORKER_PLOTS.timings.take_records()
+
+
+def render_parallel(plots_args, func, tasks, jobs, timings=None):
+    """Spread tasks over a pool of `jobs` worker processes.
+
+    Tasks are submitted one by one so that idle workers pick up the next one,
+    which balances profiles of very different depths. The first worker error
+    cancels pending tasks and is raised again in the parent process. Return
+    the results of the tasks, in completion order. Workers time their stages
+    like the `Timings` instance timings, when given.
+    """
+    flags = (timings.enabled, timings.memory) if timings else (False, False)
+    # spawn gives the same fresh-interpreter workers on Linux and Windows
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx,
+                             initializer=_init_worker,
+                             initargs=(plots_args, flags)) as pool:
+        futures = [pool.submit(func, task) for task in tasks]
+        results = []
+        try:
+            for future in as_completed(futures):
+                results.append(future.result())
+        except BaseException:
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+    return results
+
+
 def processArgs():
     """Build the command-line parser used by the plotting script."""
     parser = argparse.ArgumentParser(
@@ -503,17 +2639,31 @@ def processArgs():
         'python plots.py netcdf/OS_PIRATA-FR31_XBT.nc -t XBT -s -k DEPTH TEMP -xaxis LATITUDE\n'
         'python plots.py netcdf/OS_PIRATA-FR31_XBT.nc -t XBT -s -k DEPTH TEMP -xaxis TIME -l 29 36\n'
         'python plots.py netcdf/OS_AMAZOMIX_TSG.nc -t TSG --scatter  -k SSPS SSTP -o plots/AMAZOMIX\n'
+        'python plots.py netcdf/OS_PIRATA-FR31_TSG.nc -t TSG --scatter  -k SSPS SSTP --start 2021-03-05 --end 2021-03-20\n'
+        'OVERLAY:\n'
+        'python plots.py netcdf/OS_PIRATA-FR31_XBT.nc -t XBT --overlay --overlay-color time -k DEPTH TEMP DENS SVEL -l 1 66\n'
+        'TIME SERIES:\n'
+        'python plots.py netcdf/OS_PIRATA-FR31_MTO.nc -t MTO --timeseries -k ATMS DRYT RELH WMSP\n'
+        'python plots.py netcdf/OS_PIRATA-FR31_SND.nc -t SND --timeseries -k BATH --start 2021-03-05 --end 2021-03-20\n'
+        'SEVERAL FILES:\n'
+        'python plots.py "netcdf/OS_*_TSG.nc" -t TSG --scatter -k SSPS SSTP --jobs 2\n'
+        'python plots.py leg1_XBT.nc leg2_XBT.nc -t XBT -s -k DEPTH TEMP --xaxis LATITUDE --aggregate\n'
+        'WATCH:\n'
+        'python plots.py netcdf/OS_PIRATA-FR31_CTD.nc -t CTD -p -s -k PRES TEMP --xaxis LATITUDE --watch --watch-interval 5\n'
+        'BATCH:\n'
+        'python plots.py --batch examples/jobs.txt\n'
+        'SERVER:\n'
+        'python plots.py --serve 8765 --jobs 2\n'
         ' \n',
         formatter_class=argparse.RawTextHelpFormatter,
         epilog='J. Grelet IRD US191 - March 2021 / April 2021')
-    parser.add_argument('files',
-                        help='netcdf file to parse')
+    parser.add_argument('files', nargs='*',
+                        help='netcdf file(s) or glob pattern(s) to parse')
     parser.add_argument('-a', '--append', default="",
                         help='string to append in output filename')
     parser.add_argument('-t', '--type',
-                        choices=['CTD', 'XBT', 'ADCP', 'TSG'],
-                        required=True,
-                        help='select type instrument CTD, XBT, LADCP, TSG')
+                        choices=['CTD', 'XBT', 'ADCP', 'TSG', 'MTO', 'SND'],
+                        help='select type instrument CTD, XBT, LADCP, TSG, MTO, SND')
     parser.add_argument('-p', '--profiles', '--profile',
                         action='store_true',
                         help='plot profiles')
@@ -531,16 +2681,39 @@ def processArgs():
                         help='select colors, ex: k- b- r- m- g-')
     parser.add_argument('-f', '--force',
                         action='store_true',
-                        help='force graphic output even if the file exist')
+                        help='force graphic output even if the file is up to date')
     parser.add_argument('-g', '--grid',
                         action='store_true',
                         help='add grid')
     parser.add_argument('-s', '--sections', '--section',
                         action='store_true',
                         help='plot sections')
+    parser.add_argument('--overlay', action='store_true',
+                        help='plot the selected profiles on a single figure')
+    parser.add_argument('--overlay-color', choices=['key', 'time', 'latitude'], default='key',
+                        help='color the lines of --overlay by key, time or latitude '
+                        '(default: %(default)s)')
     parser.add_argument('--scatters', '--scatter',
                         action='store_true',
                         help='plot scatters')
+    parser.add_argument('--timeseries',
+                        action='store_true',
+                        help='plot time series of 1-D records, such as MTO and SND')
+    parser.add_argument('--scatter-mode', choices=['points', 'mean', 'median', 'last', 'thin'],
+                        default='points',
+                        help=textwrap.dedent('''\
+        points:     draw every sample (default)
+        mean, median, last: draw samples binned into a raster
+        thin:       draw one sample per raster cell along track'''))
+    parser.add_argument('--cell', type=int, default=4,
+                        help='raster cell size in pixels for --scatter-mode')
+    parser.add_argument('--start', type=parse_time,
+                        help='first date plotted, ex: 2021-03-05T12:00 or julian days')
+    parser.add_argument('--end', type=parse_time,
+                        help='last date plotted, ex: 2021-03-20 or julian days')
+    parser.add_argument('--chunk', type=int, default=DEFAULT_TRACK_CHUNK,
+                        help='number of samples read at a time by --scatter and --timeseries '
+                        '(default: %(default)s)')
     parser.add_argument('--dims', '--dimensions',
                         nargs='+', default=DEFAULT_DIMS,
                         help='give dimensions name, ex: TIME, LATITUDE, LONGITUDE')
@@ -551,6 +2724,14 @@ def processArgs():
                         help='select vartical scale for sections, ex: 0 2000 or 0 250 250 2000')
     parser.add_argument('--xinterp', type=int, default=None,
                         help='horizontal interpolation points')
+    parser.add_argument('--xinterp-method', choices=['linear', 'gap', 'griddata'],
+                        default='linear',
+                        help=textwrap.dedent('''\
+        linear:     interpolate between neighbouring profiles (default)
+        gap:        bridge missing values, up to --xgap x units
+        griddata:   former scipy griddata interpolation'''))
+    parser.add_argument('--xgap', type=float, default=None,
+                        help='largest x distance bridged by --xinterp-method gap')
     parser.add_argument('--yinterp', type=int, default=1,
                         help='vertical interpolation step, none plot raw data')
     parser.add_argument('--clevels', type=int, default=20,
@@ -570,37 +2751,166 @@ def processArgs():
                         help='output path, default is plots/')
     parser.add_argument('-d', '--debug', help='display debug informations',
                         action='store_true')
+    parser.add_argument('--store', action='store_true',
+                        help='keep profile variables in memory, within --store-budget')
+    parser.add_argument('--store-budget', type=float, default=DEFAULT_STORE_BUDGET, metavar='MB',
+                        help='memory of --store in MB, larger variables are read from the file '
+                        '(default: %(default)s)')
+    parser.add_argument('--template', action='store_true',
+                        help='build the profile figure once and only update its data')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes for profiles and sections, 0 for all cores')
+    parser.add_argument('--grid-cache', action='store_true',
+                        help='keep gridded sections in {} in the output path, so that restyling '
+                        'runs do not regrid'.format(GRID_CACHE_NAME))
+    parser.add_argument('--grid-cache-dir', metavar='DIR',
+                        help='keep the grids of --grid-cache in DIR instead')
+    parser.add_argument('--grid-cache-size', type=float, default=DEFAULT_GRID_CACHE_BUDGET,
+                        metavar='MB', help='size of the grid cache beyond which the least recently '
+                        'used grids are removed (default: %(default)s)')
+    parser.add_argument('--coastlines', metavar='SHP',
+                        help='coastlines of scatter maps, from a shapefile or a directory of '
+                        'Natural Earth shapefiles laid out as in the cartopy data directory')
+    parser.add_argument('--no-map-cache', action='store_true',
+                        help='project the coastlines of scatter maps again on every run, instead '
+                        'of keeping them in {} in the output path'.format(MAP_CACHE_NAME))
+    parser.add_argument('--reader', choices=['netcdf4', 'mmap'], default='netcdf4',
+                        help='read classic NetCDF files with netCDF4, or memory map them '
+                        '(other formats are always read by netCDF4)')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running, plot new profiles and the sections holding them '
+                        'each time the files grow')
+    parser.add_argument('--watch-interval', type=float, default=2.0, metavar='SECONDS',
+                        help='polling interval of --watch (default: %(default)s)')
+    parser.add_argument('--aggregate', action='store_true',
+                        help='plot the profiles of all the files as a single dataset, '
+                        'ex: a section over consecutive legs')
+    parser.add_argument('--archive', metavar='FILE',
+                        help='write all the figures of a run into a single .zip or .tar file, '
+                        'appended to on later runs, or a multipage .pdf file')
+    parser.add_argument('--format', dest='fmt', choices=OUTPUT_FORMATS, default='png',
+                        help='image format of the figures, contour fills and markers are '
+                        'rasterized in pdf and svg')
+    parser.add_argument('--dpi', type=float,
+                        help='resolution of the figures, default is the figure dpi (100)')
+    parser.add_argument('--png-compression', type=int, choices=range(10), metavar='0-9',
+                        help='zlib compression level of png figures, 1 is fastest (default: 6)')
+    parser.add_argument('--async-write', action='store_true',
+                        help='compress and write each figure on a background thread while '
+                        'the next one is drawn')
+    parser.add_argument('--timings', action='store_true',
+                        help='time the open, read, regrid, draw, encode and write stages of each '
+                        'figure and print a summary')
+    parser.add_argument('--timings-file', metavar='FILE',
+                        help='with --timings, append JSON lines to FILE instead of the summary')
+    parser.add_argument('--timings-memory', action='store_true',
+                        help='with --timings, also trace the peak memory of each stage (slower)')
+    parser.add_argument('--batch', metavar='MANIFEST',
+                        help='run every job of a JSON, YAML or text manifest in one process')
+    parser.add_argument('--serve', nargs='?', type=int, const=DEFAULT_SERVE_PORT, metavar='PORT',
+                        help='serve figures rendered in memory on localhost:PORT, keeping datasets '
+                        'open, see README (default: %(const)s)')
+    parser.add_argument('--serve-cache', type=float, default=DEFAULT_SERVE_CACHE, metavar='MB',
+                        help='memory of the --serve figure cache, least recently used figures '
+                        'are dropped beyond it (default: %(default)s)')
     return parser
 
 def validate_args(args, parser):
     """Validate combinations that argparse alone cannot express cleanly."""
-    if not (args.profiles or args.sections or args.scatters):
-        parser.error('one plotting mode is required: --profiles, --sections or --scatter')
+    if args.serve is not None:
+        if args.jobs < 0:
+            parser.error('--jobs expects a positive number, or 0 for all cores')
+        if args.serve_cache <= 0:
+            parser.error('--serve-cache expects a positive size in MB')
+    if args.batch is not None or args.serve is not None:
+        return
+    if not args.files:
+        parser.error('the following arguments are required: files')
+    if args.type is None:
+        parser.error('the following arguments are required: -t/--type')
+    if not (args.profiles or args.sections or args.overlay or args.scatters or args.timeseries):
+        parser.error('one plotting mode is required: --profiles, --sections, --overlay, '
+                     '--scatter or --timeseries')
+    if args.timeseries and (args.profiles or args.sections or args.overlay or args.scatters):
+        parser.error('--timeseries cannot be combined with another plotting mode')
     if args.keys is None:
         parser.error('--keys is required')
-    if len(args.keys) < 2:
+    if len(args.keys) < (1 if args.timeseries else 2):
         parser.error('--keys expects at least 2 values')
     if args.profiles and len(args.keys) < 2:
         parser.error('profiles require at least 2 keys')
     if args.sections and len(args.keys) < 2:
         parser.error('sections require at least 2 keys')
+    if args.overlay and args.scatters:
+        parser.error('--overlay applies to profile files, not to --scatter')
     if args.scatters and len(args.keys) != 2:
         parser.error('scatter plots require exactly 2 keys')
     if len(args.dims) != 3:
         parser.error('--dims expects exactly 3 dimension names')
+    if args.start is not None and args.end is not None and args.start > args.end:
+        parser.error('--start must be before --end')
+    if args.cell < 1:
+        parser.error('--cell expects a positive size in pixels')
+    if args.chunk < 1:
+        parser.error('--chunk expects a positive number of samples')
+    if args.jobs < 0:
+        parser.error('--jobs expects a positive number, or 0 for all cores')
+    if args.jobs != 1 and args.screen:
+        parser.error('--jobs cannot be used with --screen')
+    if args.watch_interval <= 0:
+        parser.error('--watch-interval expects a positive polling interval')
+    if args.watch and args.screen:
+        parser.error('--watch cannot be used with --screen')
+    if args.aggregate and (args.scatters or args.timeseries):
+        parser.error('--aggregate applies to profiles and sections only')
+    if args.timings_memory and not args.timings:
+        parser.error('--timings-memory requires --timings')
+    if args.timings_file is not None and not args.timings:
+        parser.error('--timings-file requires --timings')
+    if args.coastlines is not None and not os.path.exists(args.coastlines):
+        parser.error('--coastlines: no such file or directory: {}'.format(args.coastlines))
+    if args.grid_cache_dir is not None and not args.grid_cache:
+        parser.error('--grid-cache-dir requires --grid-cache')
+    if args.store_budget <= 0:
+        parser.error('--store-budget expects a positive size in MB')
+    if args.grid_cache_size <= 0:
+        parser.error('--grid-cache-size expects a positive size in MB')
+    if args.dpi is not None and args.dpi <= 0:
+        parser.error('--dpi expects a positive resolution')
+    if args.png_compression is not None and args.fmt != 'png':
+        parser.error('--png-compression only applies to --format png')
+    if args.archive is not None:
+        if os.path.splitext(args.archive)[1].lower() not in Archive.KINDS:
+            parser.error('--archive expects a .zip, .tar or .pdf file')
+        if args.jobs != 1 or args.screen:
+            parser.error('--archive cannot be used with --jobs or --screen')
+        if args.watch and args.archive.lower().endswith('.pdf'):
+            # each update would write the PDF again, with its new figures only
+            parser.error('--watch cannot append to a .pdf --archive, use a .zip or .tar file')
+    if args.async_write and args.screen:
+        parser.error('--async-write cannot be used with --screen')
 
 
 def resolve_output_path(args):
     """Resolve the output directory from explicit CLI input or plotting mode."""
     if args.out is not None:
         return args.out
-    if args.profiles:
+    if args.profiles or args.overlay:
         return DEFAULT_OUTPUT_PATHS['profiles']
     if args.sections:
         return DEFAULT_OUTPUT_PATHS['sections']
+    if args.timeseries:
+        return DEFAULT_OUTPUT_PATHS['timeseries']
     return DEFAULT_OUTPUT_PATHS['scatters']
 
 
+def resolve_grid_cache(args, output_path):
+    """Return the directory of the grid cache, None when it is disabled."""
+    if not args.grid_cache:
+        return None
+    return args.grid_cache_dir or os.path.join(output_path, GRID_CACHE_NAME)
+
+
 def resolve_profile_range(profile_ids, selection):
     """Resolve the requested profile interval from dataset bounds and --list."""
     start = int(profile_ids[0])
@@ -614,13 +2924,591 @@ def resolve_profile_range(profile_ids, selection):
     raise ValueError('--list expects one or two profile numbers')
 
 
-def main(argv=None):
+def load_manifest(path):
+    """Read a batch manifest and return one argv list per job.
+
+    JSON and YAML manifests hold a list of jobs, or a mapping with a `jobs`
+    list. Each job is either a command line string or a list of arguments.
+    Any other file is read as text, one command line per line, so the
+    commands of a shell script such as examples/python-plots.sh can be
+    pasted as is. Environment variables are expanded in every argument.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, encoding='utf-8') as fid:
+        if ext == '.json':
+            jobs = json.load(fid)
+        elif ext in ('.yml', '.yaml'):
+            try:
+                import yaml
+            except ImportError:
+                sys.exit('YAML manifest {} requires the pyyaml package'.format(path))
+            jobs = yaml.safe_load(fid)
+        else:
+            jobs = [line for line in fid
+                    if line.strip() and not line.lstrip().startswith('#')]
+    if isinstance(jobs, dict):
+        jobs = jobs.get('jobs', [])
+
+    argvs = []
+    for job in jobs:
+        argv = shlex.split(job) if isinstance(job, str) else [str(a) for a in job]
+        argv = [os.path.expandvars(a) for a in argv]
+        # allow lines copied from shell scripts, starting with the program name
+        if argv and os.path.basename(argv[0]) in ('python', 'python3'):
+            argv = argv[1:]
+        if argv and os.path.basename(argv[0]) == 'plots.py':
+            argv = argv[1:]
+        if argv:
+            argvs.append(argv)
+    return argvs
+
+
+def run_batch(manifest):
+    """Run every job of a manifest in this process and report wall times.
+
+    Jobs share a single `Session`, so a file opened by one job and the
+    profile ranges it resolved are reused by the following ones.
+    """
+    jobs = load_manifest(manifest)
+    session = Session()
+    failures = 0
+    t_start = time.perf_counter()
+    try:
+        for n, argv in enumerate(jobs, start=1):
+            t_job = time.perf_counter()
+            if '--batch' in argv:
+                status = 'nested --batch is not allowed'
+            else:
+                try:
+                    status = main(argv, session=session)
+                except SystemExit as exc:
+                    status = exc.code
+                except Exception as exc:
+                    # a broken job, ex: an unknown variable, must not stop the batch
+                    status = '{}: {}'.format(type(exc).__name__, exc)
+            elapsed = time.perf_counter() - t_job
+            if status:
+                failures += 1
+                print('Job {}/{} failed in {:.2f}s: {} ({})'.format(
+                    n, len(jobs), elapsed, ' '.join(argv), status), file=sys.stderr)
+            else:
+                print('Job {}/{} done in {:.2f}s: {}'.format(
+                    n, len(jobs), elapsed, ' '.join(argv)))
+    finally:
+        session.close()
+    print('Batch: {} job(s), {} failed, total {:.2f}s'.format(
+        len(jobs), failures, time.perf_counter() - t_start))
+    return 1 if failures else 0
+
+
+def run_file(args, file, path, session=None, timings=None, known=None, images=None,
+             archive=None):
+    """Plot file, or the list of files aggregated, as requested by args.
+
+    When known holds the profile IDs plotted by a previous run, only the
+    other profiles are plotted, and sections only when their range holds
+    one of them. When images is a dict, figures are encoded into it instead
+    of files. archive is an open Archive replacing the one of args.archive.
+    Return the Plots instance, once every figure is written. Its render
+    cache is left for the caller to save.
+    """
+    jobs = args.jobs or os.cpu_count() or 1
+    store = args.store_budget if args.store else None
+
+    # instanciate plots class
+    plots_args = dict(file=file, dims=args.dims, keys=args.keys, ti=args.type,
+                      colors=args.colors, append=args.append, output_path=path,
+                      force=args.force, grid=args.grid, screen=args.screen,
+                      store=store, template=args.template, fmt=args.fmt, dpi=args.dpi,
+                      compression=args.png_compression, async_write=args.async_write,
+                      grid_cache=resolve_grid_cache(args, path),
+                      grid_cache_size=args.grid_cache_size, reader=args.reader,
+                      map_cache=None if args.no_map_cache else os.path.join(path, MAP_CACHE_NAME),
+                      coastlines=args.coastlines, archive=archive or args.archive)
+    p = Plots(**plots_args, session=session, timings=timings, images=images)
+    try:
+        if args.scatters:
+            p.scatters(args.scatter_mode, args.cell, args.start, args.end, args.chunk)
+        elif args.timeseries:
+            p.timeseries(args.start, args.end, args.chunk)
+        else:
+
+            # set first and last profiles or all profiles
+            profiles = list(p.profile_rows())
+            exclude = list(args.exclude)
+            if args.start is not None or args.end is not None:
+                inside = set(p.profiles_between(args.start, args.end))
+                if not inside:
+                    sys.exit('No profile left to plot after applying --start/--end')
+                # profiles out of the time window are excluded from sections
+                exclude += [i for i in profiles if i not in inside]
+                profiles = [i for i in profiles if i in inside]
+            start, end = resolve_profile_range(profiles, args.list)
+            new = [i for i in profiles if known is None or i not in known]
+
+            # plot profiles
+            if args.profiles:
+                ids = [int(s) for s in new if start <= s <= end]
+                if jobs > 1:
+                    for entries, records in render_parallel(plots_args, _render_profile, ids,
+                                                            jobs, timings):
+                        p.cache.update(entries)
+                        p.timings.extend(records)
+                else:
+                    for s in ids:
+                        p.profiles(s)
+                    p.close_figures()
+
+            if args.sections and (known is None or any(start <= i <= end for i in new)):
+                section_args = (start, end, args.xaxis, args.yscale, exclude, args.xinterp,
+                                args.yinterp, args.clevels, args.autoscale, args.display,
+                                args.xinterp_method, args.xgap)
+                if jobs > 1 and len(args.keys) > 2:
+                    # grid once in this process, render the figures in the workers
+                    tasks = p.section_tasks(*section_args)
+                    for entries, records in render_parallel(plots_args, _render_section, tasks,
+                                                            jobs, timings):
+                        p.cache.update(entries)
+                        p.timings.extend(records)
+                else:
+                    p.section(*section_args)
+
+            if args.overlay and (known is None or any(start <= i <= end for i in new)):
+                p.overlay(start, end, exclude, args.overlay_color)
+    finally:
+        # the queued images are still written and the thread stopped after an error
+        if p.writer is not None:
+            p.writer.close()
+    return p
+
+
+def _run_file_worker(args, file, path, timings):
+    """Plot one file of several in a pool worker, then close it.
+
+    Return the render cache entries, stage timings and profile store report.
+    """
+    enabled, memory = timings
+    p = run_file(args, file, path, timings=Timings(enabled, memory, label=file))
+    p.nc.close()
+    return p.cache.take_pending(), p.timings.take_records(), p.store and p.store.report()
+
+
+def run_files(args, files, path, timings=None, archive=None):
+    """Plot each of several files with the same options, return the number of failures.
+
+    With --jobs, files are spread over a pool of worker processes, each
+    plotting one file at a time, so that no more than `jobs` files are open
+    at once. Otherwise files are plotted one after the other, each closed
+    before the next is opened. A failing file is reported and the others
+    are still plotted. The figures of every file go into archive, when
+    given, which is left for the caller to save.
+    """
+    jobs = min(args.jobs or os.cpu_count() or 1, len(files))
+    # each file is plotted by a single process
+    args = argparse.Namespace(**dict(vars(args), jobs=1))
+    cache = RenderCache(path)
+    failures = 0
+
+    def failed(file, error):
+        nonlocal failures
+        failures += 1
+        print('File {} failed: {}'.format(file, error), file=sys.stderr)
+
+    if jobs > 1:
+        flags = (timings.enabled, timings.memory) if timings else (False, False)
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx) as pool:
+            futures = {pool.submit(_run_file_worker, args, file, path, flags): file
+                       for file in files}
+            for future in as_completed(futures):
+                try:
+                    entries, records, report = future.result()
+                except (Exception, SystemExit) as exc:
+                    failed(futures[future], exc)
+                    continue
+                cache.update(entries)
+                if timings is not None:
+                    timings.extend(records)
+                if report:
+                    print(report)
+    else:
+        for file in files:
+            if timings is not None:
+                timings.label = file
+            try:
+                p = run_file(args, file, path, timings=timings, archive=archive)
+            except (Exception, SystemExit) as exc:
+                failed(file, exc)
+                continue
+            p.nc.close()
+            if p.archive is None:
+                cache.update(p.cache.take_pending())
+            if p.store:
+                print(p.store.report())
+    cache.save()
+    return failures
+
+
+def file_state(file):
+    """Return the size and modification time of file, or of each aggregated file."""
+    return tuple((st.st_size, st.st_mtime_ns) for st in map(os.stat, file_list(file)))
+
+
+def watch(args, targets, path, session, timings=None):
+    """Plot targets, then plot what is new each time one of them grows, until interrupted.
+
+    targets are files, or a list of aggregated files. The size and
+    modification time of every target are polled each `args.watch_interval`
+    seconds, and a changed target is read again once it was left unchanged
+    for a whole poll, so a file being written is not read half way. Other
+    datasets stay open in the session. Only the profiles absent from the
+    previous run are plotted, and sections only when their range holds
+    new profiles.
+    """
+    known = {}
+    state = {}
+
+    def update(target, key):
+        t0 = time.perf_counter()
+        try:
+            p = run_file(args, target, path, session, timings, known.get(key))
+        except (Exception, SystemExit) as exc:
+            print('Update of {} failed: {}'.format(target, exc), file=sys.stderr)
+            return
+        p.cache.save()
+        count = ''
+        if not (args.scatters or args.timeseries):
+            profiles = set(p.profile_rows())
+            if key in known:
+                count = ', {} new profile(s)'.format(len(profiles - known[key]))
+            known[key] = profiles
+        print('Updated {} in {:.2f}s{}'.format(target, time.perf_counter() - t0, count))
+
+    for target in targets:
+        key = tuple(file_list(target))
+        state[key] = file_state(target)
+        update(target, key)
+    print('Watching {} file(s) every {}s, press Ctrl-C to stop'.format(
+        len(state), args.watch_interval))
+    pending = {}
+    try:
+        while True:
+            time.sleep(args.watch_interval)
+            for target in targets:
+                key = tuple(file_list(target))
+                try:
+                    now = file_state(target)
+                except OSError:
+                    # the file is being replaced
+                    continue
+                if now == state[key]:
+                    continue
+                if pending.get(key) != now:
+                    pending[key] = now
+                    continue
+                del pending[key]
+                state[key] = now
+                session.forget(target)
+                update(target, key)
+    except KeyboardInterrupt:
+        print('Stopped watching')
+    return 0
+
+
+# render server
+class FigureCache():
+    """Keep rendered figures in memory, dropping the least recently used beyond a budget.
+
+    Entries map a request key to the dict of its encoded figures, budget is
+    in MB. Handler threads share the cache.
+    """
+    def __init__(self, budget=DEFAULT_SERVE_CACHE):
+        self.budget = int(budget * 1048576)
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the figures of key, or None."""
+        with self.lock:
+            images = self.entries.get(key)
+            if images is None:
+                self.misses += 1
+            else:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            return images
+
+    def put(self, key, images):
+        """Keep images for key, unless they alone exceed the budget."""
+        size = sum(len(b) for b in images.values())
+        if size > self.budget:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = images
+            self.nbytes += size
+            while self.nbytes > self.budget:
+                _, old = self.entries.popitem(last=False)
+                self.nbytes -= sum(len(b) for b in old.values())
+
+    def stats(self):
+        """Return the counters of the cache, as served by /stats."""
+        with self.lock:
+            return {'entries': len(self.entries), 'mb': round(self.nbytes / 1048576.0, 2),
+                    'budget_mb': round(self.budget / 1048576.0, 2),
+                    'hits': self.hits, 'misses': self.misses}
+
+
+def parse_request(argv):
+    """Parse the plots.py arguments of a render request.
+
+    Return the arguments and the expanded files, raise ValueError with the
+    parser message when the request is invalid or cannot be served.
+    """
+    parser = processArgs()
+
+    def error(message):
+        raise ValueError(message)
+
+    # handler threads share sys.stderr, raise instead of printing the usage
+    parser.error = error
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit:
+        raise ValueError('--help cannot be used in a render request') from None
+    validate_args(args, parser)
+    for option, value in (('--batch', args.batch is not None), ('--watch', args.watch),
+                          ('--serve', args.serve is not None), ('--timings', args.timings),
+                          ('--archive', args.archive is not None),
+                          ('--grid-cache', args.grid_cache)):
+        if value:
+            raise ValueError('{} cannot be used in a render request'.format(option))
+    if args.screen:
+        raise ValueError('--screen cannot be used in a render request')
+    files = expand_files(args.files)
+    for file in files:
+        if not os.path.isfile(file):
+            raise ValueError('no such file: {}'.format(file))
+    if len(files) > 1 and not args.aggregate:
+        raise ValueError('several files are only rendered with --aggregate')
+    return args, files
+
+
+def request_state(file):
+    """Return the file_state of a requested file, raise ValueError when it is unreadable."""
+    try:
+        return file_state(file)
+    except OSError as exc:
+        raise ValueError('cannot read {}: {}'.format(exc.filename, exc.strerror)) from None
+
+
+def render_request(argv, session, states):
+    """Render the figures of a plots.py command line in memory, in this process.
+
+    Return a dict mapping figure names to encoded images. Datasets stay
+    open in session between requests, a file whose size or modification
+    time differs from the one recorded in states is opened again. Errors
+    caused by the request are raised as ValueError.
+    """
+    args, files = parse_request(argv)
+    if args.colors is None:
+        args.colors = DEFAULT_COLORS.copy()
+    # figures are made again for each request, in this process, never written
+    args.force = True
+    args.jobs = 1
+    args.async_write = False
+    args.no_map_cache = True
+    target = files if args.aggregate else files[0]
+    key = tuple(os.path.abspath(f) for f in files)
+    state = request_state(target)
+    if states.get(key, state) != state:
+        session.forget(target)
+    states[key] = state
+    images = {}
+    try:
+        run_file(args, target, resolve_output_path(args), session, images=images)
+    except SystemExit as exc:
+        raise ValueError(str(exc.code)) from None
+    return images
+
+
+_SERVER_SESSION = None
+_SERVER_STATES = {}
+
+
+def _init_server_worker():
+    """Open the session a render worker keeps for all its requests."""
+    global _SERVER_SESSION
+    _SERVER_SESSION = Session()
+    load_pyplot([])
+
+
+def _serve_request(argv):
+    """Render one request in a pool worker, see `render_request`."""
+    return render_request(argv, _SERVER_SESSION, _SERVER_STATES)
+
+
+class RenderServer(ThreadingHTTPServer):
+    """Serve figures rendered from plots.py command lines, see `serve`.
+
+    With jobs 1, figures are rendered in this process one at a time,
+    otherwise by a pool of jobs worker processes, each keeping its own
+    datasets open. Handler threads answer cached figures meanwhile.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, jobs=1, cache=DEFAULT_SERVE_CACHE):
+        super().__init__(address, RenderHandler)
+        self.cache = FigureCache(cache)
+        # requests being rendered, so that identical ones wait instead of rendering again
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.pool = None
+        self.session = None
+        if jobs > 1:
+            self.pool = multiprocessing.get_context('spawn').Pool(
+                jobs, initializer=_init_server_worker)
+        else:
+            self.session = Session()
+            self.states = {}
+            self.lock = threading.Lock()
+
+    def render(self, argv):
+        """Return the figures of argv and whether they came from the cache."""
+        _, files = parse_request(argv)
+        key = (tuple(argv), tuple(request_state(f) for f in files))
+        images = self.cache.get(key)
+        if images is not None:
+            return images, True
+        with self.pending_lock:
+            done = self.pending.get(key)
+            if done is None:
+                self.pending[key] = threading.Event()
+        if done is not None:
+            done.wait()
+            images = self.cache.get(key)
+            if images is not None:
+                return images, True
+        try:
+            if self.pool is not None:
+                images = self.pool.apply(_serve_request, (argv,))
+            else:
+                with self.lock:
+                    images = render_request(argv, self.session, self.states)
+            self.cache.put(key, images)
+        finally:
+            if done is None:
+                with self.pending_lock:
+                    self.pending.pop(key).set()
+        return images, False
+
+    def server_close(self):
+        super().server_close()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+        if self.session is not None:
+            self.session.close()
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+    """Answer GET /render?args=<command line>, POST /render and GET /stats."""
+
+    def log_message(self, fmt, *args):
+        logging.debug('%s ' + fmt, self.address_string(), *args)
+
+    def reply(self, status, body, content_type='text/plain; charset=utf-8', headers=()):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/stats':
+            self.reply(200, json.dumps(self.server.cache.stats()), 'application/json')
+        elif url.path == '/render':
+            self.answer(shlex.split(query.get('args', [''])[0]), query.get('figure', [None])[0])
+        else:
+            self.reply(404, 'unknown path {}\n'.format(url.path))
+
+    def do_POST(self):
+        if urlsplit(self.path).path != '/render':
+            self.reply(404, 'unknown path {}\n'.format(self.path))
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            argv = [str(a) for a in request['argv']]
+        except (ValueError, KeyError, TypeError):
+            self.reply(400, 'expected a JSON object with an argv list\n')
+            return
+        self.answer(argv, request.get('figure'))
+
+    def answer(self, argv, figure=None):
+        """Reply with the figure of argv, or the list of its figures when it has several."""
+        try:
+            images, hit = self.server.render(argv)
+        except ValueError as exc:
+            self.reply(400, '{}\n'.format(exc))
+            return
+        except Exception as exc:
+            logging.exception('render failed: %s', ' '.join(argv))
+            self.reply(500, '{}: {}\n'.format(type(exc).__name__, exc))
+            return
+        headers = [('X-Cache', 'hit' if hit else 'miss')]
+        if figure is None and len(images) == 1:
+            figure = next(iter(images))
+        if figure is None:
+            self.reply(200, json.dumps({'figures': sorted(images)}), 'application/json', headers)
+        elif figure in images:
+            fmt = os.path.splitext(figure)[1][1:]
+            self.reply(200, images[figure], CONTENT_TYPES.get(fmt, 'application/octet-stream'),
+                       headers)
+        else:
+            self.reply(404, 'no figure {} in {}\n'.format(figure, sorted(images)))
+
+
+def serve(args):
+    """Run the render server on localhost until interrupted."""
+    server = RenderServer(('127.0.0.1', args.serve), args.jobs or os.cpu_count() or 1,
+                          args.serve_cache)
+    print('Serving figures on http://{}:{}/render, press Ctrl-C to stop'.format(
+        *server.server_address[:2]), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('Stopped serving')
+    finally:
+        server.server_close()
+    return 0
+
+
+def main(argv=None, session=None):
     """CLI entrypoint used both by the script and the tests."""
     parser = processArgs()
     args = parser.parse_args(argv)
     validate_args(args, parser)
+    if args.batch is not None:
+        return run_batch(args.batch)
+    if args.serve is not None:
+        return serve(args)
     if args.colors is None:
         args.colors = DEFAULT_COLORS.copy()
+    try:
+        files = expand_files(args.files)
+    except ValueError as exc:
+        parser.error(str(exc))
 
     path = resolve_output_path(args)
 
@@ -631,27 +3519,40 @@ def main(argv=None):
         mpl_logger = logging.getLogger('plt')
         mpl_logger.setLevel(logging.ERROR)
 
-    # instanciate plots class
-    p = Plots(args.files, args.dims, args.keys, args.type,
-              args.colors, args.append, path, args.force, args.grid, args.screen)
+    t0 = time.perf_counter()
+    timings = None
+    if args.timings:
+        label = files if args.aggregate else files[0]
+        timings = Timings(memory=args.timings_memory, label=label)
 
-    if args.scatters:
-        p.scatters()
+    status = 0
+    if args.watch:
+        own = session is None
+        session = session or Session()
+        try:
+            status = watch(args, [files] if args.aggregate else files, path, session, timings)
+        finally:
+            if own:
+                session.close()
     else:
-
-        # set first and last profiles or all profiles
-        profiles = p.nc.variables['PROFILE'][:]
-        start, end = resolve_profile_range(profiles, args.list)
-
-        # plot profiles
-        if args.profiles:
-            for s in range(start, end+1):
-                p.profiles(s)
-
-        if args.sections:
-            p.section(start, end, args.xaxis, args.yscale, args.exclude, args.xinterp,
-                    args.yinterp, args.clevels, args.autoscale, args.display)
-    return 0
+        # the archive is opened once, a PDF opened again would lose the pages of earlier
+        # files, and it is saved even when a figure fails so its index holds every member
+        archive = Archive(args.archive) if args.archive is not None else None
+        try:
+            if len(files) > 1 and not args.aggregate:
+                status = 1 if run_files(args, files, path, timings, archive) else 0
+            else:
+                p = run_file(args, files if args.aggregate else files[0], path, session,
+                             timings, archive=archive)
+                p.cache.save()
+                if p.store:
+                    print(p.store.report())
+        finally:
+            if archive is not None:
+                archive.save()
+    if timings is not None:
+        report_timings(timings, args.timings_file, time.perf_counter() - t0)
+    return status
 
 
 if __name__ == '__main__':
@@ -0,0 +1,166 @@
+"""
+Write synthetic OceanSITES files for the tests and benchmarks, shaped like
+netcdf/OS_*_CTD.nc, netcdf/OS_*_TSG.nc and netcdf/OS_*_MTO.nc, with any
+number of profiles or samples, and copies of parts of the sample files.
+
+Dimensions, variables, attributes and global attributes are copied from the
+sample files, so plots.py reads the synthetic files exactly like real ones.
+"""
+import os
+
+import numpy as np
+from netCDF4 import Dataset
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+TEMPLATES = {
+    'ctd': os.path.join(ROOT, 'netcdf', 'OS_AMAZOMIX_CTD.nc'),
+    'tsg': os.path.join(ROOT, 'netcdf', 'OS_AMAZOMIX_TSG.nc'),
+    'mto': os.path.join(ROOT, 'netcdf', 'OS_PIRATA-FR31_MTO.nc'),
+}
+CTD_KEYS = ['PRES', 'DEPTH', 'TEMP', 'PSAL', 'DENS', 'SVEL']
+TSG_KEYS = ['SSJT', 'SSPS', 'CNDC', 'SSTP']
+MTO_KEYS = ['ATMS', 'DRYT', 'RELH', 'WMSP']
+# first date of the synthetic files, in CNES julian days (2021-08-28)
+START = 26172.0
+
+
+def create_like(template, path, sizes, names, fmt):
+    """Create path with the global attributes, dimensions and variables of template.
+
+    sizes gives the new length of each dimension, only variables in names
+    are created.
+    """
+    src = Dataset(template)
+    dst = Dataset(path, 'w', format=fmt)
+    dst.setncatts({k: src.getncattr(k) for k in src.ncattrs()})
+    dst.cycle_mesure = 'BENCH'
+    for name, dim in src.dimensions.items():
+        dst.createDimension(name, sizes.get(name, len(dim)))
+    for name in names:
+        var = src.variables[name]
+        attrs = var.__dict__.copy()
+        fill = attrs.pop('_FillValue', None)
+        out = dst.createVariable(name, var.dtype, var.dimensions, fill_value=fill)
+        out.setncatts(attrs)
+    src.close()
+    return dst
+
+
+def ctd_block(first, count, nlev, rng):
+    """Return the variables of `count` CTD profiles, starting at profile `first`."""
+    profiles = np.arange(first, first + count)
+    pres = np.tile(np.arange(nlev, dtype=np.float32), (count, 1))
+    # each cast stops at its own depth, deeper levels hold fill values
+    depth = rng.integers(nlev // 4, nlev + 1, count)
+    mask = np.arange(nlev)[None, :] >= depth[:, None]
+    temp = 2.0 + 26.0 * np.exp(-pres / 400.0) + rng.normal(0, 0.05, pres.shape)
+    psal = 35.0 + 0.6 * np.exp(-((pres - 150.0) / 200.0) ** 2) + rng.normal(0, 0.01, pres.shape)
+    dens = 22.0 + 5.0 * (1.0 - np.exp(-pres / 300.0))
+    svel = 1450.0 + 4.0 * temp + 0.016 * pres
+    data = {
+        'PROFILE': profiles + 1,
+        'TIME': START + profiles * 0.25,
+        'LATITUDE': -10.0 + 20.0 * np.sin(profiles / 500.0),
+        'LONGITUDE': -20.0 + 15.0 * (profiles % 1000) / 1000.0,
+        'BATH': depth + 100.0,
+    }
+    for key, values in (('PRES', pres), ('DEPTH', pres * 0.99), ('TEMP', temp),
+                        ('PSAL', psal), ('DENS', dens), ('SVEL', svel)):
+        data[key] = np.ma.masked_array(values, mask)
+    return data
+
+
+def tsg_block(first, count, rng):
+    """Return the variables of `count` TSG samples, starting at sample `first`."""
+    samples = np.arange(first, first + count)
+    # a slow zonal and meridional zig-zag, one sample every 10 s
+    phase = samples / 200000.0
+    data = {
+        'TIME': START + samples * 10.0 / 86400.0,
+        'LATITUDE': -20.0 + 40.0 * np.abs((phase % 2.0) - 1.0),
+        'LONGITUDE': -25.0 + 20.0 * np.abs(((phase / 3.0) % 2.0) - 1.0),
+    }
+    sstp = 20.0 + 8.0 * np.cos(np.radians(data['LATITUDE'])) + rng.normal(0, 0.05, count)
+    data['SSTP'] = sstp
+    data['SSJT'] = sstp + 0.1
+    data['SSPS'] = 35.5 + 0.8 * np.sin(phase * 7.0) + rng.normal(0, 0.01, count)
+    data['CNDC'] = 4.0 + 0.05 * (sstp - 20.0)
+    # a few gaps, as on a real underway record
+    gaps = rng.random(count) < 0.001
+    for key in ('SSTP', 'SSJT', 'SSPS', 'CNDC'):
+        data[key] = np.ma.masked_array(data[key], gaps)
+    return data
+
+
+def mto_block(first, count, rng):
+    """Return the variables of `count` meteo samples, starting at sample `first`."""
+    samples = np.arange(first, first + count)
+    # one sample every 10 s, with daily cycles and a few gusts
+    days = samples * 10.0 / 86400.0
+    data = {
+        'TIME': START + days,
+        'LATITUDE': -10.0 + 20.0 * np.sin(samples / 500000.0),
+        'LONGITUDE': np.full(count, -10.0),
+    }
+    data['ATMS'] = 1012.0 + 1.5 * np.sin(2 * np.pi * 2 * days) + rng.normal(0, 0.2, count)
+    data['DRYT'] = 26.0 + 1.5 * np.sin(2 * np.pi * days) + rng.normal(0, 0.1, count)
+    data['RELH'] = np.clip(75.0 - 8.0 * np.sin(2 * np.pi * days) + rng.normal(0, 1, count), 0, 100)
+    gusts = rng.random(count) < 0.0005
+    data['WMSP'] = np.abs(8.0 + rng.normal(0, 1.5, count) + gusts * rng.uniform(10, 25, count))
+    gaps = rng.random(count) < 0.001
+    for key in MTO_KEYS:
+        data[key] = np.ma.masked_array(data[key], gaps)
+    return data
+
+
+def make_ctd(path, profiles, levels, block=1000, fmt='NETCDF3_64BIT_OFFSET', seed=0):
+    """Write a CTD-like file of `profiles` x `levels`, `block` profiles at a time."""
+    names = ['PROFILE', 'TIME', 'LATITUDE', 'LONGITUDE', 'BATH'] + CTD_KEYS
+    nc = create_like(TEMPLATES['ctd'], path, {'TIME': profiles, 'DEPTH': levels}, names, fmt)
+    rng = np.random.default_rng(seed)
+    for first in range(0, profiles, block):
+        count = min(block, profiles - first)
+        for name, values in ctd_block(first, count, levels, rng).items():
+            nc.variables[name][first:first + count] = values
+    nc.close()
+
+
+def make_tsg(path, samples, block=1000000, fmt='NETCDF3_64BIT_OFFSET', seed=0):
+    """Write a TSG-like file of `samples` records, `block` samples at a time."""
+    names = ['TIME', 'LATITUDE', 'LONGITUDE'] + TSG_KEYS
+    nc = create_like(TEMPLATES['tsg'], path, {'TIME': samples}, names, fmt)
+    rng = np.random.default_rng(seed)
+    for first in range(0, samples, block):
+        count = min(block, samples - first)
+        for name, values in tsg_block(first, count, rng).items():
+            nc.variables[name][first:first + count] = values
+    nc.close()
+
+
+def make_mto(path, samples, block=1000000, fmt='NETCDF3_64BIT_OFFSET', seed=0):
+    """Write a MTO-like file of `samples` records, `block` samples at a time."""
+    names = ['TIME', 'LATITUDE', 'LONGITUDE'] + MTO_KEYS
+    nc = create_like(TEMPLATES['mto'], path, {'TIME': samples}, names, fmt)
+    rng = np.random.default_rng(seed)
+    for first in range(0, samples, block):
+        count = min(block, samples - first)
+        for name, values in mto_block(first, count, rng).items():
+            nc.variables[name][first:first + count] = values
+    nc.close()
+
+
+def write_leg(src, dst, rows, levels=None):
+    """Copy the profiles rows of src, and their first levels, to a new file dst."""
+    with Dataset(src) as nc, Dataset(dst, 'w', format=nc.file_format) as out:
+        out.setncatts({k: nc.getncattr(k) for k in nc.ncattrs()})
+        for name, dim in nc.dimensions.items():
+            out.createDimension(name, len(rows) if name == 'TIME' else levels or len(dim))
+        for name, var in nc.variables.items():
+            attrs = var.__dict__.copy()
+            fill = attrs.pop('_FillValue', None)
+            copy = out.createVariable(name, var.dtype, var.dimensions, fill_value=fill)
+            copy.setncatts(attrs)
+            if var.dimensions[:1] == ('TIME',):
+                copy[:] = var[rows][:, :levels] if var.ndim == 2 else var[rows]
+            elif var.dimensions:
+                copy[:] = var[:levels]
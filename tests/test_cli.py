@@ -1,7 +1,15 @@
+import json
 import os
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
+from unittest import mock
 from datetime import datetime
 
+import numpy as np
+
 os.environ.setdefault('MPLBACKEND', 'Agg')
 
 import plots
@@ -49,6 +57,14 @@ class CliHelpersTest(unittest.TestCase):
         with self.assertRaises(SystemExit):
             plots.validate_args(args, self.parser)
 
+    def test_validate_args_rejects_scatter_cells_below_one_pixel(self):
+        for cell in ('0', '-2'):
+            args = self.parser.parse_args(['netcdf/OS_AMAZOMIX_TSG.nc', '-t', 'TSG', '--scatter',
+                                           '-k', 'SSPS', 'SSTP', '--scatter-mode', 'mean',
+                                           '--cell', cell])
+            with self.assertRaises(SystemExit):
+                plots.validate_args(args, self.parser)
+
     def test_resolve_profile_range_without_selection_uses_dataset_bounds(self):
         start, end = plots.resolve_profile_range([1, 2, 3], None)
         self.assertEqual((start, end), (1, 3))
@@ -91,3 +107,380 @@ class CliHelpersTest(unittest.TestCase):
     def test_julian_round_trip_preserves_fractional_day(self):
         dt = datetime(2021, 4, 30, 6, 30, 0)
         self.assertEqual(plots.julian2dt(plots.dt2julian(dt)), dt)
+
+    def test_julian2datetime64_matches_julian2dt(self):
+        jd = np.array([0.0, 0.5, 26000.123456789, 26172.93381944, -3.75])
+        expected = [np.datetime64(plots.julian2dt(v), 'us') for v in jd]
+        np.testing.assert_array_equal(plots.julian2datetime64(jd), expected)
+        self.assertTrue(np.isnat(plots.julian2datetime64(np.ma.masked_array([1.0], [1]))[0]))
+
+    def test_datetime64_round_trip_preserves_fractional_day(self):
+        t = np.array(['2021-04-30T06:30:00', '2021-03-05T23:59:59.999999'], dtype='datetime64[us]')
+        np.testing.assert_array_equal(plots.julian2datetime64(plots.datetime642julian(t)), t)
+
+    def test_format_julian_matches_datetime_str(self):
+        jd = [0.0, 26000.123456789, 26172.5]
+        self.assertEqual(plots.format_julian(jd).tolist(),
+                         [str(plots.julian2dt(v)) for v in jd])
+
+    def test_julian2num_feeds_matplotlib_date_axes(self):
+        plots.load_pyplot()
+        self.assertEqual(plots.mdates.num2date(plots.julian2num([26000.5])[0]).replace(tzinfo=None),
+                         plots.julian2dt(26000.5))
+
+    def test_section_contours_match_contourf_and_keep_panel_parts(self):
+        plt = plots.load_pyplot()
+        xi = np.linspace(0, 10, 30)
+        yi = np.linspace(0, 1000, 200)
+        zi = np.ma.masked_greater(np.sin(xi[None, :]) * np.exp(-yi[:, None] / 300), 0.9)
+        levels = np.linspace(zi.min(), zi.max(), 11)
+        fig, (top, bottom) = plt.subplots(2)
+        try:
+            contours = plots.SectionContours(xi, yi, zi)
+            expected = top.contourf(xi, yi, zi, levels=levels)
+            filled = contours.contour_set(top, levels, filled=True)
+            for path, reference in zip(filled.get_paths(), expected.get_paths()):
+                np.testing.assert_array_equal(path.vertices, reference.vertices)
+                np.testing.assert_array_equal(path.codes, reference.codes)
+
+            # the lower panel only gets the lines reaching below 600
+            bottom.set_ylim(600, 1000)
+            lines = contours.contour_set(bottom, levels)
+            for path in lines.get_paths():
+                if len(path.vertices):
+                    self.assertTrue(all(part[:, 1].max() >= 600
+                                        for part in path.to_polygons(closed_only=False)))
+            self.assertEqual(bottom.get_xlim(), top.get_xlim())
+            self.assertEqual(len(contours._lines), len(levels))
+        finally:
+            plt.close(fig)
+
+    def test_validate_args_requires_files_without_batch(self):
+        args = self.parser.parse_args(['-t', 'CTD', '-p', '-k', 'PRES', 'TEMP'])
+        with self.assertRaises(SystemExit):
+            plots.validate_args(args, self.parser)
+
+    def test_validate_args_rejects_watch_on_screen_or_without_interval(self):
+        for extra in (['--watch', '--screen'], ['--watch', '--watch-interval', '0']):
+            args = self.parser.parse_args(['netcdf/OS_PIRATA-FR31_XBT.nc', '-t', 'XBT', '-p',
+                                           '-k', 'DEPTH', 'TEMP'] + extra)
+            with self.assertRaises(SystemExit):
+                plots.validate_args(args, self.parser)
+
+    def test_validate_args_rejects_unknown_or_parallel_archives(self):
+        xbt = ['netcdf/OS_PIRATA-FR31_XBT.nc', '-t', 'XBT', '-p', '-k', 'DEPTH', 'TEMP']
+        for extra in (['--archive', 'run.7z'], ['--archive', 'run.zip', '--jobs', '2'],
+                      ['--archive', 'run.pdf', '--watch']):
+            args = self.parser.parse_args(xbt + extra)
+            with self.assertRaises(SystemExit):
+                plots.validate_args(args, self.parser)
+
+    def test_overlay_is_a_profile_mode(self):
+        args = self.parser.parse_args(['netcdf/OS_PIRATA-FR31_XBT.nc', '-t', 'XBT', '--overlay',
+                                       '-k', 'DEPTH', 'TEMP'])
+        plots.validate_args(args, self.parser)
+        self.assertEqual(args.overlay_color, 'key')
+        self.assertEqual(plots.resolve_output_path(args), 'plots/profiles')
+        args = self.parser.parse_args(['netcdf/OS_AMAZOMIX_TSG.nc', '-t', 'TSG', '--scatter',
+                                       '--overlay', '--overlay-color', 'time',
+                                       '-k', 'SSPS', 'SSTP'])
+        with self.assertRaises(SystemExit):
+            plots.validate_args(args, self.parser)
+
+    def test_flags_do_not_take_the_files_as_values(self):
+        args = self.parser.parse_args(['-t', 'XBT', '-p', '-k', 'DEPTH', 'TEMP', '--timings',
+                                       '--grid-cache', '--watch', '--store', '--overlay',
+                                       'netcdf/OS_PIRATA-FR31_XBT.nc'])
+        plots.validate_args(args, self.parser)
+        self.assertEqual(args.files, ['netcdf/OS_PIRATA-FR31_XBT.nc'])
+        self.assertIsNone(args.timings_file)
+        self.assertEqual(plots.resolve_grid_cache(args, 'out'),
+                         os.path.join('out', plots.GRID_CACHE_NAME))
+
+    def test_validate_args_rejects_value_options_without_their_flag(self):
+        xbt = ['netcdf/OS_PIRATA-FR31_XBT.nc', '-t', 'XBT', '-p', '-k', 'DEPTH', 'TEMP']
+        for extra in (['--timings-file', 'log'], ['--grid-cache-dir', 'grids'],
+                      ['--store', '--store-budget', '0']):
+            args = self.parser.parse_args(xbt + extra)
+            with self.assertRaises(SystemExit):
+                plots.validate_args(args, self.parser)
+
+    def test_validate_args_accepts_batch_alone(self):
+        args = self.parser.parse_args(['--batch', 'jobs.txt'])
+        plots.validate_args(args, self.parser)
+
+    def test_load_manifest_reads_text_lines_from_shell_scripts(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifest = os.path.join(tmpdir, 'jobs.txt')
+            with open(manifest, 'w') as fid:
+                fid.write('# comment\n\n')
+                fid.write('plots.py netcdf/OS_AMAZOMIX_CTD.nc -t CTD -p -k PRES TEMP\n')
+            self.assertEqual(plots.load_manifest(manifest), [
+                ['netcdf/OS_AMAZOMIX_CTD.nc', '-t', 'CTD', '-p', '-k', 'PRES', 'TEMP'],
+            ])
+
+    def test_load_manifest_reads_json_jobs_mapping(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifest = os.path.join(tmpdir, 'jobs.json')
+            with open(manifest, 'w') as fid:
+                json.dump({'jobs': ['a.nc -t CTD -p', ['b.nc', '-t', 'XBT', '-s']]}, fid)
+            self.assertEqual(plots.load_manifest(manifest), [
+                ['a.nc', '-t', 'CTD', '-p'],
+                ['b.nc', '-t', 'XBT', '-s'],
+            ])
+
+    def test_validate_args_rejects_jobs_with_screen(self):
+        args = self.parser.parse_args([
+            'netcdf/OS_AMAZOMIX_CTD.nc',
+            '-t', 'CTD',
+            '-p',
+            '-k', 'PRES', 'TEMP',
+            '--jobs', '4',
+            '--screen',
+        ])
+        with self.assertRaises(SystemExit):
+            plots.validate_args(args, self.parser)
+
+    def test_validate_args_rejects_png_compression_of_other_formats(self):
+        args = self.parser.parse_args([
+            'netcdf/OS_AMAZOMIX_CTD.nc',
+            '-t', 'CTD',
+            '-p',
+            '-k', 'PRES', 'TEMP',
+            '--format', 'webp',
+            '--png-compression', '1',
+        ])
+        with self.assertRaises(SystemExit):
+            plots.validate_args(args, self.parser)
+
+    def test_grid_cache_round_trips_and_evicts_least_recently_used(self):
+        grid = dict(xi=np.arange(3.0), yi=np.arange(4.0), zi=np.ones((4, 3)),
+                    x=np.arange(3.0), list_profiles=[1, 2, 3],
+                    zrange=np.array([0.5, 2.5], dtype=np.float32), data='abc')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = plots.GridCache(tmpdir, budget=1)
+            self.assertIsNone(cache.load('missing'))
+            cache.store('a', grid, var='TEMP')
+            loaded = cache.load('a')
+            np.testing.assert_array_equal(loaded['zi'], grid['zi'])
+            self.assertEqual(loaded['list_profiles'], [1, 2, 3])
+            self.assertEqual(loaded['zrange'][0].dtype, np.float32)
+            self.assertEqual(loaded['data'], 'abc')
+
+            # a budget of a single grid keeps the last one stored
+            size = os.path.getsize(os.path.join(tmpdir, 'a.npz'))
+            cache.budget = size * 1.5 / 1048576
+            os.utime(os.path.join(tmpdir, 'a.npz'), (1, 1))
+            cache.store('b', grid)
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['b.npz'])
+
+    def test_async_writer_records_digests_once_written(self):
+        plots.load_pyplot()
+        rgba = np.zeros((2, 2, 4), dtype=np.uint8)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = plots.RenderCache(tmpdir)
+            writer = plots.AsyncWriter()
+            writer.submit(os.path.join(tmpdir, 'a.png'), rgba, 'png', 100,
+                          done=lambda: cache.record('a.png', 'da'))
+            writer.submit(os.path.join(tmpdir, 'missing', 'b.png'), rgba, 'png', 100,
+                          done=lambda: cache.record('b.png', 'db'))
+            with self.assertRaises(OSError):
+                writer.close()
+            self.assertEqual(cache.pending, {'a.png': 'da'})
+
+    def test_figure_cache_drops_least_recently_used_beyond_budget(self):
+        cache = plots.FigureCache(budget=25 / 1048576)
+        cache.put('a', {'a.png': b'x' * 10})
+        cache.put('b', {'b.png': b'x' * 10})
+        self.assertIsNotNone(cache.get('a'))
+        cache.put('c', {'c.png': b'x' * 10})
+        cache.put('big', {'big.png': b'x' * 30})
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNone(cache.get('big'))
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_parse_request_raises_instead_of_exiting(self):
+        xbt = ['netcdf/OS_PIRATA-FR31_XBT.nc', '-t', 'XBT', '-p', '-k', 'DEPTH', 'TEMP']
+        for argv in (xbt[:3], xbt + ['--screen'], xbt + ['--watch'], ['--help'],
+                     ['netcdf/OS_*_XBT.nc'] + xbt[1:], xbt + ['--grid-cache'],
+                     ['missing.nc'] + xbt[1:]):
+            with self.assertRaises(ValueError):
+                plots.parse_request(argv)
+        args, files = plots.parse_request(xbt)
+        self.assertEqual(files, xbt[:1])
+
+    def test_render_request_does_not_write_map_caches(self):
+        with mock.patch.object(plots, 'run_file') as run_file:
+            plots.render_request(['netcdf/OS_AMAZOMIX_TSG.nc', '-t', 'TSG', '--scatter',
+                                  '-k', 'SSPS', 'SSTP'], plots.Session(), {})
+        self.assertTrue(run_file.call_args[0][0].no_map_cache)
+
+    def test_expand_files_matches_globs_in_argument_order(self):
+        files = plots.expand_files(['netcdf/OS_PIRATA-FR31_XBT.nc', 'netcdf/OS_*_XBT.nc'])
+        self.assertEqual(files, ['netcdf/OS_PIRATA-FR31_XBT.nc', 'netcdf/OS_AMAZOMIX_XBT.nc'])
+        with self.assertRaises(ValueError):
+            plots.expand_files(['netcdf/OS_*_NONE.nc'])
+
+    def test_regrid_profiles_matches_np_interp_per_profile(self):
+        rng = np.random.default_rng(0)
+        y = np.sort(rng.random((20, 30)) * 100, axis=1)
+        z = rng.random((20, 30))
+        yi = np.linspace(-5, 105, 50)
+        expected = np.array([np.interp(yi, y[i], z[i]) for i in range(len(y))])
+        np.testing.assert_allclose(plots.regrid_profiles(y, z, yi, block=7), expected)
+
+    def test_regrid_profiles_sorts_non_monotonic_levels(self):
+        y = np.array([[0.0, 20.0, 10.0, 30.0]])
+        z = np.array([[0.0, 2.0, 1.0, 3.0]])
+        np.testing.assert_allclose(plots.regrid_profiles(y, z, [5.0, 15.0, 25.0]),
+                                   [[0.5, 1.5, 2.5]])
+
+    def test_regrid_profiles_skips_masked_levels_without_extrapolating(self):
+        y = np.ma.masked_array([[0.0, 10.0, 20.0, 30.0]], mask=[[0, 0, 0, 1]])
+        z = np.ma.masked_array([[0.0, 1.0, np.nan, 3.0]], mask=[[0, 0, 0, 1]])
+        zi = plots.regrid_profiles(y, z, [0.0, 5.0, 10.0, 25.0])
+        np.testing.assert_allclose(zi[0, :3], [0.0, 0.5, 1.0])
+        self.assertTrue(np.isnan(zi[0, 3]))
+
+    def test_regrid_profiles_stacks_variables_with_shared_or_own_levels(self):
+        rng = np.random.default_rng(2)
+        y = np.tile(np.arange(0.0, 40.0, 2.0), (6, 1))
+        z = rng.random((3, 6, 20))
+        z[:, 1, 15:] = np.nan
+        yi = np.arange(0.0, 40.0, 3.0)
+        own = z.copy()
+        own[2, :, 4] = np.nan
+        for stacked in (z, own):
+            expected = [plots.regrid_profiles(y, v, yi) for v in stacked]
+            np.testing.assert_array_equal(plots.regrid_profiles(y, stacked, yi), expected)
+
+    def test_interpx_linear_matches_griddata_on_regular_grid(self):
+        rng = np.random.default_rng(1)
+        x = np.array([-1.0, -2.5, -4.0, -6.0, -10.0])
+        xi = np.linspace(x[0], x[-1], len(x))
+        yi = np.arange(0.0, 50.0, 5.0)
+        zi = rng.random((len(xi), len(yi)))
+        xn, expected = plots.interpx(17, x, xi, yi, zi, 'griddata')
+        xl, result = plots.interpx(17, x, xi, yi, zi, 'linear')
+        np.testing.assert_allclose(xl, xn)
+        np.testing.assert_allclose(result, expected, atol=1e-12)
+
+    def test_interpx_gap_bridges_missing_profiles_within_max_gap(self):
+        xi = np.array([0.0, 1.0, 2.0, 3.0])
+        zi = np.array([[0.0], [np.nan], [np.nan], [3.0]])
+        _, linear = plots.interpx(7, xi, xi, np.array([0.0]), zi, 'linear')
+        self.assertTrue(np.isnan(linear[0, 3]))
+        _, gap = plots.interpx(7, xi, xi, np.array([0.0]), zi, 'gap')
+        np.testing.assert_allclose(gap[0], np.linspace(0.0, 3.0, 7))
+        _, short = plots.interpx(7, xi, xi, np.array([0.0]), zi, 'gap', max_gap=2.0)
+        self.assertTrue(np.isnan(short[0, 3]))
+        self.assertEqual((short[0, 0], short[0, -1]), (0.0, 3.0))
+
+    def test_import_does_not_load_heavy_dependencies(self):
+        code = ('import sys, plots; '
+                'print(sorted(m for m in ("cartopy", "scipy", "netCDF4", "matplotlib") '
+                'if m in sys.modules))')
+        output = subprocess.run([sys.executable, '-c', code], check=True,
+                                capture_output=True, text=True).stdout
+        self.assertEqual(output.strip(), '[]')
+
+    def test_input_digest_ignores_values_under_the_mask(self):
+        a = np.ma.masked_array([1.0, 2.0, 3.0], mask=[0, 0, 1])
+        b = np.ma.masked_array([1.0, 2.0, 99.0], mask=[0, 0, 1])
+        self.assertEqual(plots.input_digest(a, {'clevels': 20}),
+                         plots.input_digest(b, {'clevels': 20}))
+        self.assertNotEqual(plots.input_digest(a, {'clevels': 20}),
+                            plots.input_digest(a, {'clevels': 30}))
+
+    def test_aggregate_track_bins_samples_per_cell(self):
+        lon = np.array([0.1, 0.2, 0.3, 1.6, 1.7])
+        lat = np.array([0.1, 0.1, 0.1, 0.1, 0.1])
+        values = np.array([1.0, 2.0, 6.0, 4.0, 8.0])
+        extent = [0.0, 2.0, 0.0, 1.0]
+        lon_edges, lat_edges, mean = plots.aggregate_track(lon, lat, values, extent, (1, 2), 'mean')
+        np.testing.assert_allclose(lon_edges, [0.0, 1.0, 2.0])
+        np.testing.assert_allclose(lat_edges, [0.0, 1.0], atol=1e-12)
+        np.testing.assert_allclose(mean, [[3.0, 6.0]])
+        _, _, median = plots.aggregate_track(lon, lat, values, extent, (1, 2), 'median')
+        np.testing.assert_allclose(median, [[2.0, 6.0]])
+        _, _, last = plots.aggregate_track(lon, lat, values, extent, (1, 2), 'last')
+        np.testing.assert_allclose(last, [[6.0, 8.0]])
+        _, _, empty = plots.aggregate_track(lon, lat, values, extent, (2, 2), 'mean')
+        self.assertTrue(empty.mask[1].all())
+
+    def test_thin_track_keeps_first_sample_of_each_cell_run(self):
+        lon = np.ma.masked_array([0.1, 0.2, 1.5, np.nan, 1.6, 0.3], mask=[0, 0, 0, 1, 0, 0])
+        lat = np.zeros(6)
+        keep, last = plots.thin_track(lon, lat, [0.0, 2.0, -1.0, 1.0], (1, 2))
+        np.testing.assert_array_equal(keep, [0, 2, 5])
+        keep, _ = plots.thin_track(lon[5:], lat[5:], [0.0, 2.0, -1.0, 1.0], (1, 2), last)
+        self.assertEqual(len(keep), 0)
+
+    def test_track_raster_accumulates_chunks_like_a_single_pass(self):
+        rng = np.random.default_rng(3)
+        lon, lat, values = rng.random(500) * 10, rng.random(500) * 10, rng.random(500)
+        extent = [0.0, 10.0, 0.0, 10.0]
+        for how in ('mean', 'median', 'last'):
+            raster = plots.TrackRaster(extent, (4, 5), how)
+            for chunk in np.array_split(np.arange(500), 7):
+                raster.add(lon[chunk], lat[chunk], values[chunk])
+            expected = plots.aggregate_track(lon, lat, values, extent, (4, 5), how)[2]
+            np.testing.assert_allclose(raster.result()[2], expected)
+
+    def test_series_bins_keep_first_last_and_extremes_of_each_column(self):
+        time = np.array([0.1, 0.2, 0.3, 0.4, 1.1, 1.5, 1.9, 3.5])
+        values = np.array([5.0, 9.0, -2.0, 4.0, 1.0, np.nan, 3.0, 7.0])
+        bins = plots.SeriesBins(0.0, 4.0, 4)
+        # chunks are accumulated in any order
+        bins.add(time[4:], values[4:])
+        bins.add(time[:4][::-1], values[:4][::-1])
+        t, v = bins.result()
+        # more samples than columns, the empty column is a gap breaking the line
+        np.testing.assert_array_equal(t, [0.1, 0.2, 0.3, 0.4, 1.1, 1.9, np.nan, 3.5])
+        np.testing.assert_array_equal(v, [5.0, 9.0, -2.0, 4.0, 1.0, 3.0, np.nan, 7.0])
+        # fewer samples than columns, empty columns are bridged
+        bins = plots.SeriesBins(0.0, 4.0, 8)
+        bins.add(np.array([0.1, 1.1, 3.5]), np.array([1.0, 2.0, 3.0]))
+        np.testing.assert_array_equal(bins.result()[0], [0.1, 1.1, 3.5])
+
+    def test_timeseries_is_a_mode_of_its_own(self):
+        args = self.parser.parse_args(['netcdf/OS_PIRATA-FR31_SND.nc', '-t', 'SND',
+                                       '--timeseries', '-k', 'BATH'])
+        plots.validate_args(args, self.parser)
+        self.assertEqual(plots.resolve_output_path(args), 'plots/timeseries')
+        for extra in (['-p'], ['--aggregate']):
+            args = self.parser.parse_args(['netcdf/OS_PIRATA-FR31_MTO.nc', '-t', 'MTO',
+                                           '--timeseries', '-k', 'ATMS', 'DRYT'] + extra)
+            with self.assertRaises(SystemExit):
+                plots.validate_args(args, self.parser)
+
+    def test_parse_time_accepts_iso_dates_and_julian_days(self):
+        self.assertEqual(plots.parse_time('1950-01-02'), 1.0)
+        self.assertEqual(plots.parse_time('1950-01-01T12:00:00Z'), 0.5)
+        self.assertEqual(plots.parse_time('26000.25'), 26000.25)
+        args = self.parser.parse_args(['f.nc', '-t', 'TSG', '--scatter', '-k', 'SSPS', 'SSTP',
+                                       '--start', '2021-03-20', '--end', '2021-03-05'])
+        with self.assertRaises(SystemExit):
+            plots.validate_args(args, self.parser)
+
+    def test_timings_report_nested_stages_once_and_call_hooks(self):
+        seen = []
+        timings = plots.Timings(hooks=[seen.append], label='f.nc')
+        with timings.stage('draw', 'a.png'):
+            with timings.stage('contour', 'a.png'):
+                time.sleep(0.02)
+        self.assertEqual([r['stage'] for r in seen], ['contour', 'draw'])
+        contour, draw = seen
+        self.assertGreaterEqual(contour['seconds'], 0.02)
+        self.assertLess(draw['seconds'], contour['seconds'])
+        self.assertEqual(draw['file'], 'f.nc')
+        self.assertIn('a.png', timings.summary())
+        self.assertEqual(timings.take_records(), seen)
+        self.assertEqual(timings.records, [])
+
+        disabled = plots.Timings(enabled=False, hooks=[seen.append])
+        with disabled.stage('draw'):
+            pass
+        self.assertEqual(disabled.records, [])
+        self.assertEqual(len(seen), 2)
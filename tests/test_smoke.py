@@ -1,11 +1,28 @@
+import contextlib
+import io
+import json
 import os
+import re
+import shlex
+import shutil
+import tarfile
 import tempfile
+import threading
 import unittest
+import urllib.error
+import urllib.parse
+import urllib.request
+import zipfile
 from pathlib import Path
+from unittest import mock
+
+import numpy as np
+from netCDF4 import Dataset
 
 os.environ.setdefault('MPLBACKEND', 'Agg')
 
 import plots
+from tests.synthetic import make_ctd, make_tsg, write_leg
 
 
 class SmokeTest(unittest.TestCase):
@@ -23,3 +40,555 @@ class SmokeTest(unittest.TestCase):
 
             self.assertEqual(exit_code, 0)
             self.assertTrue(Path(tmpdir, 'AMAZOMIX-00101_CTD.png').exists())
+
+    def test_batch_shares_datasets_between_jobs(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifest = Path(tmpdir, 'jobs.txt')
+            manifest.write_text(
+                'netcdf/OS_PIRATA-FR31_XBT.nc -t XBT -s -k DEPTH TEMP --xaxis LATITUDE '
+                '-l 18 20 --yscale 0 250 -o {0}\n'
+                'netcdf/OS_PIRATA-FR31_XBT.nc -t XBT -s -k DEPTH SVEL --xaxis LATITUDE '
+                '-l 18 20 --yscale 0 250 --autoscale 1 -o {0}\n'.format(tmpdir))
+            session = plots.Session()
+            for argv in plots.load_manifest(str(manifest)):
+                self.assertEqual(plots.main(argv, session=session), 0)
+
+            self.assertEqual(len(session.datasets), 1)
+            self.assertEqual(len(session.selections), 1)
+            self.assertTrue(Path(tmpdir, 'PIRATA-FR31-XBT-TEMP.png').exists())
+            self.assertTrue(Path(tmpdir, 'PIRATA-FR31-XBT-SVEL.png').exists())
+            session.close()
+
+    def test_run_batch_reports_failed_jobs(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifest = Path(tmpdir, 'jobs.txt')
+            manifest.write_text('netcdf/OS_AMAZOMIX_CTD.nc -t CTD -p -k PRES\n')
+            self.assertEqual(plots.main(['--batch', str(manifest)]), 1)
+
+    def test_run_batch_continues_after_a_job_raising(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifest = Path(tmpdir, 'jobs.txt')
+            manifest.write_text(
+                'netcdf/OS_PIRATA-FR31_XBT.nc -t XBT -p -k DEPTH NOPE -l 1 1 -o {0}\n'
+                'netcdf/OS_PIRATA-FR31_XBT.nc -t XBT -p -k DEPTH TEMP -l 1 1 -o {0}\n'
+                .format(tmpdir))
+            err = io.StringIO()
+            with contextlib.redirect_stderr(err):
+                self.assertEqual(plots.main(['--batch', str(manifest)]), 1)
+            self.assertIn('Job 1/2 failed', err.getvalue())
+            self.assertTrue(Path(tmpdir, 'PIRATA-FR31-00001_XBT.png').exists())
+
+    def test_jobs_renders_section_variables_in_worker_processes(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            exit_code = plots.main([
+                'netcdf/OS_PIRATA-FR31_XBT.nc',
+                '-t', 'XBT',
+                '-s',
+                '-k', 'DEPTH', 'TEMP', 'SVEL',
+                '-l', '18', '20',
+                '--xaxis', 'LATITUDE',
+                '--yscale', '0', '250',
+                '--autoscale', '1',
+                '-o', tmpdir,
+                '--jobs', '2',
+            ])
+
+            self.assertEqual(exit_code, 0)
+            self.assertTrue(Path(tmpdir, 'PIRATA-FR31-XBT-TEMP.png').exists())
+            self.assertTrue(Path(tmpdir, 'PIRATA-FR31-XBT-SVEL.png').exists())
+
+    def test_section_tasks_grid_all_variables_once_and_skip_fresh_figures(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            p = plots.Plots('netcdf/OS_PIRATA-FR31_XBT.nc', plots.DEFAULT_DIMS,
+                            ['DEPTH', 'TEMP', 'SVEL'], 'XBT', plots.DEFAULT_COLORS, '', tmpdir)
+            args = (18, 20, 'LATITUDE', np.array([0, 250]), [], 10, 5, 20, [1])
+            tasks = p.section_tasks(*args)
+            self.assertEqual([t['var'] for t in tasks], ['TEMP', 'SVEL'])
+            self.assertIs(tasks[0]['yi'], tasks[1]['yi'])
+            self.assertEqual(tasks[0]['zi'].shape, (len(tasks[0]['yi']), 10))
+            for task in tasks:
+                p.render_section(task)
+            self.assertEqual(p.section_tasks(*args), [])
+
+    def test_main_selects_profiles_in_a_time_window(self):
+        with Dataset('netcdf/OS_PIRATA-FR31_XBT.nc') as nc:
+            times = nc.variables['TIME'][:]
+            ids = nc.variables['PROFILE'][:]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            exit_code = plots.main([
+                'netcdf/OS_PIRATA-FR31_XBT.nc',
+                '-t', 'XBT',
+                '-p',
+                '-k', 'DEPTH', 'TEMP',
+                '--start', repr(float(times[18])),
+                '--end', repr(float(times[20])),
+                '-o', tmpdir,
+            ])
+
+            self.assertEqual(exit_code, 0)
+            figures = sorted(f for f in os.listdir(tmpdir) if f.endswith('.png'))
+            self.assertEqual(figures, ['PIRATA-FR31-{:05d}_XBT.png'.format(int(i))
+                                       for i in sorted(ids[18:21])])
+
+    def test_timings_append_json_lines_per_figure_and_run(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            log = os.path.join(tmpdir, 'timings.jsonl')
+            exit_code = plots.main([
+                'netcdf/OS_PIRATA-FR31_XBT.nc',
+                '-t', 'XBT',
+                '-s',
+                '-k', 'DEPTH', 'TEMP',
+                '--xaxis', 'LATITUDE',
+                '-l', '18', '20',
+                '-o', tmpdir,
+                '--timings', '--timings-file', log,
+            ])
+
+            self.assertEqual(exit_code, 0)
+            with open(log) as f:
+                records = [json.loads(line) for line in f]
+            stages = {r['stage'] for r in records}
+            self.assertTrue({'open', 'read', 'regrid', 'draw', 'contour', 'encode',
+                             'write', 'run'} <= stages)
+            figures = {r['figure'] for r in records if r['stage'] == 'draw'}
+            self.assertEqual(figures, {'PIRATA-FR31-XBT-TEMP.png'})
+            self.assertEqual(records[-1]['stage'], 'run')
+
+    def test_grid_cache_restyles_sections_without_regridding(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            log = os.path.join(tmpdir, 'timings.jsonl')
+            argv = ['netcdf/OS_PIRATA-FR31_XBT.nc', '-t', 'XBT', '-s', '-k', 'DEPTH', 'TEMP',
+                    '--xaxis', 'LATITUDE', '-l', '18', '20', '--xinterp', '10',
+                    '-o', tmpdir, '--grid-cache']
+            for clevels in ('20', '10'):
+                if os.path.exists(log):
+                    os.remove(log)
+                self.assertEqual(plots.main(argv + ['--clevels', clevels,
+                                                    '--timings', '--timings-file', log]), 0)
+                with open(log) as f:
+                    stages = {json.loads(line)['stage'] for line in f}
+                self.assertIn('draw', stages)
+
+            self.assertFalse({'regrid', 'interp'} & stages)
+            self.assertEqual(len(os.listdir(Path(tmpdir, plots.GRID_CACHE_NAME))), 1)
+
+    def test_several_files_are_plotted_alone_or_aggregated(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            xbt = 'netcdf/OS_PIRATA-FR31_XBT.nc'
+            write_leg(xbt, os.path.join(tmpdir, 'leg1_XBT.nc'), np.arange(0, 30))
+            write_leg(xbt, os.path.join(tmpdir, 'leg2_XBT.nc'), np.arange(30, 66), levels=1300)
+            legs = os.path.join(tmpdir, 'leg*_XBT.nc')
+            section = ['-t', 'XBT', '-s', '-k', 'DEPTH', 'TEMP', '--xaxis', 'LATITUDE',
+                       '-l', '25', '35', '--yscale', '0', '800']
+
+            self.assertEqual(plots.main([legs, '-t', 'XBT', '-p', '-k', 'DEPTH', 'TEMP',
+                                         '-l', '29', '31', '-o', tmpdir]), 0)
+            self.assertEqual(plots.main([legs] + section + ['--aggregate', '-o', tmpdir]), 0)
+            self.assertEqual(plots.main([xbt] + section + ['-o', os.path.join(tmpdir, 'whole')]), 0)
+
+            # each leg only holds some of the requested profiles
+            figures = sorted(f for f in os.listdir(tmpdir) if f.endswith('_XBT.png'))
+            self.assertEqual(figures, ['PIRATA-FR31-{:05d}_XBT.png'.format(i) for i in (29, 30, 31)])
+            name = 'PIRATA-FR31-XBT-TEMP.png'
+            self.assertEqual(Path(tmpdir, name).read_bytes(),
+                             Path(tmpdir, 'whole', name).read_bytes())
+
+    def test_watch_plots_only_new_profiles(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            xbt = 'netcdf/OS_PIRATA-FR31_XBT.nc'
+            live = os.path.join(tmpdir, 'live_XBT.nc')
+            write_leg(xbt, live, np.arange(0, 30))
+            polls = []
+
+            def poll(seconds):
+                # the file grows on the first poll, is read once unchanged on
+                # the second, and the watch is interrupted on the third
+                polls.append(seconds)
+                if len(polls) == 1:
+                    write_leg(xbt, live, np.arange(0, 40))
+                elif len(polls) == 3:
+                    raise KeyboardInterrupt
+
+            out = io.StringIO()
+            with mock.patch.object(plots.time, 'sleep', poll), contextlib.redirect_stdout(out):
+                status = plots.main([live, '-t', 'XBT', '-p', '-s', '-k', 'DEPTH', 'TEMP',
+                                     '--xaxis', 'LATITUDE', '-l', '25', '--yscale', '0', '800',
+                                     '-o', tmpdir, '--watch', '--watch-interval', '0.5'])
+
+            self.assertEqual(status, 0)
+            self.assertEqual(polls, [0.5, 0.5, 0.5])
+            printed = [line for line in out.getvalue().splitlines() if line.startswith('Printing')]
+            # profiles 25 to 30 first, then only the 10 new ones and the section
+            self.assertEqual(len([p for p in printed if p.endswith('_XBT.png')]), 16)
+            self.assertEqual(len([p for p in printed if 'XBT-TEMP' in p]), 2)
+            self.assertIn('10 new profile(s)', out.getvalue())
+
+    def test_render_server_answers_like_files_and_caches_figures(self):
+        xbt = 'netcdf/OS_PIRATA-FR31_XBT.nc -t XBT -p -k DEPTH TEMP -l 5 5'
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.assertEqual(plots.main(shlex.split(xbt) + ['-o', tmpdir]), 0)
+            server = plots.RenderServer(('127.0.0.1', 0))
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+                def get(path, **query):
+                    return urllib.request.urlopen('{}{}?{}'.format(
+                        url, path, urllib.parse.urlencode(query)))
+
+                answers = [get('/render', args=xbt) for _ in range(2)]
+                self.assertEqual([a.headers['X-Cache'] for a in answers], ['miss', 'hit'])
+                self.assertEqual(answers[0].headers['Content-Type'], 'image/png')
+                self.assertEqual(answers[0].read(),
+                                 Path(tmpdir, 'PIRATA-FR31-00005_XBT.png').read_bytes())
+
+                section = 'netcdf/OS_PIRATA-FR31_XBT.nc -t XBT -s -k DEPTH TEMP DENS'
+                figures = json.load(get('/render', args=section))['figures']
+                self.assertEqual(figures, ['PIRATA-FR31-XBT-DENS.png', 'PIRATA-FR31-XBT-TEMP.png'])
+                answer = get('/render', args=section, figure=figures[1])
+                self.assertEqual(answer.headers['X-Cache'], 'hit')
+                with self.assertRaises(urllib.error.HTTPError) as error:
+                    get('/render', args=xbt + ' --start 2030-01-01')
+                self.assertEqual(error.exception.code, 400)
+                with self.assertRaises(urllib.error.HTTPError) as error:
+                    get('/render', args=xbt.replace('XBT.nc', 'MISSING.nc'))
+                self.assertEqual(error.exception.code, 400)
+                self.assertEqual(json.load(get('/stats'))['entries'], 2)
+            finally:
+                server.shutdown()
+                server.server_close()
+                thread.join()
+
+    def test_scatter_map_coastlines_are_projected_once(self):
+        import shapefile
+        import cartopy.io.shapereader as shpreader
+        with tempfile.TemporaryDirectory() as tmpdir:
+            coast = os.path.join(tmpdir, 'coast')
+            with shapefile.Writer(coast, shapeType=shapefile.POLYLINE) as shp:
+                shp.field('name', 'C')
+                shp.line([[(-60.0, -5.0), (-45.0, 0.0), (-35.0, -4.0)]])
+                shp.record('coast')
+            argv = ['netcdf/OS_AMAZOMIX_TSG.nc', '-t', 'TSG', '--scatter', '-k', 'SSPS', 'SSTP',
+                    '--coastlines', coast + '.shp', '-o', tmpdir, '--force']
+            figure = Path(tmpdir, 'AMAZOMIX_TSG_COLCOR_SCATTER.png')
+
+            reader = shpreader.Reader
+            with mock.patch.object(shpreader, 'Reader', side_effect=reader) as opened:
+                self.assertEqual(plots.main(argv), 0)
+            # both panels share the projected coastlines
+            self.assertEqual(opened.call_count, 1)
+            self.assertEqual(len(os.listdir(os.path.join(tmpdir, plots.MAP_CACHE_NAME))), 1)
+            first = figure.read_bytes()
+
+            with mock.patch.object(shpreader, 'Reader', side_effect=AssertionError):
+                self.assertEqual(plots.main(argv), 0)
+            self.assertEqual(figure.read_bytes(), first)
+
+    def test_archive_holds_figures_and_is_appended_to(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            xbt = ['netcdf/OS_PIRATA-FR31_XBT.nc', '-t', 'XBT', '-p', '-k', 'DEPTH', 'TEMP',
+                   '-o', os.path.join(tmpdir, 'files')]
+            self.assertEqual(plots.main(xbt + ['-l', '1', '3']), 0)
+            for name in ('run.zip', 'run.tar'):
+                archive = os.path.join(tmpdir, name)
+                self.assertEqual(plots.main(xbt + ['-l', '1', '2', '--archive', archive]), 0)
+                out = io.StringIO()
+                with contextlib.redirect_stdout(out):
+                    self.assertEqual(plots.main(xbt + ['-l', '1', '3', '--archive', archive]), 0)
+                # only the new profile is added
+                self.assertEqual(out.getvalue().count('Printing'), 1)
+
+                if name.endswith('.zip'):
+                    with zipfile.ZipFile(archive) as zf:
+                        index = json.loads(zf.read('index.json'))
+                        image = zf.read('PIRATA-FR31-00003_XBT.png')
+                else:
+                    with tarfile.open(archive) as tf:
+                        index = json.load(tf.extractfile('index.json'))
+                        image = tf.extractfile('PIRATA-FR31-00003_XBT.png').read()
+                self.assertEqual(sorted(index), ['PIRATA-FR31-{:05d}_XBT.png'.format(i)
+                                                 for i in (1, 2, 3)])
+                self.assertEqual(image, Path(tmpdir, 'files',
+                                             'PIRATA-FR31-00003_XBT.png').read_bytes())
+
+            pdf = os.path.join(tmpdir, 'run.pdf')
+            self.assertEqual(plots.main(xbt + ['-s', '-l', '1', '3', '--archive', pdf]), 0)
+            self.assertEqual(len(re.findall(rb'/Type /Page\b', Path(pdf).read_bytes())), 4)
+
+    def test_archive_index_is_saved_when_a_figure_fails(self):
+        xbt = ['netcdf/OS_PIRATA-FR31_XBT.nc', '-t', 'XBT', '-p', '-k', 'DEPTH', 'TEMP',
+               '-l', '1', '2']
+        profiles = plots.Plots.profiles
+
+        def failing(self, profile):
+            if profile == 2:
+                raise RuntimeError('broken profile')
+            profiles(self, profile)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            archive = os.path.join(tmpdir, 'run.zip')
+            with mock.patch.object(plots.Plots, 'profiles', failing):
+                with self.assertRaises(RuntimeError):
+                    plots.main(xbt + ['--archive', archive])
+            with zipfile.ZipFile(archive) as zf:
+                self.assertEqual(list(json.loads(zf.read('index.json'))),
+                                 ['PIRATA-FR31-00001_XBT.png'])
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                self.assertEqual(plots.main(xbt + ['--archive', archive]), 0)
+            # the profile written before the failure is not added again
+            self.assertEqual(out.getvalue().count('Printing'), 1)
+
+    def test_archive_holds_the_figures_of_every_file(self):
+        xbt = ['netcdf/OS_PIRATA-FR31_XBT.nc', 'netcdf/OS_AMAZOMIX_XBT.nc', '-t', 'XBT', '-p',
+               '-k', 'DEPTH', 'TEMP', '-l', '1', '2']
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pdf = os.path.join(tmpdir, 'run.pdf')
+            self.assertEqual(plots.main(xbt + ['--archive', pdf]), 0)
+            self.assertEqual(len(re.findall(rb'/Type /Page\b', Path(pdf).read_bytes())), 4)
+            archive = os.path.join(tmpdir, 'run.zip')
+            self.assertEqual(plots.main(xbt + ['--archive', archive]), 0)
+            with zipfile.ZipFile(archive) as zf:
+                self.assertEqual(len(json.loads(zf.read('index.json'))), 4)
+
+    def test_overlay_draws_one_line_collection_per_key(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            p = plots.Plots('netcdf/OS_PIRATA-FR31_XBT.nc', plots.DEFAULT_DIMS,
+                            ['DEPTH', 'TEMP', 'SVEL'], 'XBT', plots.DEFAULT_COLORS, '', tmpdir)
+            with mock.patch.object(p, 'plot') as plot:
+                p.overlay(10, 20, [15], 'key')
+            figname = plot.call_args[0][0]
+            self.assertEqual(figname, 'PIRATA-FR31-OVERLAY-00010-00020_XBT.png')
+            collections = [c for ax in p.fig.axes for c in ax.collections]
+            self.assertEqual(len(collections), 2)
+            # one line per profile left after the exclusion
+            self.assertEqual([len(c.get_segments()) for c in collections], [10, 10])
+            plots.plt.close(p.fig)
+
+            exit_code = plots.main(['netcdf/OS_PIRATA-FR31_XBT.nc', '-t', 'XBT', '--overlay',
+                                    '--overlay-color', 'time', '-k', 'DEPTH', 'TEMP', 'SVEL',
+                                    '-o', tmpdir])
+            self.assertEqual(exit_code, 0)
+            self.assertTrue(Path(tmpdir, 'PIRATA-FR31-OVERLAY-00001-00066_XBT.png').exists())
+
+    def test_timeseries_keeps_extremes_with_a_few_vertices_per_pixel(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            p = plots.Plots('netcdf/OS_PIRATA-FR31_SND.nc', plots.DEFAULT_DIMS, ['BATH', 'SOG'],
+                            'SND', plots.DEFAULT_COLORS, '', tmpdir)
+            with mock.patch.object(p, 'plot'):
+                p.timeseries(chunk=10000)
+            for ax, key in zip(p.fig.axes, ('BATH', 'SOG')):
+                values = plots.read_float(p.nc.variables[key])
+                plotted = ax.lines[0].get_ydata()
+                self.assertLess(len(plotted), 5 * ax.bbox.width)
+                self.assertEqual(np.nanmax(plotted), np.nanmax(values))
+                self.assertEqual(np.nanmin(plotted), np.nanmin(values))
+            plots.plt.close(p.fig)
+
+            argv = ['netcdf/OS_PIRATA-FR31_MTO.nc', '-t', 'MTO', '--timeseries', '-k', 'ATMS',
+                    'WMSP', '--start', '2021-03-05', '--end', '2021-03-20', '-o', tmpdir]
+            self.assertEqual(plots.main(argv), 0)
+            self.assertTrue(Path(tmpdir, 'PIRATA-FR31-MTO-TIMESERIES-ATMS-WMSP.png').exists())
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                self.assertEqual(plots.main(argv), 0)
+            self.assertNotIn('Printing', out.getvalue())
+
+    def test_mmap_reader_reads_like_netcdf4(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # a record variable, a scaled one and a byte one holding its default fill value,
+            # as in files written by other tools
+            records = os.path.join(tmpdir, 'records.nc')
+            with Dataset(records, 'w', format='NETCDF3_CLASSIC') as nc:
+                nc.createDimension('TIME', None)
+                nc.createDimension('DEPTH', 3)
+                temp = nc.createVariable('TEMP', 'f4', ('TIME', 'DEPTH'), fill_value=-9.0)
+                count = nc.createVariable('COUNT', 'i2', ('TIME',))
+                count.scale_factor = 0.5
+                count.valid_max = np.int16(3)
+                flag = nc.createVariable('FLAG', 'i1', ('TIME',))
+                temp[0:4] = np.ma.masked_greater(np.arange(12.0).reshape(4, 3), 9)
+                count[:] = np.arange(4)
+                flag[:] = np.array([1, -127, 3, -127], dtype='i1')
+            hdf5 = os.path.join(tmpdir, 'hdf5.nc')
+            Dataset(hdf5, 'w').close()
+            self.assertNotIsInstance(plots.open_dataset(hdf5, 'mmap'), plots.ClassicDataset)
+
+            for path in ('netcdf/OS_PIRATA-FR31_XBT.nc', 'netcdf/OS_AMAZOMIX_TSG.nc', records):
+                with Dataset(path) as expected:
+                    nc = plots.open_dataset(path, 'mmap')
+                    self.assertIsInstance(nc, plots.ClassicDataset)
+                    self.assertEqual(plots.get_cycle_label(nc), plots.get_cycle_label(expected))
+                    for name, var in expected.variables.items():
+                        mine = nc.variables[name]
+                        self.assertEqual(mine.ncattrs(), var.ncattrs())
+                        for index in (np.s_[:], np.s_[[0, 2]]):
+                            np.testing.assert_array_equal(plots.read_float(mine, index),
+                                                          plots.read_float(var, index))
+                            np.testing.assert_array_equal(np.ma.getmaskarray(mine[index]),
+                                                          np.ma.getmaskarray(var[index]))
+                    nc.close()
+
+    def test_synthetic_datasets_are_read_like_the_sample_files(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ctd = os.path.join(tmpdir, 'OS_BENCH_CTD.nc')
+            tsg = os.path.join(tmpdir, 'OS_BENCH_TSG.nc')
+            make_ctd(ctd, profiles=30, levels=200, block=7)
+            make_tsg(tsg, samples=5000, block=999)
+            exit_code = plots.main([ctd, '-t', 'CTD', '-p', '-s', '-k', 'PRES', 'TEMP',
+                                    '-l', '1', '2', '--xaxis', 'LATITUDE',
+                                    '--yscale', '0', '100', '-o', tmpdir])
+
+            self.assertEqual(exit_code, 0)
+            self.assertTrue(Path(tmpdir, 'BENCH-00001_CTD.png').exists())
+            self.assertTrue(Path(tmpdir, 'BENCH-CTD-TEMP.png').exists())
+            with Dataset(tsg) as nc:
+                track = plots.TrackReader(nc, plots.DEFAULT_DIMS, ['SSPS', 'SSTP'])
+                data = next(track.chunks())
+                self.assertEqual(len(data['SSPS']), 5000)
+                self.assertTrue(np.isnan(data['SSPS']).any())
+
+    def test_jobs_returns_worker_errors_to_the_parent(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertRaises(KeyError):
+                plots.main([
+                    'netcdf/OS_PIRATA-FR31_XBT.nc',
+                    '-t', 'XBT',
+                    '-s',
+                    '-k', 'DEPTH', 'TEMP', 'MISSING',
+                    '-l', '18', '20',
+                    '--xaxis', 'LATITUDE',
+                    '--yscale', '0', '250',
+                    '-o', tmpdir,
+                    '--jobs', '2',
+                ])
+
+    def test_profile_store_indexes_rows_and_last_valid_levels(self):
+        with Dataset('netcdf/OS_AMAZOMIX_CTD.nc') as nc:
+            store = plots.ProfileStore(nc)
+            row = store.rows[301]
+            self.assertEqual(row, list(nc.variables['PROFILE'][:]).index(301))
+            pres = nc.variables['PRES'][row, :]
+            self.assertEqual(store.depth(['PRES', 'TEMP'], row), pres.count())
+            np.testing.assert_array_equal(store.read('TEMP', row),
+                                          nc.variables['TEMP'][row, :])
+            self.assertGreater(store.nbytes, 0)
+
+    def test_profile_store_reads_from_file_over_budget(self):
+        with Dataset('netcdf/OS_AMAZOMIX_CTD.nc') as nc:
+            store = plots.ProfileStore(nc, budget=0)
+            self.assertFalse(store.load('TEMP'))
+            self.assertEqual(store.nbytes, 0)
+            np.testing.assert_array_equal(store.read('TEMP', 3),
+                                          nc.variables['TEMP'][3, :])
+
+    def test_track_reader_chunks_match_a_single_read_within_the_window(self):
+        with Dataset('netcdf/OS_AMAZOMIX_TSG.nc') as nc:
+            time = nc.variables['TIME'][:]
+            start, end = time[100], time[5000]
+            whole = plots.TrackReader(nc, plots.DEFAULT_DIMS, ['SSPS', 'SSTP'], start, end)
+            chunked = plots.TrackReader(nc, plots.DEFAULT_DIMS, ['SSPS', 'SSTP'], start, end,
+                                        chunk=997)
+            data = next(whole.chunks())
+            self.assertEqual(len(data['SSPS']), 4901)
+            for key in ('LONGITUDE', 'SSPS'):
+                np.testing.assert_array_equal(
+                    np.concatenate([c[key] for c in chunked.chunks()]), data[key])
+            self.assertEqual(chunked.extent(), whole.extent())
+            lon = nc.variables['LONGITUDE'][100:5001]
+            self.assertEqual(whole.extent()[:2], [lon.min(), lon.max()])
+
+    def test_main_generates_profile_figure_from_store(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            exit_code = plots.main([
+                'netcdf/OS_AMAZOMIX_CTD.nc',
+                '-t', 'CTD',
+                '-p',
+                '-k', 'PRES', 'TEMP', 'FLU2',
+                '-l', '301', '301',
+                '-o', tmpdir,
+                '--store',
+            ])
+
+            self.assertEqual(exit_code, 0)
+            self.assertTrue(Path(tmpdir, 'AMAZOMIX-00301_CTD.png').exists())
+
+    def test_template_mode_renders_the_same_images(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for out, extra in (('plain', []), ('template', ['--template'])):
+                exit_code = plots.main([
+                    'netcdf/OS_PIRATA-FR31_XBT.nc',
+                    '-t', 'XBT',
+                    '-p',
+                    '-k', 'DEPTH', 'TEMP', 'SVEL',
+                    '-l', '1', '3',
+                    '-g',
+                    '-o', str(Path(tmpdir, out)),
+                ] + extra)
+                self.assertEqual(exit_code, 0)
+
+            for profile in (1, 2, 3):
+                name = 'PIRATA-FR31-{:05d}_XBT.png'.format(profile)
+                self.assertEqual(Path(tmpdir, 'plain', name).read_bytes(),
+                                 Path(tmpdir, 'template', name).read_bytes())
+
+    def test_async_writer_renders_the_same_images(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for out, extra in (('plain', []), ('async', ['--async-write', '--template'])):
+                exit_code = plots.main([
+                    'netcdf/OS_PIRATA-FR31_XBT.nc',
+                    '-t', 'XBT',
+                    '-p',
+                    '-k', 'DEPTH', 'TEMP',
+                    '-l', '1', '3',
+                    '--dpi', '60',
+                    '--png-compression', '1',
+                    '-o', str(Path(tmpdir, out)),
+                ] + extra)
+                self.assertEqual(exit_code, 0)
+
+            for profile in (1, 2, 3):
+                name = 'PIRATA-FR31-{:05d}_XBT.png'.format(profile)
+                self.assertEqual(Path(tmpdir, 'plain', name).read_bytes(),
+                                 Path(tmpdir, 'async', name).read_bytes())
+
+    def test_vector_sections_embed_rasterized_contour_fills(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            exit_code = plots.main([
+                'netcdf/OS_PIRATA-FR31_XBT.nc',
+                '-t', 'XBT',
+                '-s',
+                '-k', 'DEPTH', 'TEMP',
+                '--xaxis', 'LATITUDE',
+                '-l', '18', '20',
+                '--format', 'svg',
+                '-o', tmpdir,
+            ])
+
+            self.assertEqual(exit_code, 0)
+            svg = Path(tmpdir, 'PIRATA-FR31-XBT-TEMP.svg').read_text()
+            self.assertIn('<image', svg)
+
+    def test_render_cache_only_rerenders_profiles_whose_data_changed(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            data = str(Path(tmpdir, 'OS_AMAZOMIX_XBT.nc'))
+            shutil.copy('netcdf/OS_AMAZOMIX_XBT.nc', data)
+            argv = [data, '-t', 'XBT', '-p', '-k', 'DEPTH', 'TEMP',
+                    '-l', '1', '3', '-o', tmpdir]
+
+            def printed():
+                out = io.StringIO()
+                with contextlib.redirect_stdout(out):
+                    self.assertEqual(plots.main(argv), 0)
+                return sorted(Path(line.split()[-1]).name
+                              for line in out.getvalue().splitlines()
+                              if line.startswith('Printing'))
+
+            self.assertEqual(len(printed()), 3)
+            self.assertEqual(printed(), [])
+            with Dataset(data, mode='a') as nc:
+                nc.variables['TEMP'][1, 0] = nc.variables['TEMP'][1, 0] + 1
+            self.assertEqual(printed(), ['AMAZOMIX-00002_XBT.png'])
+            Path(tmpdir, 'AMAZOMIX-00003_XBT.png').unlink()
+            self.assertEqual(printed(), ['AMAZOMIX-00003_XBT.png'])